@@ -1,15 +1,20 @@
+import os
 import pygame
-import random
 import sys
-from enum import Enum
+import time
+from collections import OrderedDict
 
-# initialize pygame
-pygame.init()
+from force_grey_engine import EFFECTS, EFFECT_SLOTS, FixedStep, TurnScheduler, MagicAttackMode, PlayerAction, Player, Game
+from force_grey_mcts import MCTSAgent
+import force_grey_damage
+from force_grey_fonts import GlyphAtlas, LazyFont
+import force_grey_replay
+import force_grey_save
+import force_grey_metrics
 
-# set the game screen
+# the game screen size, the window itself is only opened by init_display() when main() runs
 WIDTH, HEIGHT = 1100, 700
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Force_Grey")
+screen = None
 
 # define colors
 WHITE = (255, 255, 255)
@@ -23,365 +28,136 @@ ORANGE = (255, 165, 0)
 YELLOW = (255, 255, 0)
 BROWN = (165, 42, 42)
 
-# type of words
-font_large = pygame.font.SysFont('simhei', 36)
-font_medium = pygame.font.SysFont('simhei', 28)
-font_small = pygame.font.SysFont('simhei', 22)
-font_tiny = pygame.font.SysFont('simhei', 18)
-
-# II-magic
-class MagicType(Enum):
-    FIRE = 1      # burn
-    BREAK = 2     # rupture
-    SHOCK = 3     # tremor
-
-# I-magic
-class MagicAttackMode(Enum):
-    NORMAL = 1    # normal attack
-    DOUBLE = 2    # double attack
-    CHARGE = 3    # charge attack
-
-# state
-class StatusEffect:
-    def __init__(self, name, duration=0, stacks=0):
-        self.name = name
-        self.duration = duration  # state duration, 0 means forever-lasting until it triggered
-        self.stacks = stacks      # state stacks
-    
-    def __str__(self):
-        return f"{self.name}({self.stacks})"
-
-class Character:
-    def __init__(self, name, max_hp, attack, defense, magic_power, physical_resistance=1.0, magic_resistance=1.0):
-        self.name = name
-        self.max_hp = max_hp
-        self.hp = max_hp
-        self.attack = attack
-        self.defense = defense
-        self.magic_power = magic_power
-        self.physical_resistance = physical_resistance  # physical damage multiplier
-        self.magic_resistance = magic_resistance        # magical damage multiplier
-        self.alive = True
-        self.status_effects = {}  # dictionary of all state
-        self.stunned = False      # is shocked or not
-    
-    def take_damage(self, damage, damage_type="physical"):
-        # applying damage based on different damage multiplier
-        resistance = self.physical_resistance if damage_type == "physical" else self.magic_resistance
-        actual_damage = max(1, int((damage - self.defense) * resistance))
-        self.hp -= actual_damage
-        if self.hp <= 0:
-            self.hp = 0
-            self.alive = False
-        return actual_damage
-    
-    def heal(self, amount):
-        heal_amount = min(self.max_hp - self.hp, amount)
-        self.hp += heal_amount
-        return heal_amount
-    
-    def is_alive(self):
-        return self.alive
-    
-    def add_status_effect(self, effect_name, duration=0, stacks=1):
-        if effect_name in self.status_effects:
-            self.status_effects[effect_name].stacks += stacks
-            if duration > 0:
-                self.status_effects[effect_name].duration = max(
-                    self.status_effects[effect_name].duration, duration
-                )
-        else:
-            self.status_effects[effect_name] = StatusEffect(effect_name, duration, stacks)
-    
-    def remove_status_effect(self, effect_name, stacks=1):
-        if effect_name in self.status_effects:
-            self.status_effects[effect_name].stacks -= stacks
-            if self.status_effects[effect_name].stacks <= 0:
-                del self.status_effects[effect_name]
-                return True
-        return False
-    
-    def process_status_effects(self):
-        effects_log = []
-        damage_taken = 0
-        
-        # dealing with burn state
-        if "burn" in self.status_effects:
-            burn_stacks = self.status_effects["burn"].stacks
-            burn_damage = int(self.max_hp * (burn_stacks * 0.01))
-            self.hp -= burn_damage
-            damage_taken += burn_damage
-            # burn state stacks(s) - 1
-            self.remove_status_effect("burn", 1)
-            effects_log.append(f"{self.name}affected by the burn，lost{burn_damage}heal points")
-            
-            if self.hp <= 0:
-                self.hp = 0
-                self.alive = False
-        
-        # dealing with state duration
-        effects_to_remove = []
-        for effect_name, effect in self.status_effects.items():
-            if effect.duration > 0:
-                effect.duration -= 1
-                if effect.duration <= 0:
-                    effects_to_remove.append(effect_name)
-        
-        for effect_name in effects_to_remove:
-            del self.status_effects[effect_name]
-            effects_log.append(f"{self.name}'s{effect_name}ends.")
-        
-        return effects_log, damage_taken
-    
-    def apply_break_effect(self, damage):
-        # rupture: every time when getting attcked, lost 1 rupture stack and increase this attack damage based on the rupture state stacks
-        if "break" in self.status_effects:
-            break_stacks = self.status_effects["break"].stacks
-            bonus_damage = break_stacks
-            self.remove_status_effect("break", 1)
-            return damage + bonus_damage
-        return damage
-    
-    def apply_shock_effect(self, damage, attack_count):
-        # tremor: every time when getting attacked, the stack of tremor buff increase 1 
-        if "shock" in self.status_effects:
-            self.status_effects["shock"].stacks += 1
-            # if the stack of tremor buff equal or over 10, the enemy get shocked, next turn it can not do any action and will get double damage
-            if self.status_effects["shock"].stacks >= 10:
-                self.stunned = True
-                return damage * 2
-        else:
-            self.add_status_effect("shock", 0, 1)
-        return damage
-
-class Player(Character):
-    def __init__(self):
-        super().__init__("Element Master", 120, 15, 5, 25)
-        self.magic_points = 60
-        self.max_magic_points = 60
-        self.charging = False  # is charging or not
-        self.charge_turn = 0   # rest of the charging turn
-        self.magic_attack_mode = MagicAttackMode.NORMAL  # default magical attack mode
-    
-    def use_magic(self, cost):
-        if self.magic_points >= cost:
-            self.magic_points -= cost
-            return True
-        return False
-    
-    def restore_magic(self, amount):
-        self.magic_points = min(self.max_magic_points, self.magic_points + amount)
-
-class Enemy(Character):
-    def __init__(self, name, max_hp, attack, defense, magic_power, physical_resistance=1.0, magic_resistance=1.0):
-        super().__init__(name, max_hp, attack, defense, magic_power, physical_resistance, magic_resistance)
-
-class Game:
-    def __init__(self):
-        self.player = Player()
-        # create enemies, each enemy has their own damage multiplier
-        self.enemies = [
-            Enemy("Goblin", 40, 10, 2, 5, 1.2, 0.8),  # high physical multiplier but low magical multiplier
-            Enemy("Orc", 70, 15, 5, 8, 0.8, 1.2),    # low physical multiplier but high magical multiplier
-            Enemy("Dragon", 150, 25, 10, 15, 0.7, 0.7)  # both magical and physical multiplier are low but has high heal points
-        ]
-        self.current_enemy = None
-        self.game_state = "start"  # start, battle, player_turn, enemy_turn, victory, defeat
-        self.message = ""
-        self.battle_log = []
-        self.enemy_index = 0
-        self.attack_count = 0  # for the count of tremor buff
-        self.new_enemy()
-    
-    def new_enemy(self):
-        if self.enemy_index < len(self.enemies):
-            self.current_enemy = self.enemies[self.enemy_index]
-            self.enemy_index += 1
-            self.game_state = "battle"
-            self.add_message(f"fall in battle with {self.current_enemy.name}！")
-            self.add_message(f"{self.current_enemy.name}'s physical multiplier:{self.current_enemy.physical_resistance}, magical multiplier:{self.current_enemy.magic_resistance}")
-        else:
-            self.game_state = "victory"
-    
-    def player_attack(self):
-        damage = self.player.attack + random.randint(-3, 3)
-        
-        # applying rupture buff
-        damage = self.current_enemy.apply_break_effect(damage)
-        
-        # applying tremor buff
-        self.attack_count += 1
-        damage = self.current_enemy.apply_shock_effect(damage, self.attack_count)
-        
-        actual_damage = self.current_enemy.take_damage(damage, "physical")
-        self.add_message(f"You dealt {actual_damage} points of physical damage to {self.current_enemy.name}！")
-        
-        # check the buff
-        if "break" in self.current_enemy.status_effects:
-            self.add_message(f"{self.current_enemy.name}'s rupture buff decrease 1 stack!")
-        
-        if not self.current_enemy.is_alive():
-            self.add_message(f"you have beat {self.current_enemy.name}！")
-            self.player.restore_magic(15)
-            self.game_state = "enemy_defeated"
-        else:
-            self.game_state = "enemy_turn"
-    
-    def player_magic_attack(self, magic_type=None):
-        if magic_type is None:
-            magic_type = self.player.magic_attack_mode
-        
-        if magic_type == MagicAttackMode.NORMAL:
-            self._normal_magic_attack()
-        elif magic_type == MagicAttackMode.DOUBLE:
-            self._double_magic_attack()
-        elif magic_type == MagicAttackMode.CHARGE:
-            self._charge_magic_attack()
-    
-    def _normal_magic_attack(self):
-        if self.player.use_magic(10):
-            damage = self.player.magic_power + random.randint(5, 10)
-            actual_damage = self.current_enemy.take_damage(damage, "magic")
-            self.add_message(f"You dealt {actual_damage} points of magical damage to {self.current_enemy.name}！")
-            
-            if not self.current_enemy.is_alive():
-                self.add_message(f"you have beat {self.current_enemy.name}！")
-                self.player.restore_magic(15)
-                self.game_state = "enemy_defeated"
-            else:
-                self.game_state = "enemy_turn"
-        else:
-            self.add_message("No enough mana！")
-            self.game_state = "player_turn"
-    
-    def _double_magic_attack(self):
-        if self.player.use_magic(15):
-            total_damage = 0
-            for i in range(2):
-                damage = int((self.player.magic_power + random.randint(3, 7)) * 0.4)
-                actual_damage = self.current_enemy.take_damage(damage, "magic")
-                total_damage += actual_damage
-                self.add_message(f"Your magic attack {i+1} dealt {actual_damage} points of magical damage！")
-            
-            self.add_message(f"The double magic dealt total damage: {total_damage}！")
-            
-            if not self.current_enemy.is_alive():
-                self.add_message(f"you have beat {self.current_enemy.name}！")
-                self.player.restore_magic(15)
-                self.game_state = "enemy_defeated"
-            else:
-                self.game_state = "enemy_turn"
-        else:
-            self.add_message("No enough mana！")
-            self.game_state = "player_turn"
-    
-    def _charge_magic_attack(self):
-        if self.player.charging:
-            # charging ends, deal powerful attack
-            damage = int((self.player.magic_power + random.randint(10, 15)) * 3.0)
-            actual_damage = self.current_enemy.take_damage(damage, "magic")
-            self.add_message(f"Charging ends！you dealt {actual_damage} points of magical damage to {self.current_enemy.name}！")
-            self.player.charging = False
-            self.player.charge_turn = 0
-            
-            if not self.current_enemy.is_alive():
-                self.add_message(f"you have beat {self.current_enemy.name}！")
-                self.player.restore_magic(15)
-                self.game_state = "enemy_defeated"
-            else:
-                self.game_state = "enemy_turn"
-        else:
-            # start to charge
-            if self.player.use_magic(20):
-                self.player.charging = True
-                self.player.charge_turn = 1
-                self.add_message("Start to charge, the charge is going to ends at next turn！")
-                self.game_state = "enemy_turn"
-            else:
-                self.add_message("No enough mana！")
-                self.game_state = "player_turn"
-    
-    def apply_magic_effect(self, magic_type):
-        cost = 12
-        if self.player.use_magic(cost):
-            if magic_type == MagicType.FIRE:
-                self.current_enemy.add_status_effect("burn", 0, 2)
-                self.add_message(f"You dealt (2) Burn to {self.current_enemy.name}！")
-            elif magic_type == MagicType.BREAK:
-                self.current_enemy.add_status_effect("break", 0, 10)
-                self.add_message(f"You dealt (10) Rupture to {self.current_enemy.name}！")
-            elif magic_type == MagicType.SHOCK:
-                self.current_enemy.add_status_effect("shock", 0, 1)
-                self.add_message(f"You dealt (1) Tremor to {self.current_enemy.name}！")
-            
-            self.game_state = "enemy_turn"
-        else:
-            self.add_message("No enough mana！")
-            self.game_state = "player_turn"
-    
-    def player_heal(self):
-        if self.player.use_magic(15):
-            heal_amount = self.player.heal(30 + random.randint(5, 15))
-            self.add_message(f"You heal yourself {heal_amount} points of heal points！")
-            self.game_state = "enemy_turn"
-        else:
-            self.add_message("No enough mana！")
-            self.game_state = "player_turn"
-    
-    def enemy_attack(self):
-        # check enemy is shocked or not
-        if self.current_enemy.stunned:
-            self.add_message(f"{self.current_enemy.name} is shocked, can't move this turn！")
-            self.current_enemy.stunned = False
-            if "shock" in self.current_enemy.status_effects:
-                self.current_enemy.remove_status_effect("shock")  # if shock triggered, remove the buff of tremor
-            self.game_state = "player_turn"
-            return
-        
-        damage = self.current_enemy.attack + random.randint(-2, 2)
-        actual_damage = self.player.take_damage(damage, "physical")
-        self.add_message(f"{self.current_enemy.name} dealt {actual_damage} points of physical damage to you！")
-        
-        if not self.player.is_alive():
-            self.game_state = "defeat"
-        else:
-            self.game_state = "player_turn"
-    
-    def add_message(self, msg):
-        self.battle_log.append(msg)
-        if len(self.battle_log) > 8:
-            self.battle_log.pop(0)
-    
-    def update(self):
-        if self.game_state == "enemy_turn":
-            # dealing with the enemy's state
-            effects_log, damage_taken = self.current_enemy.process_status_effects()
-            for log in effects_log:
-                self.add_message(log)
-            
-            if damage_taken > 0 and not self.current_enemy.is_alive():
-                self.add_message(f"{self.current_enemy.name} is bitten down due to the negative buff！")
-                self.player.restore_magic(15)
-                self.game_state = "enemy_defeated"
-                return
-            
-            pygame.time.delay(1000)
-            self.enemy_attack()
-        elif self.game_state == "enemy_defeated":
-            pygame.time.delay(1500)
-            self.new_enemy()
-            self.attack_count = 0  # reset the attack count
+# the last game played is kept here as a replay, so a bug can be reproduced with force_grey_replay.py
+REPLAY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "last_game.fgr")
+# the run in progress, saved after every turn and picked up again at the next start
+SAVE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "autosave.fgs")
+
+# what the magic button does in each magic attack mode
+MODE_ACTIONS = {
+    MagicAttackMode.NORMAL: PlayerAction.NORMAL,
+    MagicAttackMode.DOUBLE: PlayerAction.DOUBLE,
+    MagicAttackMode.CHARGE: PlayerAction.CHARGE,
+}
+
+# button names used by the hint
+HINT_LABELS = {
+    PlayerAction.ATTACK: "physical ATK",
+    PlayerAction.NORMAL: "normal magical ATK",
+    PlayerAction.DOUBLE: "double magical ATK",
+    PlayerAction.CHARGE: "charging",
+    PlayerAction.BURN: "BURN",
+    PlayerAction.RUPTURE: "RUPTURE",
+    PlayerAction.TREMOR: "TREMOR",
+    PlayerAction.HEAL: "healing",
+}
+HINT_BUDGET = 0.2  # seconds the hint may think
+
+# the loop runs the simulation in fixed ticks and draws only when something can have changed. while the game just
+# waits for a click it sleeps in pygame.event.wait() and uses no cpu. FORCE_GREY_FPS caps the frame rate the rest of
+# the time, FORCE_GREY_IDLE_FPS=n wakes up n times a second when idle instead of sleeping until there is input,
+# FORCE_GREY_PACING=busy paces frames with a busy loop, steadier than sleeping but it keeps a core busy
+SIM_STEP = 1 / 60  # seconds of one simulation tick
+FPS = int(os.environ.get("FORCE_GREY_FPS", 60))
+IDLE_FPS = int(os.environ.get("FORCE_GREY_IDLE_FPS", 0))
+BUSY_PACING = os.environ.get("FORCE_GREY_PACING") == "busy"
+
+# the action of the button under the mouse, main() sets it every frame and draw_preview() shows its numbers
+hover_action = None
+
+# type of words, a font file is only opened when the first text that is not in the atlas is drawn with it
+font_large = LazyFont(36)
+font_medium = LazyFont(28)
+font_small = LazyFont(22)
+font_tiny = LazyFont(18)
+
+# the strings that never change, kept rendered in force_grey_atlas.png (see force_grey_fonts.py)
+ATLAS_STRINGS = [
+    (font_large, "Force_Grey", GOLD),
+    (font_large, "congratulations！you win！", GOLD),
+    (font_large, "YOU DIED...", RED),
+    (font_medium, "Click to start...", WHITE),
+    (font_medium, "click to restart", WHITE),
+    (font_medium, "your turn，choose your action", GOLD),
+    (font_medium, "charging... click magic attack to deal powerful attack! ", GOLD),
+    (font_medium, "enemy's turn...", RED),
+    (font_medium, Player().name, WHITE),
+    (font_small, "Use your power to clear the dunguen！", GREEN),
+    (font_small, "waiting for new version...", WHITE),
+    (font_small, "Battle Log:", GOLD),
+    (font_small, "hint", BLACK),
+] + [(font_small, label, WHITE) for label in ("physical ATK", "magical ATK", "charging ATK", "magic effect", "healing",
+                                              "normal", "double", "charging", "BURN", "RUPTURE", "TREMOR")] + [
+    (font_tiny, "magic buff:", WHITE),
+]
+glyph_atlas = GlyphAtlas()
+
+def init_display():
+    # open the window and load the atlas, only the parts of pygame the game uses are started
+    global screen
+    pygame.display.init()
+    pygame.font.init()
+    for font in (font_large, font_medium, font_small, font_tiny):
+        font.font = None  # a Font of an earlier pygame session can't be used again
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Force_Grey")
+    glyph_atlas.load_or_build(ATLAS_STRINGS)
+
+class SurfaceCache:
+    # least recently used cache of rendered surfaces, rendering text is the slowest thing a frame does
+    def __init__(self, size=512):
+        self.size = size  # 0 turns the cache off
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = build()
+        if self.size:
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.size:
+                self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+
+surface_cache = SurfaceCache()
+
+def _render(font, text, color):
+    surface = glyph_atlas.get(font, text, color)
+    return font.render(text, True, color) if surface is None else surface
+
+def render_text(font, text, color):
+    return surface_cache.get((font, text, color), lambda: _render(font, text, color))
+
+def _button_surface(width, height, color, text, text_color):
+    # the whole button on a transparent surface, built once per look
+    button = pygame.Surface((width, height), pygame.SRCALPHA)
+    pygame.draw.rect(button, color, (0, 0, width, height), border_radius=10)
+    pygame.draw.rect(button, BLACK, (0, 0, width, height), 2, border_radius=10)
+    text_surf = render_text(font_small, text, text_color)
+    button.blit(text_surf, text_surf.get_rect(center=(width/2, height/2)))
+    return button
+
+def _panel_surface(width, height):
+    panel = pygame.Surface((width, height), pygame.SRCALPHA)
+    pygame.draw.rect(panel, (20, 20, 40), (0, 0, width, height), border_radius=10)
+    pygame.draw.rect(panel, BLUE, (0, 0, width, height), 2, border_radius=10)
+    return panel
 
 def draw_button(surface, x, y, width, height, color, text, text_color=WHITE, enabled=True):
     if not enabled:
         color = (color[0]//2, color[1]//2, color[2]//2)
     
-    pygame.draw.rect(surface, color, (x, y, width, height), border_radius=10)
-    pygame.draw.rect(surface, BLACK, (x, y, width, height), 2, border_radius=10)
-    
-    text_surf = font_small.render(text, True, text_color)
-    text_rect = text_surf.get_rect(center=(x + width/2, y + height/2))
-    surface.blit(text_surf, text_rect)
+    key = ("button", width, height, color, text, text_color)
+    surface.blit(surface_cache.get(key, lambda: _button_surface(width, height, color, text, text_color)), (x, y))
     
     return pygame.Rect(x, y, width, height)
 
@@ -398,35 +174,250 @@ def draw_magic_bar(surface, x, y, width, height, current, maximum):
     pygame.draw.rect(surface, BLUE, (x, y, width * ratio, height), border_radius=5)
 
 def draw_status_effects(surface, x, y, character):
-    if not character.status_effects:
+    effects = character.status_effects
+    if not effects:
         return
     
-    title_text = font_tiny.render("magic buff:", True, WHITE)            #  hfajfhioagu
+    title_text = render_text(font_tiny, "magic buff:", WHITE)
     surface.blit(title_text, (x, y))
     
     y_offset = 25
-    for effect_name, effect in character.status_effects.items():
-        color = WHITE
-        if effect_name == "burn":
-            color = RED
-        elif effect_name == "break":
-            color = ORANGE
-        elif effect_name == "shock":
-            color = YELLOW
-            
-        effect_text = font_tiny.render(f"{effect_name}: {effect.stacks} stack(s)", True, color)
+    for effect_name, effect in effects.items():
+        # every effect type has its own color in the registry
+        color = EFFECTS[EFFECT_SLOTS[effect_name]].color
+        effect_text = render_text(font_tiny, f"{effect_name}: {effect.stacks} stack(s)", color)
         surface.blit(effect_text, (x, y + y_offset))
         y_offset += 20
 
+def _effect_key(character):
+    return tuple(character.effect_stacks)
+
+def _enemy_key(enemy):
+    return (enemy.hp, _effect_key(enemy)) if enemy else None
+
+def _blit_centered(surface, text_surf, y):
+    surface.blit(text_surf, (WIDTH//2 - text_surf.get_width()//2, y))
+
+# every part of the screen is a region: an area, a key that changes when the area has to be redrawn
+# and the function drawing it. regions are drawn in this order, later ones on top of earlier ones
+def draw_page(surface, game):
+    # the game start page
+    if game.game_state != "start":
+        return
+    _blit_centered(surface, render_text(font_large, "Force_Grey", GOLD), 150)
+    _blit_centered(surface, render_text(font_medium, "Click to start...", WHITE), 250)
+    _blit_centered(surface, render_text(font_small, "Use your power to clear the dunguen！", GREEN), 320)
+    
+    features_text = [
+        'waiting for new version...'
+    ]
+    
+    for i, text in enumerate(features_text):
+        _blit_centered(surface, render_text(font_small, text, WHITE), 370 + i * 30)
+
+def draw_player_panel(surface, game):
+    if game.game_state == "start":
+        return
+    player = game.player
+    surface.blit(render_text(font_medium, player.name, WHITE), (100, 50))
+    
+    draw_health_bar(surface, 100, 90, 250, 20, player.hp, player.max_hp, GREEN)
+    surface.blit(render_text(font_small, f"HP: {player.hp}/{player.max_hp}", WHITE), (360, 90))
+    
+    draw_magic_bar(surface, 100, 120, 250, 15, player.magic_points, player.max_magic_points)
+    surface.blit(render_text(font_small, f"MP: {player.magic_points}/{player.max_magic_points}", WHITE), (360, 120))
+    
+    # draw player's state
+    draw_status_effects(surface, 100, 150, player)
+
+def draw_enemy_panel(surface, game):
+    enemy = game.current_enemy
+    if game.game_state == "start" or not enemy:
+        return
+    surface.blit(render_text(font_medium, enemy.name, WHITE), (600, 50))
+    
+    draw_health_bar(surface, 600, 90, 250, 20, enemy.hp, enemy.max_hp, RED)
+    surface.blit(render_text(font_small, f"HP: {enemy.hp}/{enemy.max_hp}", WHITE), (860, 90))
+    
+    # show the multiplier of enemy
+    resist_text = render_text(
+        font_tiny,
+        f"physical multiplier: {enemy.physical_resistance} magical multiplier: {enemy.magic_resistance}",
+        YELLOW
+    )
+    surface.blit(resist_text, (600, 115))
+    
+    # draw enemy's state
+    draw_status_effects(surface, 600, 150, enemy)
+
+def draw_battle_log(surface, game):
+    if game.game_state == "start":
+        return
+    surface.blit(surface_cache.get(("panel", 800, 250), lambda: _panel_surface(800, 250)), (50, 200))
+    surface.blit(render_text(font_small, "Battle Log:", GOLD), (70, 210))
+    
+    for i, message in enumerate(game.battle_log):
+        surface.blit(render_text(font_small, message, WHITE), (70, 240 + i * 25))
+
+def draw_action_buttons(surface, game):
+    if game.game_state != "player_turn":
+        return
+    player = game.player
+    draw_button(surface, 50, 500, 150, 40, RED, "physical ATK")
+    
+    magic_text = "charging ATK" if player.charging else "magical ATK"
+    magic_color = PURPLE if player.charging else BLUE
+    draw_button(surface, 210, 500, 150, 40, magic_color, magic_text)
+    
+    draw_button(surface, 370, 500, 150, 40, GREEN, "magic effect")
+    draw_button(surface, 530, 500, 150, 40, GREEN, "healing")
+    draw_button(surface, 690, 500, 150, 40, GOLD, "hint", BLACK)
+    
+    # draw the bottom of magic mode selection
+    mode_normal_color = GOLD if player.magic_attack_mode == MagicAttackMode.NORMAL else BLUE
+    mode_double_color = GOLD if player.magic_attack_mode == MagicAttackMode.DOUBLE else BLUE
+    mode_charge_color = GOLD if player.magic_attack_mode == MagicAttackMode.CHARGE else BLUE
+    
+    draw_button(surface, 50, 550, 120, 30, mode_normal_color, "normal")
+    draw_button(surface, 180, 550, 120, 30, mode_double_color, "double")
+    draw_button(surface, 310, 550, 120, 30, mode_charge_color, "charging")
+    
+    # draw the bottom of magic type selection
+    draw_button(surface, 50, 590, 120, 30, RED, "BURN")
+    draw_button(surface, 180, 590, 120, 30, GREEN, "RUPTURE")
+    draw_button(surface, 310, 590, 120, 30, ORANGE, "TREMOR")
+
+def draw_preview(surface, game):
+    # expected damage and kill chance of the hovered button, straight from the damage tables
+    if game.game_state != "player_turn" or hover_action is None:
+        return
+    label = HINT_LABELS[hover_action]
+    if hover_action is PlayerAction.HEAL:
+        text, color = f"{label}: +{force_grey_damage.expected_heal(game):.1f} hp expected", GREEN
+    elif hover_action is PlayerAction.CHARGE and not game.player.charging:
+        table = force_grey_damage.action_table(game, hover_action)
+        text, color = f"{label}: starts now, the release {table.mean:.1f} dmg ({table.low}-{table.high})", WHITE
+    else:
+        table = force_grey_damage.action_table(game, hover_action)
+        kill = table.kill_chance(game.current_enemy.hp)
+        text = f"{label}: {table.mean:.1f} dmg ({table.low}-{table.high}), {kill:.0%} to kill"
+        color = GOLD if kill > 0 else WHITE
+    surface.blit(render_text(font_tiny, text, color), (450, 555))
+
+def draw_turn_status(surface, game):
+    # show current state
+    if game.game_state == "player_turn":
+        if game.player.charging:
+            status_text = render_text(font_medium, "charging... click magic attack to deal powerful attack! ", GOLD)
+        else:
+            status_text = render_text(font_medium, "your turn，choose your action", GOLD)
+        _blit_centered(surface, status_text, 650)
+    elif game.game_state == "enemy_turn":
+        _blit_centered(surface, render_text(font_medium, "enemy's turn...", RED), 650)
+
+def draw_result(surface, game):
+    if game.game_state == "victory":
+        _blit_centered(surface, render_text(font_large, "congratulations！you win！", GOLD), 350)
+    elif game.game_state == "defeat":
+        _blit_centered(surface, render_text(font_large, "YOU DIED...", RED), 350)
+    else:
+        return
+    _blit_centered(surface, render_text(font_medium, "click to restart", WHITE), 420)
+
+REGIONS = [
+    ((0, 0, WIDTH, HEIGHT), lambda game: game.game_state == "start", draw_page),
+    ((90, 40, 480, 200), lambda game: (game.game_state == "start", game.player.hp, game.player.magic_points,
+                                       _effect_key(game.player)), draw_player_panel),
+    ((590, 40, WIDTH - 590, 200), lambda game: (game.game_state == "start", game.enemy_index,
+                                                _enemy_key(game.current_enemy)), draw_enemy_panel),
+    ((50, 200, WIDTH - 50, 250), lambda game: (game.game_state == "start", tuple(game.log_events)), draw_battle_log),
+    ((50, 500, 800, 120), lambda game: (game.game_state == "player_turn", game.player.charging,
+                                        game.player.magic_attack_mode), draw_action_buttons),
+    ((450, 550, 600, 30), lambda game: (game.game_state == "player_turn", hover_action, game.player.charging,
+                                        game.player.magic_power, _enemy_key(game.current_enemy)), draw_preview),
+    ((0, 645, WIDTH, 45), lambda game: (game.game_state, game.player.charging), draw_turn_status),
+    ((0, 340, WIDTH, 120), lambda game: game.game_state in ("victory", "defeat"), draw_result),
+]
+
+class DirtyRenderer:
+    # redraws only the regions whose key changed since the last frame and returns the rects to push
+    # with pygame.display.update(). the first frame, or one after invalidate(), draws everything
+    def __init__(self, surface, regions=REGIONS, background=(30, 30, 50)):
+        self.surface = surface
+        self.regions = [(pygame.Rect(rect), key, draw) for rect, key, draw in regions]
+        self.background = background
+        self.keys = [None] * len(self.regions)
+
+    def invalidate(self):
+        self.keys = [None] * len(self.regions)
+
+    def draw(self, game):
+        dirty = []
+        for index, (rect, key, draw) in enumerate(self.regions):
+            value = key(game)
+            if value != self.keys[index]:
+                self.keys[index] = value
+                dirty.append(rect)
+        for area in dirty:
+            # everything that overlaps the area is drawn again, clipped to it, so the layering stays right
+            self.surface.set_clip(area)
+            self.surface.fill(self.background)
+            for rect, key, draw in self.regions:
+                if rect.colliderect(area):
+                    draw(self.surface, game)
+        self.surface.set_clip(None)
+        return dirty
+
+def draw_frame(surface, game):
+    # the whole screen at once, like the first frame
+    surface.fill((30, 30, 50))
+    for rect, key, draw in REGIONS:
+        draw(surface, game)
+
+def write_save(save, game, path):
+    # a full disk or a read only directory costs the file, not the session being played
+    try:
+        save(game, path)
+    except OSError as error:
+        print(f"could not write {path}: {error}", file=sys.stderr)
+
+def load_autosave():
+    # the run left open last time, a new game if there is none, it is over or it can't be read
+    try:
+        game = force_grey_save.load(SAVE_PATH)
+        if game.game_state not in ("victory", "defeat"):
+            return game
+    except (OSError, ValueError):
+        pass
+    return Game()
+
 def main():
+    global hover_action
+    init_display()
     clock = pygame.time.Clock()
-    game = Game()
+    game = load_autosave()
+    saved = None  # (state, actions) of the last autosave
+    hint_agent = MCTSAgent(HINT_BUDGET)
+    renderer = DirtyRenderer(screen)
+    # the enemy's turn and the next enemy come after a pause so the player can read the log,
+    # without a real display (tests, recordings) there is nobody to wait for
+    if os.environ.get("SDL_VIDEODRIVER") == "dummy":
+        scheduler = TurnScheduler.headless()
+    else:
+        scheduler = TurnScheduler()
+    # the pauses count simulation ticks, not frames or wall time
+    stepper = FixedStep(SIM_STEP)
+    scheduler.clock = stepper.now
+    # FORCE_GREY_METRICS=path turns the counters on, they are written there on quit (.json or prometheus text)
+    metrics_path = os.environ.get("FORCE_GREY_METRICS")
+    metrics = force_grey_metrics.instrument(game, detail=True) if metrics_path else None
     
     # bottom area
     attack_button_rect = pygame.Rect(50, 500, 150, 40)
     magic_button_rect = pygame.Rect(210, 500, 150, 40)
     magic_effect_button_rect = pygame.Rect(370, 500, 150, 40)
     heal_button_rect = pygame.Rect(530, 500, 150, 40)
+    hint_button_rect = pygame.Rect(690, 500, 150, 40)
     
     # magical attack mode selecton bottom area
     magic_normal_rect = pygame.Rect(50, 550, 120, 30)
@@ -437,16 +428,42 @@ def main():
     fire_effect_rect = pygame.Rect(50, 590, 120, 30)
     break_effect_rect = pygame.Rect(180, 590, 120, 30)
     shock_effect_rect = pygame.Rect(310, 590, 120, 30)
+    
+    def hovered_action(pos):
+        # the action the preview is about, None away from the attack and heal buttons
+        if attack_button_rect.collidepoint(pos):
+            return PlayerAction.ATTACK
+        if magic_button_rect.collidepoint(pos):
+            return PlayerAction.CHARGE if game.player.charging else MODE_ACTIONS[game.player.magic_attack_mode]
+        if heal_button_rect.collidepoint(pos):
+            return PlayerAction.HEAL
+        for rect, mode in ((magic_normal_rect, MagicAttackMode.NORMAL), (magic_double_rect, MagicAttackMode.DOUBLE),
+                           (magic_charge_rect, MagicAttackMode.CHARGE)):
+            if rect.collidepoint(pos):
+                return MODE_ACTIONS[mode]
+        return None
 
     running = True
     while running:
-        screen.fill((30, 30, 50))
-        
+        events = pygame.event.get()
+        if not events and scheduler.scheduled is None and game.game_state not in scheduler.delays:
+            # idle: nothing moves until the player does something
+            events = [pygame.event.wait(1000 // IDLE_FPS if IDLE_FPS else 0)] + pygame.event.get()
+        elif not events and scheduler.events:
+            # the enemy's turn is queued, sleep until it is due or there is input
+            wait_start = stepper.clock()
+            events = [pygame.event.wait(max(1, int(scheduler.time_to_next() * 1000)))] + pygame.event.get()
+            stepper.waited(stepper.clock() - wait_start)
+        frame_start = time.perf_counter()
         # event execution
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
             
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                # the window was covered or restored, the regions that did not change are gone too
+                renderer.invalidate()
+            
             if event.type == pygame.MOUSEBUTTONDOWN:
                 mouse_pos = pygame.mouse.get_pos()
                 
@@ -454,15 +471,20 @@ def main():
                     game.game_state = "player_turn"
                 
                 elif game.game_state == "player_turn":
+                    # actions go through game.perform() so they end up in the replay
                     if attack_button_rect.collidepoint(mouse_pos):
-                        game.player_attack()
+                        game.perform(PlayerAction.ATTACK)
                     elif magic_button_rect.collidepoint(mouse_pos):
                         if game.player.charging:
-                            game.player_magic_attack(MagicAttackMode.CHARGE)
+                            game.perform(PlayerAction.CHARGE)
                         else:
-                            game.player_magic_attack()
+                            game.perform(MODE_ACTIONS[game.player.magic_attack_mode])
                     elif heal_button_rect.collidepoint(mouse_pos):
-                        game.player_heal()
+                        game.perform(PlayerAction.HEAL)
+                    elif hint_button_rect.collidepoint(mouse_pos):
+                        # ask the tree search what to do next
+                        action = hint_agent.choose(game)
+                        game.add_message(f"hint: try {HINT_LABELS[action]}")
                     elif magic_effect_button_rect.collidepoint(mouse_pos):
                         # select the magic type
                         pass
@@ -473,135 +495,52 @@ def main():
                     elif magic_charge_rect.collidepoint(mouse_pos):
                         game.player.magic_attack_mode = MagicAttackMode.CHARGE
                     elif fire_effect_rect.collidepoint(mouse_pos):
-                        game.apply_magic_effect(MagicType.FIRE)
+                        game.perform(PlayerAction.BURN)
                     elif break_effect_rect.collidepoint(mouse_pos):
-                        game.apply_magic_effect(MagicType.BREAK)
+                        game.perform(PlayerAction.RUPTURE)
                     elif shock_effect_rect.collidepoint(mouse_pos):
-                        game.apply_magic_effect(MagicType.SHOCK)
+                        game.perform(PlayerAction.TREMOR)
                 
                 elif game.game_state in ["victory", "defeat"]:
                     # restart the game
+                    write_save(force_grey_replay.save, game, REPLAY_PATH)
+                    scheduler.clear()
                     game = Game()
+                    if metrics:
+                        force_grey_metrics.instrument(game, metrics, detail=True)
         
-        # draw the game start page
-        if game.game_state == "start":
-            # stary page
-            title_text = font_large.render("Force_Grey", True, GOLD)
-            screen.blit(title_text, (WIDTH//2 - title_text.get_width()//2, 150))
-            
-            start_text = font_medium.render("Click to start...", True, WHITE)
-            screen.blit(start_text, (WIDTH//2 - start_text.get_width()//2, 250))
-            
-            instruction_text = font_small.render("Use your power to clear the dunguen！", True, GREEN)
-            screen.blit(instruction_text, (WIDTH//2 - instruction_text.get_width()//2, 320))
-            
-            features_text = [
-                'waiting for new version...'
-            ]
-            
-            for i, text in enumerate(features_text):
-                feature_text = font_small.render(text, True, WHITE)
-                screen.blit(feature_text, (WIDTH//2 - feature_text.get_width()//2, 370 + i * 30))
+        # the enemy's turn and the next enemy are timed events, run in whole ticks of simulation time
+        for _ in range(stepper.advance()):
+            stepper.tick()
+            scheduler.poll(game)
         
-        else:
-            # draw the info of player
-            player_text = font_medium.render(game.player.name, True, WHITE)
-            screen.blit(player_text, (100, 50))
-            
-            draw_health_bar(screen, 100, 90, 250, 20, game.player.hp, game.player.max_hp, GREEN)
-            hp_text = font_small.render(f"HP: {game.player.hp}/{game.player.max_hp}", True, WHITE)
-            screen.blit(hp_text, (360, 90))
-            
-            draw_magic_bar(screen, 100, 120, 250, 15, game.player.magic_points, game.player.max_magic_points)
-            mp_text = font_small.render(f"MP: {game.player.magic_points}/{game.player.max_magic_points}", True, WHITE)
-            screen.blit(mp_text, (360, 120))
-            
-            # draw player's state
-            draw_status_effects(screen, 100, 150, game.player)
-            
-            # draw the info of enemy
-            if game.current_enemy:
-                enemy_text = font_medium.render(game.current_enemy.name, True, WHITE)
-                screen.blit(enemy_text, (600, 50))
-                
-                draw_health_bar(screen, 600, 90, 250, 20, game.current_enemy.hp, game.current_enemy.max_hp, RED)
-                enemy_hp_text = font_small.render(f"HP: {game.current_enemy.hp}/{game.current_enemy.max_hp}", True, WHITE)
-                screen.blit(enemy_hp_text, (860, 90))
-                
-                # show the multiplier of enemy
-                resist_text = font_tiny.render(
-                    f"physical multiplier: {game.current_enemy.physical_resistance} magical multiplier: {game.current_enemy.magic_resistance}", 
-                    True, YELLOW
-                )
-                screen.blit(resist_text, (600, 115))
-                
-                # draw enemy's state
-                draw_status_effects(screen, 600, 150, game.current_enemy)
-            
-            # draw the battle log
-            log_bg = pygame.Rect(50, 200, 800, 250)
-            pygame.draw.rect(screen, (20, 20, 40), log_bg, border_radius=10)
-            pygame.draw.rect(screen, BLUE, log_bg, 2, border_radius=10)
-            
-            log_title = font_small.render("Battle Log:", True, GOLD)
-            screen.blit(log_title, (70, 210))
-            
-            for i, message in enumerate(game.battle_log):
-                log_text = font_small.render(message, True, WHITE)
-                screen.blit(log_text, (70, 240 + i * 25))
-            
-            # draw bottoms
-            if game.game_state == "player_turn":
-                attack_button = draw_button(screen, 50, 500, 150, 40, RED, "physical ATK")
-                
-                magic_text = "charging ATK" if game.player.charging else "magical ATK"
-                magic_color = PURPLE if game.player.charging else BLUE
-                magic_button = draw_button(screen, 210, 500, 150, 40, magic_color, magic_text)
-                
-                magic_effect_button = draw_button(screen, 370, 500, 150, 40, GREEN, "magic effect")
-                heal_button = draw_button(screen, 530, 500, 150, 40, GREEN, "healing")
-                
-                # draw the bottom of magic mode selection
-                mode_normal_color = GOLD if game.player.magic_attack_mode == MagicAttackMode.NORMAL else BLUE
-                mode_double_color = GOLD if game.player.magic_attack_mode == MagicAttackMode.DOUBLE else BLUE
-                mode_charge_color = GOLD if game.player.magic_attack_mode == MagicAttackMode.CHARGE else BLUE
-                
-                magic_normal = draw_button(screen, 50, 550, 120, 30, mode_normal_color, "normal")
-                magic_double = draw_button(screen, 180, 550, 120, 30, mode_double_color, "double")
-                magic_charge = draw_button(screen, 310, 550, 120, 30, mode_charge_color, "charging")
-                
-                # draw the bottom of magic type selection
-                fire_effect = draw_button(screen, 50, 590, 120, 30, RED, "BURN")
-                break_effect = draw_button(screen, 180, 590, 120, 30, GREEN, "RUPTURE")
-                shock_effect = draw_button(screen, 310, 590, 120, 30, ORANGE, "TREMOR")
-            
-            # show current state
-            if game.game_state == "player_turn":
-                if game.player.charging:
-                    status_text = font_medium.render("charging... click magic attack to deal powerful attack! ", True, GOLD)
-                else:
-                    status_text = font_medium.render("your turn，choose your action", True, GOLD)
-                screen.blit(status_text, (WIDTH//2 - status_text.get_width()//2, 650))
-            elif game.game_state == "enemy_turn":
-                status_text = font_medium.render("enemy's turn...", True, RED)
-                screen.blit(status_text, (WIDTH//2 - status_text.get_width()//2, 650))
-            elif game.game_state == "victory":
-                status_text = font_large.render("congratulations！you win！", True, GOLD)
-                screen.blit(status_text, (WIDTH//2 - status_text.get_width()//2, 350))
-                restart_text = font_medium.render("click to restart", True, WHITE)
-                screen.blit(restart_text, (WIDTH//2 - restart_text.get_width()//2, 420))
-            elif game.game_state == "defeat":
-                status_text = font_large.render("YOU DIED...", True, RED)
-                screen.blit(status_text, (WIDTH//2 - status_text.get_width()//2, 350))
-                restart_text = font_medium.render("click to restart", True, WHITE)
-                screen.blit(restart_text, (WIDTH//2 - restart_text.get_width()//2, 420))
+        hover_action = hovered_action(pygame.mouse.get_pos()) if game.game_state == "player_turn" else None
         
-        pygame.display.flip()
-        clock.tick(60)
+        # only the parts of the screen that changed are drawn and sent to the display
+        render_start = time.perf_counter()
+        dirty = renderer.draw(game)
+        if dirty:
+            pygame.display.update(dirty)
+        render_end = time.perf_counter()
+        if BUSY_PACING:
+            clock.tick_busy_loop(FPS)
+        else:
+            clock.tick(FPS)
+        tick_end = time.perf_counter()
         
-        # reset the game state
-        game.update()
+        if metrics:
+            # the wait in clock.tick() is not work
+            work = time.perf_counter() - frame_start - (tick_end - render_end)
+            metrics.observe_frame(game, work, render_end - render_start)
+        # autosave whenever the game moved on, a save is well under a millisecond
+        progress = (game.game_state, len(game.action_log))
+        if progress != saved:
+            write_save(force_grey_save.save, game, SAVE_PATH)
+            saved = progress  # not again before the next change, also when it failed
     
+    write_save(force_grey_replay.save, game, REPLAY_PATH)
+    if metrics:
+        metrics.save(metrics_path)
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,486 @@
+# benchmarks for the Force_Grey engine, simulator and screen
+# every case uses fixed seeds and inputs, the screen cases run on the SDL dummy driver (no window).
+# every case runs --repeat times and each number is the median of the runs. results can be saved as json and
+# compared with a saved baseline, a number that got worse than the threshold makes the run exit with status 1.
+# by default only the numbers that don't move with the machine's load are checked (speedups, sizes, the fake
+# clock pacing), --absolute checks the timings and rates too. there is no committed baseline: save your own first.
+# usage: python force_grey_bench.py engine policies frame startup --save bench.json
+#        python force_grey_bench.py --baseline bench.json --threshold 0.15
+import argparse
+import copy
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from force_grey_engine import Enemy, Game, PlayerAction
+from force_grey_log import LOG_PHYSICAL_HIT, LogSpill
+from force_grey_metrics import Metrics, instrument
+
+def _traced_bytes(build, count):
+    # bytes still allocated after building `count` objects with build()
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    kept = [build() for _ in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del kept
+    return used / count
+
+def _enemy_with_effects():
+    enemy = Enemy("Goblin", 40, 10, 2, 5, 1.2, 0.8)
+    enemy.add_status_effect("burn", 0, 2)
+    enemy.add_status_effect("break", 0, 10)
+    enemy.add_status_effect("shock", 0, 1)
+    return enemy
+
+def _battle():
+    game = Game()
+    game.current_enemy.add_status_effect("burn", 0, 2)
+    game.current_enemy.add_status_effect("break", 0, 10)
+    game.current_enemy.add_status_effect("shock", 0, 1)
+    return game
+
+def bench_memory(count=20000):
+    # bytes held per live battle (a Game with every status effect on the enemy), per enemy,
+    # and the size of the packed player + enemy records
+    game = _battle()
+    return {
+        "bytes_per_battle": _traced_bytes(_battle, count),
+        "bytes_per_enemy": _traced_bytes(_enemy_with_effects, count),
+        "packed_bytes_per_battle": len(game.player.pack()) + len(game.current_enemy.pack()),
+    }
+
+def _per_call_us(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+def bench_snapshot(number=20000):
+    # microseconds to clone a mid battle Game with snapshot()/restore() against copy.deepcopy
+    game = _battle()
+    game.game_state = "player_turn"
+    game.player_attack()
+    game.update()
+    saved = game.snapshot()
+    light = game.snapshot(include_rng=False)
+    result = {
+        "snapshot_us": _per_call_us(game.snapshot, number),
+        "restore_us": _per_call_us(lambda: game.restore(saved), number),
+        "snapshot_no_rng_us": _per_call_us(lambda: game.snapshot(include_rng=False), number),
+        "restore_no_rng_us": _per_call_us(lambda: game.restore(light), number),
+        "deepcopy_us": _per_call_us(lambda: copy.deepcopy(game), number // 20),
+    }
+    result["speedup"] = result["deepcopy_us"] / (result["snapshot_us"] + result["restore_us"])
+    result["speedup_no_rng"] = result["deepcopy_us"] / (result["snapshot_no_rng_us"] + result["restore_no_rng_us"])
+    return result
+
+def _frame_us(game, frames, turn_every, draw):
+    # mean microseconds per frame while a game advances one step every `turn_every` frames
+    from force_grey_sim import every_action
+    start = time.perf_counter()
+    for frame in range(frames):
+        if frame % turn_every == 0:
+            if game.game_state == "battle":
+                game.game_state = "player_turn"
+            elif game.game_state == "player_turn":
+                game.perform(every_action(game))
+            elif game.game_state in ("victory", "defeat"):
+                game.__init__(game.seed + 1)
+            else:
+                game.update()
+        draw(game)
+    return (time.perf_counter() - start) / frames * 1e6
+
+def _turns_per_second(turns, metrics=None):
+    # turns per second of the Game state machine (a fixed policy and seeds, enemy turns included),
+    # every game instrumented into metrics when it is given
+    from force_grey_sim import every_action, play_turn
+    seed = 0
+    game = Game(seed)
+    if metrics:
+        instrument(game, metrics)
+    played = 0
+    start = time.perf_counter()
+    while played < turns:
+        if game.game_state == "battle":
+            game.game_state = "player_turn"
+        elif game.game_state == "player_turn":
+            play_turn(game, every_action(game))
+            played += 1
+        else:
+            seed += 1
+            game = Game(seed)
+            if metrics:
+                instrument(game, metrics)
+    return turns / (time.perf_counter() - start)
+
+def bench_engine(turns=100000, number=200000):
+    # turns per second and microseconds per call of the hot Character methods
+    turns_per_second = _turns_per_second(turns)
+
+    # a target that never dies, so the calls can repeat without resetting it
+    target = Enemy("Target", 10 ** 9, 10, 2, 5, 1.2, 0.8)
+    target.add_status_effect("shock", 0, 1)
+    # process_status_effects changes the stacks, so every call starts from the same record; the reset is subtracted
+    burning = _enemy_with_effects()
+    record = burning.to_record()
+    reset_us = _per_call_us(lambda: burning.load_record(record), number)
+    process_us = _per_call_us(lambda: (burning.load_record(record), burning.process_status_effects()), number)
+    return {
+        "turns_per_second": turns_per_second,
+        "take_damage_us": _per_call_us(lambda: target.take_damage(12, "physical"), number),
+        "apply_shock_effect_us": _per_call_us(lambda: target.apply_shock_effect(12, 1), number),
+        "process_status_effects_us": process_us - reset_us,
+    }
+
+def bench_metrics(turns=100000, number=200000):
+    # the engine with and without force_grey_metrics, and the cost of one timed call
+    # (update() of a game waiting for the player does nothing, what is left is the timing)
+    game = Game(0)
+    plain_us = _per_call_us(game.update, number)
+    instrument(game)
+    return {
+        "turns_per_second": _turns_per_second(turns),
+        "instrumented_turns_per_second": _turns_per_second(turns, Metrics()),
+        "timed_call_overhead_us": _per_call_us(game.update, number) - plain_us,
+    }
+
+def bench_policies(runs=2000):
+    # full dungeon runs per policy on one core, reported as battles per second. the tree search is left
+    # out, its speed is set by its time budget
+    from force_grey_sim import POLICIES, run_dungeon
+    result = {}
+    for name, policy in POLICIES.items():
+        if name == "mcts":
+            continue
+        battles = 0
+        start = time.perf_counter()
+        for seed in range(runs):
+            battles += len(run_dungeon(policy, Game(seed))[0])
+        result[f"{name}_battles_per_second"] = battles / (time.perf_counter() - start)
+    return result
+
+def bench_frame(frames=3000, turn_every=30):
+    # frame time of the pygame screen: full redraw with uncached text and flip() every frame,
+    # against cached surfaces with dirty regions pushed by display.update(rects). runs without a window
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    import Elemental_Master_Force_Grey as ui
+    ui.init_display()
+    cache_size = ui.surface_cache.size
+
+    def full(game):
+        ui.draw_frame(ui.screen, game)
+        pygame.display.flip()
+
+    ui.surface_cache.size = 0
+    ui.surface_cache.clear()
+    full_us = _frame_us(Game(0), frames, turn_every, full)
+
+    ui.surface_cache.size = cache_size
+    renderer = ui.DirtyRenderer(ui.screen)
+
+    def dirty(game):
+        rects = renderer.draw(game)
+        if rects:
+            pygame.display.update(rects)
+
+    dirty_us = _frame_us(Game(0), frames, turn_every, dirty)
+
+    # one complete draw pass of a battle with a full log, warm cache
+    game = Game(0)
+    game.game_state = "player_turn"
+    for _ in range(8):
+        game.add_message("You dealt 12 points of physical damage to Goblin！")
+    draw_us = _per_call_us(lambda: ui.draw_frame(ui.screen, game), 200)
+    pygame.quit()
+    return {"full_frame_us": full_us, "dirty_frame_us": dirty_us, "speedup": full_us / dirty_us,
+            "full_log_draw_us": draw_us}
+
+def _python_ms(code, repeat=5):
+    # best wall time of a fresh interpreter running `code`, in milliseconds
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", PYGAME_HIDE_SUPPORT_PROMPT="1")
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=here, env=env, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def bench_startup():
+    # milliseconds to start python and import each part, minus a bare interpreter start
+    import force_grey_fonts
+    bare = _python_ms("pass")
+    return {
+        "python_ms": bare,
+        "engine_import_ms": _python_ms("import force_grey_engine") - bare,
+        "sim_import_ms": _python_ms("import force_grey_sim") - bare,
+        "game_import_ms": _python_ms("import Elemental_Master_Force_Grey") - bare,
+        "first_game_ms": _python_ms("import force_grey_engine; force_grey_engine.Game()") - bare,
+        # with the font cache and the text atlas of an earlier start, python_ms included like a player waits it
+        "first_frame_ms": _python_ms(force_grey_fonts.FIRST_FRAME),
+    }
+
+def bench_damage(number=20000):
+    # microseconds for the expected damage and kill chance of an attack: a cached table, a table built from
+    # scratch, and an estimate from 1000 sampled hits on snapshots
+    import force_grey_damage
+    game = _battle()
+    game.game_state = "player_turn"
+    game.current_enemy.add_status_effect("break", 0, 3)
+    preview = lambda: force_grey_damage.preview(game, PlayerAction.ATTACK)
+
+    def build():
+        force_grey_damage.clear()
+        preview()
+
+    saved = game.snapshot()
+
+    def sample():
+        hp = game.current_enemy.hp
+        total = kills = 0
+        for _ in range(1000):
+            game.player_attack()
+            total += hp - game.current_enemy.hp
+            kills += not game.current_enemy.is_alive()
+            game.restore(saved)
+        return total / 1000, kills / 1000
+
+    return {"lookup_us": _per_call_us(preview, number), "build_us": _per_call_us(build, number // 10),
+            "sampled_1000_us": _per_call_us(sample, 20)}
+
+def bench_rng(runs=20000, number=200000):
+    # microseconds per randint and charge_cycle dungeon runs per second, random.Random against BatchedRandom
+    import random
+    from force_grey_rng import BatchedRandom
+    from force_grey_sim import charge_cycle, run_dungeon
+    exact = random.Random(0)
+    batched = BatchedRandom(0)
+    result = {"randint_exact_us": _per_call_us(lambda: exact.randint(-3, 3), number),
+              "randint_batched_us": _per_call_us(lambda: batched.randint(-3, 3), number)}
+    for mode in ("exact", "batched"):
+        seeds = random.Random(0)
+        shared = BatchedRandom(0) if mode == "batched" else None
+        start = time.perf_counter()
+        for _ in range(runs):
+            run_dungeon(charge_cycle, Game(seeds.getrandbits(64), rng=shared or mode))
+        result[f"{mode}_runs_per_second"] = runs / (time.perf_counter() - start)
+    return result
+
+def _pause_seconds(state, frame=1 / 60):
+    # seconds of a fake clock the pause before `state` moves on takes in the main loop of the screen: sleep
+    # until the next event when one is queued, then run the due ticks, a frame costs `frame` seconds
+    from force_grey_engine import FixedStep, TurnScheduler
+    now = [0.0]
+    clock = lambda: now[0]
+    stepper = FixedStep(1 / 60, clock=clock)
+    scheduler = TurnScheduler(clock=stepper.now)
+    game = Game(0)
+    game.game_state = state
+    while game.game_state == state:
+        if scheduler.events:
+            wait_start = clock()
+            now[0] += max(1, int(scheduler.time_to_next() * 1000)) / 1000
+            stepper.waited(clock() - wait_start)
+        for _ in range(stepper.advance()):
+            stepper.tick()
+            scheduler.poll(game)
+        now[0] += frame
+    return now[0]
+
+def bench_pacing():
+    # wall seconds of the 1.0s and 1.5s pauses of the screen on a fake clock, they should stay at about that
+    return {"enemy_turn_pause_s": _pause_seconds("enemy_turn"),
+            "enemy_defeated_pause_s": _pause_seconds("enemy_defeated")}
+
+def bench_save():
+    # size and microseconds of force_grey_save: pack, unpack and an atomic write
+    import force_grey_save
+    return force_grey_save.bench()
+
+def bench_horde(turns=2000):
+    # milliseconds per turn against the biggest encounter of the content file, all of it batched over numpy arrays
+    from force_grey_content import get_content
+    from force_grey_horde import bench_turns
+    encounters = get_content().encounters
+    name = max(encounters, key=lambda encounter: len(encounters[encounter]))
+    mean, p99 = bench_turns(name, turns)
+    return {"enemies": len(encounters[name]), "turn_ms": mean, "turn_p99_ms": p99}
+
+def effect_hit_us(extra_types, number=200000):
+    # microseconds per physical hit on a target with rupture and tremor after registering extra_types more
+    # effect types (all with every hook), the target never has the extra ones. registering changes the engine
+    # for the rest of the process, bench_effects runs this in a fresh interpreter
+    from force_grey_engine import EffectType, register_effect
+    for index in range(extra_types):
+        register_effect(type(f"Filler{index}", (EffectType,), {
+            "name": f"filler{index}",
+            "on_hit": lambda self, character, damage: damage,
+            "on_turn_start": lambda self, character, events: 0,
+            "on_expire": lambda self, character, events: None,
+        })())
+    target = Enemy("Target", 10 ** 9, 10, 2, 5, 1.2, 0.8)
+    target.add_status_effect("break", 0, 10 ** 9)
+    target.add_status_effect("shock", 0, 1)
+    return _per_call_us(lambda: target.on_hit(12), number)
+
+def bench_effects(counts=(0, 10, 100, 1000)):
+    # per hit cost by number of registered effect types, it should stay flat
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1")
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = {}
+    for count in counts:
+        output = subprocess.run([sys.executable, "-c", f"import force_grey_bench; print(force_grey_bench.effect_hit_us({count}))"],
+                                cwd=here, env=env, check=True, capture_output=True, text=True).stdout
+        result[f"hit_us_{count}_types"] = float(output)
+    return result
+
+def bench_log(number=200000):
+    # microseconds per battle log line: the old formatted string in a trimmed list, a structured event
+    # in the ring, and the same event also streamed to a spill file
+    game = Game(0)
+    name = game.current_enemy.name
+    lines = []
+
+    def formatted():
+        lines.append(f"You dealt {12} points of physical damage to {name}！")
+        if len(lines) > 8:
+            lines.pop(0)
+
+    result = {
+        "formatted_us": _per_call_us(formatted, number),
+        "event_us": _per_call_us(lambda: game.log(LOG_PHYSICAL_HIT, name, 12), number),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.fglog")
+        with LogSpill(path) as spill:
+            game.spill = spill
+            result["spill_us"] = _per_call_us(lambda: game.log(LOG_PHYSICAL_HIT, name, 12), number)
+            game.spill = None
+        result["spill_bytes_per_event"] = os.path.getsize(path) / spill.events
+    return result
+
+BENCHMARKS = {
+    "engine": bench_engine,
+    "metrics": bench_metrics,
+    "policies": bench_policies,
+    "memory": bench_memory,
+    "snapshot": bench_snapshot,
+    "frame": bench_frame,
+    "log": bench_log,
+    "effects": bench_effects,
+    "horde": bench_horde,
+    "save": bench_save,
+    "rng": bench_rng,
+    "damage": bench_damage,
+    "startup": bench_startup,
+    "pacing": bench_pacing,
+}
+
+# numbers that sit around 0 (a difference of two timings), a relative change of them is noise. they count as
+# worse only when they grew by more than this, in their own unit
+ABSOLUTE_TOLERANCE = {"timed_call_overhead_us": 0.5}
+
+def is_stable(key):
+    # a ratio of two timings of the same run, a size or the fake clock of the pacing case: these compare between
+    # runs. plain timings and rates move by 20-60% from one run to the next on a busy machine, even as medians
+    return key.startswith("speedup") or "bytes" in key or key == "enemies" or key.endswith("_pause_s")
+
+def is_timing(key):
+    # a single call timed in micro or milliseconds, or a speedup made of two of them (the dirty frame is ~12us):
+    # the noisiest numbers, --timing-threshold instead of --threshold
+    return key.startswith("speedup") or not {"us", "ms"}.isdisjoint(key.split("_"))
+
+def higher_is_better(key):
+    return key.endswith("per_second") or key.startswith("speedup")
+
+def _median(runs):
+    # one result of a case from the results of several runs, the median of each number
+    merged = {}
+    for key, value in runs[0].items():
+        values = [run[key] for run in runs if key in run]
+        numeric = all(isinstance(item, (int, float)) and not isinstance(item, bool) for item in values)
+        merged[key] = statistics.median(values) if numeric else value
+    return merged
+
+def compare(results, baseline, threshold, timing_threshold=None, absolute=False):
+    # (benchmark, key, baseline value, new value, relative change) of every number that got worse by more
+    # than threshold (timing_threshold for the single call timings). sizes and times should go down, rates and
+    # speedups up. only the is_stable() numbers unless absolute
+    if timing_threshold is None:
+        timing_threshold = threshold
+    regressions = []
+    for name, result in results.items():
+        for key, value in result.items():
+            old = baseline.get(name, {}).get(key)
+            if old is None or not isinstance(value, (int, float)):
+                continue
+            if not absolute and not is_stable(key):
+                continue
+            if key in ABSOLUTE_TOLERANCE:
+                if value - old > ABSOLUTE_TOLERANCE[key]:
+                    regressions.append((name, key, old, value, (value - old) / abs(old) if old else float("inf")))
+                continue
+            if not old:
+                continue
+            change = (value - old) / old
+            worse = -change if higher_is_better(key) else change
+            if worse > (timing_threshold if is_timing(key) else threshold):
+                regressions.append((name, key, old, value, change))
+    return regressions
+
+def _format(value):
+    if not isinstance(value, float):
+        return str(value)
+    return f"{value:,.1f}" if abs(value) >= 10 else f"{value:.3f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks for Force_Grey")
+    parser.add_argument("names", nargs="*", help="default: every benchmark, or the ones in the baseline. "
+                        + ", ".join(BENCHMARKS))
+    parser.add_argument("--save", default=None, help="write the results to this json file")
+    parser.add_argument("--baseline", default=None, help="json file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative slowdown")
+    parser.add_argument("--timing-threshold", type=float, default=0.35,
+                        help="allowed relative slowdown of the single call timings (keys with _us or _ms)")
+    parser.add_argument("--absolute", action="store_true",
+                        help="also check the timings and rates, for a baseline of this machine in the same state")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every case, the median of each number is kept")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    names = args.names or (list(baseline) if baseline else list(BENCHMARKS))
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark {', '.join(unknown)}")
+
+    results = {}
+    for name in names:
+        result = results[name] = _median([BENCHMARKS[name]() for _ in range(max(args.repeat, 1))])
+        print(name, ", ".join(f"{key} {_format(value)}" for key, value in result.items()))
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "repeat": args.repeat,
+                       "time": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, file, indent=2)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, args.timing_threshold, args.absolute)
+        for name, key, old, value, change in regressions:
+            print(f"REGRESSION {name}.{key}: {old:,.2f} -> {value:,.2f} ({change:+.1%})")
+        if regressions:
+            sys.exit(1)
+        checked = "every number" if args.absolute else "speedups and sizes"
+        print(f"no regression over {args.threshold:.0%} in {checked} against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
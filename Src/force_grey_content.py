@@ -0,0 +1,128 @@
+# game content of Force_Grey: enemies, the dungeon order, spell numbers and a few rules
+# the source is force_grey_content.json, it is checked and compiled once into a pickled cache next to it.
+# the cache is rebuilt when the json file changes (mtime and size), so startup only unpickles
+# a few tuples however many enemies the file holds.
+# usage: python force_grey_content.py          compile and print a summary
+import json
+import os
+import pickle
+import time
+from collections import namedtuple
+
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "force_grey_content.json")
+CACHE_VERSION = 2  # 2: encounters and horde_reach
+
+# the module is fixed so the cache unpickles the same when this file is run as a script
+MODULE = "force_grey_content"
+EnemyType = namedtuple("EnemyType", "name max_hp attack defense magic_power physical_resistance magic_resistance",
+                       module=MODULE)
+# damage or heal of a spell is int((base + randint(low, high)) * multiplier), hits is the number of rolls
+# of the double attack. base is the player's attack or magic power for attacks, stacks is what a buff spell adds
+Spell = namedtuple("Spell", "cost low high multiplier hits base stacks", module=MODULE)
+# horde_reach: how many members of a group can attack the player in one turn, the first ones alive
+Rules = namedtuple("Rules", "kill_mana enemy_roll_low enemy_roll_high horde_reach", module=MODULE)
+# encounters: name -> tuple of EnemyType, one per member of the group (force_grey_horde.py)
+Content = namedtuple("Content", "enemies dungeon spells rules encounters", module=MODULE)
+
+SPELL_NAMES = ("attack", "normal", "double", "charge", "burn", "rupture", "tremor", "heal")
+SPELL_DEFAULTS = {"low": 0, "high": 0, "multiplier": 1.0, "hits": 1, "base": 0, "stacks": 0}
+
+def _fields(kind, name, table, required, optional=()):
+    missing = [key for key in required if key not in table]
+    if missing:
+        raise ValueError(f"{kind} {name} is missing {', '.join(missing)}")
+    unknown = set(table) - set(required) - set(optional)
+    if unknown:
+        raise ValueError(f"{kind} {name} has unknown fields {', '.join(sorted(unknown))}")
+
+def compile_content(source):
+    # turn the parsed json into a Content of namedtuples, raises ValueError on a bad file
+    enemies = {}
+    for name, table in source["enemies"].items():
+        _fields("enemy", name, table, EnemyType._fields[1:], ("note",))
+        enemies[name] = EnemyType(name, int(table["max_hp"]), int(table["attack"]), int(table["defense"]),
+                                  int(table["magic_power"]), float(table["physical_resistance"]),
+                                  float(table["magic_resistance"]))
+    unknown = [name for name in source["dungeon"] if name not in enemies]
+    if unknown:
+        raise ValueError(f"the dungeon has enemies that are not defined: {', '.join(unknown)}")
+    spells = {}
+    for name in SPELL_NAMES:
+        if name not in source["spells"]:
+            raise ValueError(f"spell {name} is missing")
+        table = source["spells"][name]
+        _fields("spell", name, table, ("cost",), SPELL_DEFAULTS)
+        values = dict(SPELL_DEFAULTS, **table)
+        spells[name] = Spell(int(values["cost"]), int(values["low"]), int(values["high"]), float(values["multiplier"]),
+                             int(values["hits"]), int(values["base"]), int(values["stacks"]))
+    _fields("rules", "", source["rules"], Rules._fields)
+    rules = Rules(*(int(source["rules"][key]) for key in Rules._fields))
+    encounters = {}
+    for name, members in source.get("encounters", {}).items():
+        unknown = [enemy for enemy in members if enemy not in enemies]
+        if unknown:
+            raise ValueError(f"encounter {name} has enemies that are not defined: {', '.join(unknown)}")
+        if not members or any(int(count) < 1 for count in members.values()):
+            raise ValueError(f"encounter {name} needs at least one of each enemy it lists")
+        encounters[name] = tuple(enemies[enemy] for enemy, count in members.items() for _ in range(int(count)))
+    return Content(enemies, tuple(enemies[name] for name in source["dungeon"]), spells, rules, encounters)
+
+def _cache_path(path):
+    return os.path.splitext(path)[0] + ".cache"
+
+def _stamp(path):
+    status = os.stat(path)
+    return status.st_mtime_ns, status.st_size
+
+def load_content(path=SOURCE_PATH):
+    # compiled content of the json file, from the cache when it is still fresh
+    stamp = _stamp(path)
+    cache = _cache_path(path)
+    try:
+        with open(cache, "rb") as file:
+            version, cached_stamp, content = pickle.load(file)
+        if version == CACHE_VERSION and cached_stamp == stamp:
+            return content
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError, ImportError):
+        pass
+    with open(path, encoding="utf-8") as file:
+        content = compile_content(json.load(file))
+    try:
+        # written next to the final name then renamed, so a reader never sees half a cache
+        temporary = f"{cache}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            pickle.dump((CACHE_VERSION, stamp, content), file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, cache)
+    except OSError:
+        pass  # read only install, compile again next time
+    return content
+
+_loaded = {}
+
+def get_content(path=SOURCE_PATH):
+    # content shared by every Game of the process, loaded on first use
+    content = _loaded.get(path)
+    if content is None:
+        content = _loaded[path] = load_content(path)
+    return content
+
+def reload_content(path=SOURCE_PATH):
+    # pick up an edited json file in a running process, games created afterwards use it
+    _loaded.pop(path, None)
+    return get_content(path)
+
+def main():
+    start = time.perf_counter()
+    with open(SOURCE_PATH, encoding="utf-8") as file:
+        content = compile_content(json.load(file))
+    compile_time = time.perf_counter() - start
+    load_content()
+    start = time.perf_counter()
+    load_content()
+    cached_time = time.perf_counter() - start
+    print(f"{len(content.enemies)} enemies, dungeon of {len(content.dungeon)}, {len(content.spells)} spells, "
+          f"{len(content.encounters)} encounters")
+    print(f"compile {compile_time * 1000:.2f}ms, load from cache {cached_time * 1000:.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# exact damage distributions for Force_Grey
+# every damage roll of the engine is a uniform randint pushed through a few deterministic steps (the on_hit hooks of
+# the target's effects, defense, resistance), so the whole distribution is a handful of values worked out once.
+# a table is kept per (action, attacker numbers, defender numbers, effect stacks); when a stat or a stack changes the
+# key changes with it, so a stale table is never looked up. the screen previews the expected damage and kill chance
+# of the button under the mouse with them, the solver and the "expected" policy of force_grey_sim.py use them
+# instead of sampling.
+# usage: python force_grey_damage.py          tables of every action against every enemy of the dungeon, full hp
+from bisect import bisect_left
+from collections import Counter
+from itertools import product
+
+from force_grey_engine import Character, Game, PlayerAction
+
+TABLE_LIMIT = 20000  # tables kept, the cache starts over when it is full
+_tables = {}
+
+class DamageTable:
+    # distribution of a roll: (probability, value) pairs sorted by value, equal values merged
+    __slots__ = ("pairs", "values", "mean", "tails")
+
+    def __init__(self, outcomes):
+        # outcomes: every roll's value once, they are equally likely
+        counts = Counter(outcomes)
+        self.pairs = [(count / len(outcomes), value) for value, count in sorted(counts.items())]
+        self.values = [value for _, value in self.pairs]
+        self.mean = sum(outcomes) / len(outcomes)
+        # tails[i]: chance of values[i] or more, with 0.0 at the end for anything above the highest value
+        self.tails = [0.0] * (len(self.pairs) + 1)
+        for index in range(len(self.pairs) - 1, -1, -1):
+            self.tails[index] = self.tails[index + 1] + self.pairs[index][0]
+
+    def chance_at_least(self, amount):
+        return self.tails[bisect_left(self.values, amount)]
+
+    def kill_chance(self, hp):
+        return self.chance_at_least(hp)
+
+    @property
+    def low(self):
+        return self.values[0]
+
+    @property
+    def high(self):
+        return self.values[-1]
+
+def _table(key, build):
+    table = _tables.get(key)
+    if table is None:
+        if len(_tables) >= TABLE_LIMIT:
+            _tables.clear()
+        table = _tables[key] = DamageTable(build())
+    return table
+
+def clear():
+    _tables.clear()
+
+def actual_damage(damage, defense, resistance):
+    # same formula as Character.take_damage
+    return max(1, int((damage - defense) * resistance))
+
+def spell_table(spell, base, defense=0, resistance=None, hits=1):
+    # total of `hits` rolls of int((base + roll) * multiplier), through defense and resistance unless resistance
+    # is None (healing)
+    def build():
+        rolls = range(spell.low, spell.high + 1)
+        if resistance is None:
+            amount = lambda roll: int((base + roll) * spell.multiplier)
+        else:
+            amount = lambda roll: actual_damage(int((base + roll) * spell.multiplier), defense, resistance)
+        return [sum(amount(roll) for roll in combination) for combination in product(rolls, repeat=hits)]
+    return _table(("spell", spell, base, defense, resistance, hits), build)
+
+def physical_table(attack, low, high, defense, resistance, stacks=None):
+    # a physical hit of attack + randint(low, high) on a target with these effect stacks, through the real
+    # on_hit hooks of the effects (rupture, tremor, frozen, haste, ...). the hooks change a copy, not the target
+    def build():
+        target = Character("", 1, 0, defense, 0, resistance, resistance)
+        outcomes = []
+        for roll in range(low, high + 1):
+            if stacks:
+                target.effect_stacks[:] = stacks
+                target._refresh_effects()
+            outcomes.append(actual_damage(target.on_hit(attack + roll), defense, resistance))
+        return outcomes
+    return _table(("physical", attack, low, high, defense, resistance, stacks), build)
+
+def action_table(game, action):
+    # damage of the action to the current enemy, None for actions without a damage roll.
+    # CHARGE is the damage of the release, also before the charge has started.
+    # against a horde every action is worked out on the member the single target hits land on
+    player = game.player
+    enemy = game.single_target()
+    spells = game.spells
+    if action is PlayerAction.ATTACK:
+        spell = spells["attack"]
+        return physical_table(player.attack, spell.low, spell.high, enemy.defense, enemy.physical_resistance,
+                              tuple(enemy.effect_stacks) if enemy.effects else None)
+    if action is PlayerAction.NORMAL:
+        return spell_table(spells["normal"], player.magic_power, enemy.defense, enemy.magic_resistance)
+    if action is PlayerAction.DOUBLE:
+        spell = spells["double"]
+        return spell_table(spell, player.magic_power, enemy.defense, enemy.magic_resistance, spell.hits)
+    if action is PlayerAction.CHARGE:
+        return spell_table(spells["charge"], player.magic_power, enemy.defense, enemy.magic_resistance)
+    return None
+
+def heal_table(game):
+    # hp the heal spell rolls, before the cap at max hp
+    spell = game.spells["heal"]
+    return spell_table(spell, spell.base)
+
+def enemy_attack_table(game):
+    # damage of the current enemy's attack to the player, the total of every attacker's hit against a horde
+    rules = game.rules
+    player = game.player
+    attacks = game.enemy_attacks()
+    if len(attacks) == 1:
+        return physical_table(attacks[0], rules.enemy_roll_low, rules.enemy_roll_high, player.defense,
+                              player.physical_resistance)
+    low, high, defense, resistance = rules.enemy_roll_low, rules.enemy_roll_high, player.defense, \
+        player.physical_resistance
+
+    def build():
+        if not attacks:
+            return [0]
+        return [sum(actual_damage(attack + roll, defense, resistance) for attack, roll in zip(attacks, rolls))
+                for rolls in product(range(low, high + 1), repeat=len(attacks))]
+    return _table(("group", attacks, low, high, defense, resistance), build)
+
+def preview(game, action):
+    # (expected damage, kill chance) of the action this turn, None for actions without a damage roll.
+    # starting a charge deals nothing this turn
+    if action is PlayerAction.CHARGE and not game.player.charging:
+        return None
+    table = action_table(game, action)
+    if table is None:
+        return None
+    return table.mean, table.kill_chance(game.current_enemy.hp)
+
+def expected_heal(game):
+    missing = game.player.max_hp - game.player.hp
+    return sum(probability * min(amount, missing) for probability, amount in heal_table(game).pairs)
+
+def main():
+    game = Game(0)
+    actions = (PlayerAction.ATTACK, PlayerAction.NORMAL, PlayerAction.DOUBLE, PlayerAction.CHARGE)
+    while game.game_state == "battle":
+        enemy = game.current_enemy
+        print(f"{enemy.name} ({enemy.hp} hp):")
+        for action in actions:
+            table = action_table(game, action)
+            print(f"    {action.name:7} {table.low:3}-{table.high:<3} mean {table.mean:6.2f}, "
+                  f"kill chance {table.kill_chance(enemy.hp):.2%}")
+        table = enemy_attack_table(game)
+        print(f"    its attack {table.low}-{table.high}, mean {table.mean:.2f}")
+        game.new_enemy()
+    print(f"heal {heal_table(game).low}-{heal_table(game).high}")
+
+if __name__ == "__main__":
+    main()
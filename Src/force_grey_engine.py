@@ -0,0 +1,728 @@
+# battle engine of Force_Grey
+# pure python, no pygame in here, so it can be imported by batch jobs, tests and worker processes
+# without opening a window. the pygame front end lives in Elemental_Master_Force_Grey.py
+import heapq
+import random
+import struct
+import time
+from collections import deque
+from enum import Enum
+
+from force_grey_content import get_content
+from force_grey_rng import make_rng
+from force_grey_log import (LOG_LINES, LOG_TEXT, LOG_MEET, LOG_MULTIPLIERS, LOG_PHYSICAL_HIT, LOG_RUPTURE_DECAY,
+                            LOG_BEAT, LOG_MAGIC_HIT, LOG_NO_MANA, LOG_DOUBLE_HIT, LOG_DOUBLE_TOTAL, LOG_CHARGE_RELEASE,
+                            LOG_CHARGE_START, LOG_EFFECT, LOG_HEAL, LOG_STUNNED, LOG_ENEMY_HIT, LOG_BURN_TICK,
+                            LOG_EFFECT_END, LOG_BURN_KILL, LOG_EFFECT_TICK, EFFECT_LABELS, EFFECT_END_NAMES,
+                            format_event)
+
+# II-magic
+class MagicType(Enum):
+    FIRE = 1      # burn
+    BREAK = 2     # rupture
+    SHOCK = 3     # tremor
+
+# I-magic
+class MagicAttackMode(Enum):
+    NORMAL = 1    # normal attack
+    DOUBLE = 2    # double attack
+    CHARGE = 3    # charge attack
+
+# everything the player can do in one turn, used by the simulator and other headless drivers
+class PlayerAction(Enum):
+    ATTACK = 1    # physical attack
+    NORMAL = 2    # normal magical attack
+    DOUBLE = 3    # double magical attack
+    CHARGE = 4    # start charging, or release the charge
+    BURN = 5      # burn effect
+    RUPTURE = 6   # rupture effect
+    TREMOR = 7    # tremor effect
+    HEAL = 8      # healing
+
+# status effects known by the engine, filled by register_effect(). each one has a fixed slot in
+# Character.effect_stacks and effect_turns, the slot is its index in these lists
+EFFECTS = []
+EFFECT_NAMES = []
+EFFECT_SLOTS = {}
+BURN, BREAK, SHOCK = range(3)  # slots of the built in effects the spells use
+
+# state
+class StatusEffect:
+    __slots__ = ("name", "duration", "stacks")
+    
+    def __init__(self, name, duration=0, stacks=0):
+        self.name = name
+        self.duration = duration  # state duration, 0 means forever-lasting until it triggered
+        self.stacks = stacks      # state stacks
+    
+    def __str__(self):
+        return f"{self.name}({self.stacks})"
+
+class Character:
+    __slots__ = ("name", "max_hp", "hp", "attack", "defense", "magic_power", "physical_resistance",
+                 "magic_resistance", "alive", "stunned", "effect_stacks", "effect_turns", "effects", "hit_effects")
+    # fixed width record of the battle state, the packed form of to_record(). RECORD and RECORD_LENGTH
+    # are set by register_effect(), there are two numbers per registered effect
+    
+    def __init__(self, name, max_hp, attack, defense, magic_power, physical_resistance=1.0, magic_resistance=1.0):
+        self.name = name
+        self.max_hp = max_hp
+        self.hp = max_hp
+        self.attack = attack
+        self.defense = defense
+        self.magic_power = magic_power
+        self.physical_resistance = physical_resistance  # physical damage multiplier
+        self.magic_resistance = magic_resistance        # magical damage multiplier
+        self.alive = True
+        self.stunned = False      # is shocked or not
+        # state stacks and duration per effect slot, 0 stacks means the effect is not there
+        self.effect_stacks = [0] * len(EFFECTS)
+        self.effect_turns = [0] * len(EFFECTS)
+        # the active EffectTypes and the ones of them with an on_hit hook, in slot order.
+        # rebuilt only when an effect starts or ends, so a hit costs nothing for effects that are not there
+        self.effects = ()
+        self.hit_effects = ()
+    
+    @property
+    def status_effects(self):
+        # dictionary of all active states, built on the fly for display and debugging
+        return {effect.name: StatusEffect(effect.name, self.effect_turns[effect.slot], self.effect_stacks[effect.slot])
+                for effect in self.effects}
+    
+    def take_damage(self, damage, damage_type="physical"):
+        # applying damage based on different damage multiplier
+        resistance = self.physical_resistance if damage_type == "physical" else self.magic_resistance
+        actual_damage = max(1, int((damage - self.defense) * resistance))
+        self.hp -= actual_damage
+        if self.hp <= 0:
+            self.hp = 0
+            self.alive = False
+        return actual_damage
+    
+    def heal(self, amount):
+        heal_amount = min(self.max_hp - self.hp, amount)
+        self.hp += heal_amount
+        return heal_amount
+    
+    def is_alive(self):
+        return self.alive
+    
+    def has_status_effect(self, effect_name):
+        return self.effect_stacks[EFFECT_SLOTS[effect_name]] > 0
+    
+    def status_stacks(self, effect_name):
+        return self.effect_stacks[EFFECT_SLOTS[effect_name]]
+    
+    def add_status_effect(self, effect_name, duration=0, stacks=1):
+        slot = EFFECT_SLOTS[effect_name]
+        if self.effect_stacks[slot] > 0:
+            self.effect_stacks[slot] += stacks
+            if duration > 0:
+                self.effect_turns[slot] = max(self.effect_turns[slot], duration)
+        else:
+            self.effect_stacks[slot] = stacks
+            self.effect_turns[slot] = duration
+            self._refresh_effects()
+    
+    def remove_status_effect(self, effect_name, stacks=1):
+        return self._remove_stacks(EFFECT_SLOTS[effect_name], stacks)
+    
+    def _remove_stacks(self, slot, stacks):
+        if self.effect_stacks[slot] > 0:
+            self.effect_stacks[slot] -= stacks
+            if self.effect_stacks[slot] <= 0:
+                self.effect_stacks[slot] = 0
+                self.effect_turns[slot] = 0
+                self._refresh_effects()
+                return True
+        return False
+    
+    def _refresh_effects(self):
+        stacks = self.effect_stacks
+        self.effects = tuple(effect for effect in EFFECTS if stacks[effect.slot] > 0)
+        self.hit_effects = tuple(effect for effect in self.effects if effect.on_hit is not None)
+    
+    def on_hit(self, damage):
+        # a physical hit on this character goes through the on_hit hook of every active effect, in slot order
+        for effect in self.hit_effects:
+            damage = effect.on_hit(self, damage)
+        return damage
+    
+    def process_status_effects(self):
+        # start of this character's turn: the on_turn_start hooks, then the effects with a duration count down
+        effects_log = []
+        damage_taken = 0
+        
+        for effect in self.effects:
+            if effect.on_turn_start is not None:
+                damage_taken += effect.on_turn_start(self, effects_log)
+        
+        # dealing with state duration
+        turns = self.effect_turns
+        expired = False
+        for effect in self.effects:
+            slot = effect.slot
+            if turns[slot] > 0:
+                turns[slot] -= 1
+                if turns[slot] <= 0:
+                    self.effect_stacks[slot] = 0
+                    expired = True
+                    effects_log.append((LOG_EFFECT_END, self.name, 0, slot))
+                    if effect.on_expire is not None:
+                        effect.on_expire(self, effects_log)
+        if expired:
+            self._refresh_effects()
+        
+        return effects_log, damage_taken
+    
+    def apply_break_effect(self, damage):
+        # rupture on its own, see Rupture.on_hit
+        if self.effect_stacks[BREAK] > 0:
+            return EFFECTS[BREAK].on_hit(self, damage)
+        return damage
+    
+    def apply_shock_effect(self, damage, attack_count):
+        # tremor on its own, see Tremor.on_hit. a hit on a target without tremor gives it the first stack
+        if self.effect_stacks[SHOCK] > 0:
+            return EFFECTS[SHOCK].on_hit(self, damage)
+        self.add_status_effect("shock", 0, 1)
+        return damage
+    
+    def to_record(self):
+        # the battle state as a flat tuple of numbers, the name and class stay out
+        return (self.hp, self.max_hp, self.attack, self.defense, self.magic_power, self.physical_resistance,
+                self.magic_resistance, self.alive, self.stunned, *self.effect_stacks, *self.effect_turns)
+    
+    def load_record(self, record):
+        (self.hp, self.max_hp, self.attack, self.defense, self.magic_power, self.physical_resistance,
+         self.magic_resistance, self.alive, self.stunned) = record[:9]
+        self.effect_stacks[:] = record[9:9 + len(EFFECTS)]
+        self.effect_turns[:] = record[9 + len(EFFECTS):Character.RECORD_LENGTH]
+        self._refresh_effects()
+    
+    def pack(self):
+        return self.RECORD.pack(*self.to_record())
+    
+    def unpack(self, data):
+        self.load_record(self.RECORD.unpack(data))
+
+class Player(Character):
+    __slots__ = ("magic_points", "max_magic_points", "charging", "charge_turn", "magic_attack_mode")
+    RECORD_EXTRA = "2i?iB"  # after the Character fields, RECORD is set by register_effect()
+    
+    def __init__(self):
+        super().__init__("Element Master", 120, 15, 5, 25)
+        self.magic_points = 60
+        self.max_magic_points = 60
+        self.charging = False  # is charging or not
+        self.charge_turn = 0   # rest of the charging turn
+        self.magic_attack_mode = MagicAttackMode.NORMAL  # default magical attack mode
+    
+    def use_magic(self, cost):
+        if self.magic_points >= cost:
+            self.magic_points -= cost
+            return True
+        return False
+    
+    def restore_magic(self, amount):
+        self.magic_points = min(self.max_magic_points, self.magic_points + amount)
+    
+    def to_record(self):
+        return super().to_record() + (self.magic_points, self.max_magic_points, self.charging,
+                                      self.charge_turn, self.magic_attack_mode.value)
+    
+    def load_record(self, record):
+        super().load_record(record)
+        (self.magic_points, self.max_magic_points, self.charging, self.charge_turn,
+         mode) = record[Character.RECORD_LENGTH:]
+        self.magic_attack_mode = MagicAttackMode(mode)
+
+class Enemy(Character):
+    __slots__ = ()
+    
+    def __init__(self, name, max_hp, attack, defense, magic_power, physical_resistance=1.0, magic_resistance=1.0):
+        super().__init__(name, max_hp, attack, defense, magic_power, physical_resistance, magic_resistance)
+    
+    @classmethod
+    def from_type(cls, kind):
+        # a fresh enemy from an EnemyType of the content file
+        return cls(*kind)
+
+# status effect registry. an EffectType is a kind of effect with up to three hooks, a hook that is None
+# costs nothing: characters only keep the hooks of the effects they have (Character.effects, hit_effects)
+class EffectType:
+    name = ""
+    label = ""               # shown in the battle log
+    color = (255, 255, 255)  # shown in the effect list of the screen
+    slot = None              # set by register_effect()
+    on_hit = None            # (character, damage) -> damage of a physical hit on the character
+    on_turn_start = None     # (character, events) -> damage taken, at the start of the character's turn
+    on_expire = None         # (character, events), when the turns of the effect run out
+
+class Burn(EffectType):
+    # loses 1% of max hp per stack every turn, then 1 stack
+    name, label, color = "burn", "Burn", (255, 0, 0)
+    
+    def on_turn_start(self, character, events):
+        burn_damage = int(character.max_hp * (character.effect_stacks[self.slot] * 0.01))
+        character.hp -= burn_damage
+        # burn state stacks(s) - 1
+        character._remove_stacks(self.slot, 1)
+        events.append((LOG_BURN_TICK, character.name, burn_damage, 0))
+        if character.hp <= 0:
+            character.hp = 0
+            character.alive = False
+        return burn_damage
+
+class Rupture(EffectType):
+    # rupture: every time when getting attcked, lost 1 rupture stack and increase this attack damage based on the rupture state stacks
+    name, label, color = "break", "Rupture", (255, 165, 0)
+    
+    def on_hit(self, character, damage):
+        stacks = character.effect_stacks[self.slot]
+        character._remove_stacks(self.slot, 1)
+        return damage + stacks
+
+class Tremor(EffectType):
+    # tremor: every time when getting attacked, the stack of tremor buff increase 1
+    name, label, color = "shock", "Tremor", (255, 255, 0)
+    
+    def on_hit(self, character, damage):
+        character.effect_stacks[self.slot] += 1
+        # if the stack of tremor buff equal or over 10, the enemy get shocked, next turn it can not do any action and will get double damage
+        if character.effect_stacks[self.slot] >= 10:
+            character.stunned = True
+            return damage * 2
+        return damage
+
+class Poison(EffectType):
+    # loses as many hp as it has stacks every turn, for as long as the effect lasts
+    name, label, color = "poison", "Poison", (0, 200, 0)
+    
+    def on_turn_start(self, character, events):
+        damage = min(character.hp, character.effect_stacks[self.slot])
+        character.hp -= damage
+        events.append((LOG_EFFECT_TICK, character.name, damage, self.slot))
+        if character.hp <= 0:
+            character.alive = False
+        return damage
+
+class Frozen(EffectType):
+    # can't act while frozen, a physical hit shatters the ice for half again the damage and ends it
+    name, label, color = "frozen", "Frozen", (150, 220, 255)
+    
+    def on_hit(self, character, damage):
+        character._remove_stacks(self.slot, character.effect_stacks[self.slot])
+        return damage * 3 // 2
+    
+    def on_turn_start(self, character, events):
+        character.stunned = True
+        return 0
+
+class Haste(EffectType):
+    # dodges a third of every physical hit, and loses a turn to lethargy when it wears off
+    name, label, color = "haste", "Haste", (255, 105, 180)
+    
+    def on_hit(self, character, damage):
+        return damage - damage // 3
+    
+    def on_expire(self, character, events):
+        character.stunned = True
+
+def register_effect(effect):
+    # add an effect type and give it the next slot. every Character has a slot for each registered type,
+    # so register new ones at import time, before any character exists
+    if effect.name in EFFECT_SLOTS:
+        raise ValueError(f"status effect {effect.name} is already registered")
+    effect.slot = len(EFFECTS)
+    EFFECTS.append(effect)
+    EFFECT_NAMES.append(effect.name)
+    EFFECT_SLOTS[effect.name] = effect.slot
+    EFFECT_LABELS.append(effect.label)
+    EFFECT_END_NAMES.append(effect.name)
+    Character.RECORD = struct.Struct(f"<5i2d2?{len(EFFECTS)}i{len(EFFECTS)}i")
+    Character.RECORD_LENGTH = 9 + 2 * len(EFFECTS)
+    Player.RECORD = struct.Struct(Character.RECORD.format + Player.RECORD_EXTRA)
+    return effect
+
+# the order of the first three is fixed, BURN, BREAK and SHOCK are their slots
+for effect_type in (Burn, Rupture, Tremor, Poison, Frozen, Haste):
+    register_effect(effect_type())
+
+# spell of the content file used by each action
+ACTION_SPELLS = {
+    PlayerAction.ATTACK: "attack",
+    PlayerAction.NORMAL: "normal",
+    PlayerAction.DOUBLE: "double",
+    PlayerAction.CHARGE: "charge",
+    PlayerAction.BURN: "burn",
+    PlayerAction.RUPTURE: "rupture",
+    PlayerAction.TREMOR: "tremor",
+    PlayerAction.HEAL: "heal",
+}
+EFFECT_SPELLS = {MagicType.FIRE: "burn", MagicType.BREAK: "rupture", MagicType.SHOCK: "tremor"}
+MAGIC_EFFECTS = {MagicType.FIRE: BURN, MagicType.BREAK: BREAK, MagicType.SHOCK: SHOCK}  # effect slot of each spell
+
+class Game:
+    def __init__(self, seed=None, content=None, rng="exact"):
+        # every die of a game comes from its own generator, so a seed and the actions replay the whole game.
+        # rng is a mode of force_grey_rng.py or a generator to draw from, bulk simulation passes one BatchedRandom
+        # to all the games of a job (the rolls then depend on the job's seed and the order of the games)
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
+        self.rng = make_rng(rng, seed) if isinstance(rng, str) else rng
+        self.action_log = bytearray()  # PlayerAction values passed to perform(), one byte each
+        self.player = Player()
+        # enemies, spell numbers and rules come from force_grey_content.json, or from another compiled Content
+        # (the balance tuner tries variants). only the enemy being fought exists as an Enemy, new_enemy()
+        # builds the next one from the roster
+        content = content or get_content()
+        self.roster = self._roster(content)
+        self.spells = content.spells
+        self.rules = content.rules
+        self.current_enemy = None
+        self.game_state = "start"  # start, battle, player_turn, enemy_turn, victory, defeat
+        self.message = ""
+        self.log_events = deque(maxlen=LOG_LINES)  # (kind, actor, amount, extra), see force_grey_log.py
+        self.spill = None  # a force_grey_log.LogSpill to keep the whole history, off by default
+        self.enemy_index = 0
+        self.attack_count = 0  # for the count of tremor buff
+        self.new_enemy()
+    
+    def _roster(self, content):
+        # what new_enemy() fights in order, HordeGame fights encounters instead
+        return content.dungeon
+    
+    def new_enemy(self):
+        if self.enemy_index < len(self.roster):
+            self.current_enemy = Enemy.from_type(self.roster[self.enemy_index])
+            self.enemy_index += 1
+            self.game_state = "battle"
+            self.log(LOG_MEET, self.current_enemy.name)
+            self.log(LOG_MULTIPLIERS, self.current_enemy.name, self.current_enemy.physical_resistance, self.current_enemy.magic_resistance)
+        else:
+            self.game_state = "victory"
+    
+    def player_attack(self):
+        spell = self.spells["attack"]
+        damage = self.player.attack + self.rng.randint(spell.low, spell.high)
+        
+        # the enemy's effects change the damage (rupture, tremor, ...), only the active ones are called
+        damage = self.current_enemy.on_hit(damage)
+        
+        # a physical hit starts the tremor buff
+        self.attack_count += 1
+        if self.current_enemy.effect_stacks[SHOCK] == 0:
+            self.current_enemy.add_status_effect("shock", 0, 1)
+        
+        actual_damage = self.current_enemy.take_damage(damage, "physical")
+        self.log(LOG_PHYSICAL_HIT, self.current_enemy.name, actual_damage)
+        
+        # check the buff
+        if self.current_enemy.has_status_effect("break"):
+            self.log(LOG_RUPTURE_DECAY, self.current_enemy.name)
+        
+        self._end_attack()
+    
+    def single_target(self):
+        # the Character the single target hits land on, HordeGame answers with one member of the group
+        return self.current_enemy
+    
+    def enemy_attacks(self):
+        # attack of every enemy that hits the player on the enemies' next turn, a horde has several
+        return (self.current_enemy.attack,)
+    
+    def _end_attack(self):
+        # after a hit: the next enemy if this one is beaten, its turn otherwise
+        if not self.current_enemy.is_alive():
+            self.log(LOG_BEAT, self.current_enemy.name)
+            self.player.restore_magic(self.rules.kill_mana)
+            self.game_state = "enemy_defeated"
+        else:
+            self.game_state = "enemy_turn"
+    
+    def _spell_damage(self, spell):
+        return int((self.player.magic_power + self.rng.randint(spell.low, spell.high)) * spell.multiplier)
+    
+    def _magic_hit(self, damage, kind):
+        # the normal magic and the released charge, one hit on the enemy being fought
+        actual_damage = self.current_enemy.take_damage(damage, "magic")
+        self.log(kind, self.current_enemy.name, actual_damage)
+        self._end_attack()
+    
+    def player_magic_attack(self, magic_type=None):
+        if magic_type is None:
+            magic_type = self.player.magic_attack_mode
+        
+        if magic_type == MagicAttackMode.NORMAL:
+            self._normal_magic_attack()
+        elif magic_type == MagicAttackMode.DOUBLE:
+            self._double_magic_attack()
+        elif magic_type == MagicAttackMode.CHARGE:
+            self._charge_magic_attack()
+    
+    def _normal_magic_attack(self):
+        spell = self.spells["normal"]
+        if self.player.use_magic(spell.cost):
+            self._magic_hit(self._spell_damage(spell), LOG_MAGIC_HIT)
+        else:
+            self.log(LOG_NO_MANA)
+            self.game_state = "player_turn"
+    
+    def _double_magic_attack(self):
+        spell = self.spells["double"]
+        if self.player.use_magic(spell.cost):
+            total_damage = 0
+            for i in range(spell.hits):
+                damage = self._spell_damage(spell)
+                actual_damage = self.current_enemy.take_damage(damage, "magic")
+                total_damage += actual_damage
+                self.log(LOG_DOUBLE_HIT, self.current_enemy.name, actual_damage, i+1)
+            
+            self.log(LOG_DOUBLE_TOTAL, self.current_enemy.name, total_damage)
+            self._end_attack()
+        else:
+            self.log(LOG_NO_MANA)
+            self.game_state = "player_turn"
+    
+    def _charge_magic_attack(self):
+        spell = self.spells["charge"]
+        if self.player.charging:
+            # charging ends, deal powerful attack
+            self.player.charging = False
+            self.player.charge_turn = 0
+            self._magic_hit(self._spell_damage(spell), LOG_CHARGE_RELEASE)
+        else:
+            # start to charge
+            if self.player.use_magic(spell.cost):
+                self.player.charging = True
+                self.player.charge_turn = 1
+                self.log(LOG_CHARGE_START, self.player.name)
+                self.game_state = "enemy_turn"
+            else:
+                self.log(LOG_NO_MANA)
+                self.game_state = "player_turn"
+    
+    def apply_magic_effect(self, magic_type):
+        spell = self.spells[EFFECT_SPELLS[magic_type]]
+        if self.player.use_magic(spell.cost):
+            slot = MAGIC_EFFECTS[magic_type]
+            self.current_enemy.add_status_effect(EFFECT_NAMES[slot], 0, spell.stacks)
+            self.log(LOG_EFFECT, self.current_enemy.name, spell.stacks, slot)
+            
+            self.game_state = "enemy_turn"
+        else:
+            self.log(LOG_NO_MANA)
+            self.game_state = "player_turn"
+    
+    def player_heal(self):
+        spell = self.spells["heal"]
+        if self.player.use_magic(spell.cost):
+            heal_amount = self.player.heal(int((spell.base + self.rng.randint(spell.low, spell.high)) * spell.multiplier))
+            self.log(LOG_HEAL, self.player.name, heal_amount)
+            self.game_state = "enemy_turn"
+        else:
+            self.log(LOG_NO_MANA)
+            self.game_state = "player_turn"
+    
+    def enemy_attack(self):
+        # check enemy is shocked or not
+        if self.current_enemy.stunned:
+            self.log(LOG_STUNNED, self.current_enemy.name)
+            self.current_enemy.stunned = False
+            if self.current_enemy.has_status_effect("shock"):
+                self.current_enemy.remove_status_effect("shock")  # if shock triggered, remove the buff of tremor
+            self.game_state = "player_turn"
+            return
+        
+        damage = self.current_enemy.attack + self.rng.randint(self.rules.enemy_roll_low, self.rules.enemy_roll_high)
+        actual_damage = self.player.take_damage(damage, "physical")
+        self.log(LOG_ENEMY_HIT, self.current_enemy.name, actual_damage)
+        
+        if not self.player.is_alive():
+            self.game_state = "defeat"
+        else:
+            self.game_state = "player_turn"
+    
+    def snapshot(self, include_rng=True):
+        # the whole game as an immutable tuple, cheap enough to take thousands of times per decision.
+        # only the current enemy is stored, the others are still untouched roster entries or already beaten.
+        # include_rng=False leaves the random state out, for search that wants fresh rolls after restore()
+        current = self.current_enemy.to_record() if self.current_enemy else None
+        return (self.game_state, self.message, self.enemy_index, self.attack_count, tuple(self.log_events),
+                self.player.to_record(), current,
+                self.rng.getstate() if include_rng else None, len(self.action_log))
+    
+    def restore(self, snapshot):
+        # put the game back to a snapshot() of this game, or of another Game with the same roster
+        enemy_index = self.enemy_index
+        (self.game_state, self.message, self.enemy_index, self.attack_count, log_events,
+         player, current, rng_state, actions) = snapshot
+        self.log_events.clear()
+        self.log_events.extend(log_events)
+        self.player.load_record(player)
+        if current is None:
+            self.current_enemy = None
+        else:
+            if self.current_enemy is None or self.enemy_index != enemy_index:
+                # the snapshot is in another fight, the Enemy object is kept for as long as the fight lasts
+                self.current_enemy = Enemy.from_type(self.roster[self.enemy_index - 1])
+            self.current_enemy.load_record(current)
+        if rng_state is not None:
+            self.rng.setstate(rng_state)
+        del self.action_log[actions:]
+    
+    def action_cost(self, action):
+        # mana needed by the action, releasing a charge is free
+        if action == PlayerAction.CHARGE and self.player.charging:
+            return 0
+        return self.spells[ACTION_SPELLS[action]].cost
+    
+    def available_actions(self):
+        # actions the player has enough mana for
+        return [action for action in PlayerAction if self.action_cost(action) <= self.player.magic_points]
+    
+    def perform(self, action):
+        # run one player action through the same methods the buttons in main() use
+        self.action_log.append(action.value)
+        if action == PlayerAction.ATTACK:
+            self.player_attack()
+        elif action == PlayerAction.NORMAL:
+            self._normal_magic_attack()
+        elif action == PlayerAction.DOUBLE:
+            self._double_magic_attack()
+        elif action == PlayerAction.CHARGE:
+            self._charge_magic_attack()
+        elif action == PlayerAction.BURN:
+            self.apply_magic_effect(MagicType.FIRE)
+        elif action == PlayerAction.RUPTURE:
+            self.apply_magic_effect(MagicType.BREAK)
+        elif action == PlayerAction.TREMOR:
+            self.apply_magic_effect(MagicType.SHOCK)
+        elif action == PlayerAction.HEAL:
+            self.player_heal()
+    
+    def log(self, kind, actor="", amount=0, extra=0):
+        # structured log event, the deque drops the oldest one by itself
+        event = (kind, actor, amount, extra)
+        self.log_events.append(event)
+        if self.spill is not None:
+            self.spill.write(event)
+    
+    def add_message(self, msg):
+        # free text line, e.g. the hint of the front end
+        self.log(LOG_TEXT, msg)
+    
+    @property
+    def battle_log(self):
+        # the lines on screen, formatted now and not when they were logged
+        return [format_event(event) for event in self.log_events]
+    
+    def update(self):
+        if self.game_state == "enemy_turn":
+            # dealing with the enemy's state
+            effects_log, damage_taken = self.current_enemy.process_status_effects()
+            for event in effects_log:
+                self.log(*event)
+            
+            if damage_taken > 0 and not self.current_enemy.is_alive():
+                self.log(LOG_BURN_KILL, self.current_enemy.name)
+                self.player.restore_magic(self.rules.kill_mana)
+                self.game_state = "enemy_defeated"
+                return
+            
+            self.enemy_attack()
+        elif self.game_state == "enemy_defeated":
+            self.new_enemy()
+            self.attack_count = 0  # reset the attack count
+
+class TurnScheduler:
+    # runs the engine steps that follow a player action (the enemy's turn, the next enemy) as timed events,
+    # so a frame loop can keep drawing and reading input while the player reads the log.
+    # call poll(game) once per frame. with headless() every delay is 0 and poll() plays the steps at once
+    DELAYS = {"enemy_turn": 1.0, "enemy_defeated": 1.5}  # seconds to wait in each state before update()
+
+    def __init__(self, delays=None, clock=time.monotonic):
+        self.delays = dict(self.DELAYS if delays is None else delays)
+        self.clock = clock
+        self.events = []  # heap of (due time, order, callback)
+        self.order = 0    # keeps events with the same due time first in, first out
+        self.scheduled = None  # game with an update() in the queue
+
+    @classmethod
+    def headless(cls):
+        return cls({state: 0 for state in cls.DELAYS})
+
+    def call_later(self, delay, callback):
+        heapq.heappush(self.events, (self.clock() + delay, self.order, callback))
+        self.order += 1
+
+    def run_due(self):
+        # run every event whose time has come, returns how many ran
+        now = self.clock()
+        ran = 0
+        while self.events and self.events[0][0] <= now:
+            heapq.heappop(self.events)[2]()
+            ran += 1
+        return ran
+
+    def clear(self):
+        self.events.clear()
+        self.scheduled = None
+
+    def time_to_next(self):
+        # seconds until the next event is due, None when nothing is queued
+        return max(0.0, self.events[0][0] - self.clock()) if self.events else None
+
+    def poll(self, game):
+        # queue the game's next step if it is waiting for one, then run what is due. returns the events run
+        steps = 0
+        while True:
+            if self.scheduled is not game and game.game_state in self.delays:
+                self.scheduled = game
+                self.call_later(self.delays[game.game_state], lambda: self._step(game))
+            ran = self.run_due()
+            if not ran:
+                return steps
+            steps += ran
+
+    def _step(self, game):
+        self.scheduled = None
+        game.update()
+
+class FixedStep:
+    # simulation time that moves in whole ticks of `step` seconds, however often the screen is drawn.
+    # give now() to a TurnScheduler as its clock and its delays count ticks, not frames
+    def __init__(self, step=1 / 60, max_steps=5, clock=time.perf_counter):
+        self.step = step
+        self.max_steps = max_steps  # ticks run at most per advance(), a longer stall is dropped, not replayed
+        self.clock = clock
+        self.time = 0.0  # simulated seconds
+        self.lag = 0.0   # real time not simulated yet
+        self.last = clock()
+
+    def now(self):
+        return self.time
+
+    def advance(self):
+        # how many ticks are due since the last call, the caller runs them and calls tick() for each
+        now = self.clock()
+        self.lag += now - self.last
+        self.last = now
+        ticks = int(self.lag / self.step)
+        if ticks >= self.max_steps:
+            self.lag = 0.0
+            return self.max_steps
+        self.lag -= ticks * self.step
+        return ticks
+
+    def waited(self, seconds):
+        # the caller slept on purpose (until the next TurnScheduler event), that time is simulated at once in
+        # whole ticks instead of being dropped as a stall by advance(). the rest is left to advance()
+        whole = int(seconds / self.step) * self.step
+        self.time += whole
+        self.last += whole
+
+    def tick(self):
+        self.time += self.step
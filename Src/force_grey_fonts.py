@@ -0,0 +1,153 @@
+# fonts and pre-rendered text of the Force_Grey screen, for a fast start
+# pygame.font.SysFont() scans every font of the system (fc-list on linux) before it can answer, which costs hundreds
+# of milliseconds on a desktop with many fonts. the path it found is kept in force_grey_fonts.json, and a LazyFont
+# only opens its file when something is rendered with it. the fixed strings of the screen (title, buttons, labels)
+# are rendered once into force_grey_atlas.png, a start with an up to date atlas draws the start page without
+# touching a font at all. both files are rebuilt by themselves when the font, the strings or pygame change.
+# usage: python force_grey_fonts.py          how long a cold and a warm start take to the first frame
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pygame
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FONT_CACHE_PATH = os.path.join(HERE, "force_grey_fonts.json")
+ATLAS_PATH = os.path.join(HERE, "force_grey_atlas.png")
+ATLAS_WIDTH = 1024
+
+_paths = {}  # font name -> path (None: pygame's default font), for this process
+
+def _write_json(path, data):
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+def font_path(name):
+    # the file SysFont(name) would use, from the cache file when it is still there
+    if name in _paths:
+        return _paths[name]
+    try:
+        with open(FONT_CACHE_PATH, encoding="utf-8") as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        cached = {}
+    if name in cached and (cached[name] is None or os.path.exists(cached[name])):
+        path = cached[name]
+    else:
+        path = pygame.font.match_font(name)  # the slow system scan
+        cached[name] = path
+        try:
+            _write_json(FONT_CACHE_PATH, cached)
+        except OSError:
+            pass  # read only install, scan again next time
+    _paths[name] = path
+    return path
+
+class LazyFont:
+    # pygame.font.SysFont(name, size) that is only loaded on the first render()
+    def __init__(self, size, name="simhei"):
+        self.size = size
+        self.name = name
+        self.font = None
+
+    def load(self):
+        if self.font is None:
+            self.font = pygame.font.Font(font_path(self.name), self.size)
+        return self.font
+
+    def render(self, text, antialias, color):
+        return self.load().render(text, antialias, color)
+
+class GlyphAtlas:
+    # fixed strings rendered into one image, get() returns a piece of it or None for a string that is not in it
+    def __init__(self, path=ATLAS_PATH):
+        self.path = path
+        self.surface = None
+        self.rects = {}  # (font size, text, color) -> rect in the image
+
+    def _key(self, entries):
+        # changes with the font files, the strings and pygame
+        names = sorted({font.name for font, text, color in entries})
+        text = json.dumps([pygame.version.ver, [font_path(name) for name in names],
+                           [(font.name, font.size, text, list(color)) for font, text, color in entries]])
+        return hashlib.blake2b(text.encode(), digest_size=10).hexdigest()
+
+    def load(self, entries):
+        # True when the atlas on disk matches the entries
+        key = self._key(entries)
+        try:
+            with open(self.path + ".json", encoding="utf-8") as file:
+                index = json.load(file)
+            if index["key"] != key:
+                return False
+            surface = pygame.image.load(self.path)
+        except (OSError, ValueError, KeyError, pygame.error):
+            return False
+        self.surface = surface.convert_alpha() if pygame.display.get_surface() else surface
+        self.rects = {(size, text, tuple(color)): pygame.Rect(rect) for size, text, color, rect in index["entries"]}
+        return True
+
+    def build(self, entries):
+        # render the entries with their fonts, pack them in rows and save the image and its index
+        rendered = [(font, text, color, font.render(text, True, color)) for font, text, color in entries]
+        x = y = row = 0
+        placed = []
+        for font, text, color, surface in rendered:
+            width, height = surface.get_size()
+            if x + width > ATLAS_WIDTH:
+                x, y, row = 0, y + row, 0
+            placed.append((font, text, color, surface, pygame.Rect(x, y, width, height)))
+            x += width
+            row = max(row, height)
+        atlas = pygame.Surface((ATLAS_WIDTH, max(1, y + row)), pygame.SRCALPHA)
+        for font, text, color, surface, rect in placed:
+            atlas.blit(surface, rect, special_flags=pygame.BLEND_RGBA_MAX)  # a copy, alpha included
+        self.surface = atlas
+        self.rects = {(font.size, text, tuple(color)): rect for font, text, color, surface, rect in placed}
+        try:
+            pygame.image.save(atlas, self.path)
+            _write_json(self.path + ".json", {"key": self._key(entries), "entries": [
+                [font.size, text, list(color), list(rect)] for font, text, color, surface, rect in placed]})
+        except (OSError, pygame.error):
+            pass
+
+    def load_or_build(self, entries):
+        if not self.load(entries):
+            self.build(entries)
+
+    def get(self, font, text, color):
+        rect = self.rects.get((font.size, text, color))
+        return None if rect is None else self.surface.subsurface(rect)
+
+def _first_frame_ms(code):
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", PYGAME_HIDE_SUPPORT_PROMPT="1")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env, check=True)
+    return (time.perf_counter() - start) * 1000
+
+FIRST_FRAME = ("import Elemental_Master_Force_Grey as ui, force_grey_engine as engine; ui.init_display(); "
+               "ui.draw_frame(ui.screen, engine.Game()); ui.pygame.display.flip()")
+
+def startup_ms(repeat=3):
+    # milliseconds from a new interpreter to the first frame of the start page: without the caches, and with them
+    cold = []
+    for _ in range(repeat):
+        for path in (FONT_CACHE_PATH, ATLAS_PATH, ATLAS_PATH + ".json"):
+            if os.path.exists(path):
+                os.remove(path)
+        cold.append(_first_frame_ms(FIRST_FRAME))
+    warm = min(_first_frame_ms(FIRST_FRAME) for _ in range(repeat))
+    return {"cold_start_ms": min(cold), "warm_start_ms": warm}
+
+def main():
+    result = startup_ms()
+    print(f"first frame: {result['cold_start_ms']:.0f}ms without the font and atlas caches, "
+          f"{result['warm_start_ms']:.0f}ms with them")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+# fights against groups of enemies for Force_Grey
+# a Horde keeps its members as numpy arrays (hp, stacks, ...) so damage, resistances, buffs and the burn at the end
+# of the turn are one pass over the whole group, not a python call per enemy. the physical attack, the normal and the
+# charged magic hit one target, the double magic and burn/rupture/tremor hit every member that is still alive.
+# every effect of the registry works on a horde: its hooks run on the members that have it.
+# HordeGame is a Game that plays the encounters of force_grey_content.json, so the simulator policies,
+# play_turn/run_dungeon and TurnScheduler drive it unchanged. it has no snapshot() yet, so the tree search
+# (--policy mcts) and save files don't work on it.
+# usage: python force_grey_horde.py --encounter "Goblin horde" -n 200 --policy area_first
+import argparse
+import random
+import time
+
+import numpy as np
+
+from force_grey_content import get_content
+from force_grey_engine import BREAK, BURN, EFFECT_SLOTS, EFFECTS, SHOCK, Character, Game, PlayerAction
+from force_grey_log import (LOG_MEET, LOG_PHYSICAL_HIT, LOG_RUPTURE_DECAY, LOG_BEAT, LOG_NO_MANA, LOG_DOUBLE_TOTAL,
+                            LOG_EFFECT_END, LOG_EFFECT_TICK, LOG_AREA_HIT, LOG_HORDE_FELL, LOG_HORDE_STUNNED,
+                            LOG_HORDE_HIT)
+
+def _damage(damage, defense, resistance):
+    # Character.take_damage for arrays
+    return np.maximum(1, np.trunc((damage - defense) * resistance).astype(np.int64))
+
+def _group_burn(horde, members):
+    # Burn.on_turn_start for many members at once: 1% max hp per stack, then one stack less. returns the damage
+    stacks = horde.stacks[BURN]
+    damage = np.trunc(horde.max_health[members] * (stacks[members] * 0.01)).astype(np.int64)
+    hp = horde.health[members] - damage
+    horde.health[members] = np.maximum(hp, 0)
+    horde.alive[members[hp <= 0]] = False
+    stacks[members] -= 1
+    horde.turns[BURN, members[stacks[members] == 0]] = 0
+    return int(damage.sum())
+
+# array versions of on_turn_start hooks by effect slot, the effects without one go through their hook member by member
+GROUP_TURN_START = {BURN: _group_burn}
+
+class Horde:
+    # the members of one encounter as arrays, index i is the i-th member. stacks and turns have a row per registered
+    # effect (in slot order) like Character.effect_stacks and effect_turns, the hooks of the effect registry run on
+    # them: on_hit for the member hit, on_turn_start and on_expire for every member that has the effect.
+    # for the simulator policies and run_dungeon it also looks like one big enemy: hp and max_hp are the totals
+    # of the group, is_alive() and has_status_effect() are true when any member is
+    def __init__(self, name, kinds):
+        self.name = name
+        self.names = [kind.name for kind in kinds]
+        self.max_health = np.array([kind.max_hp for kind in kinds], dtype=np.int64)
+        self.health = self.max_health.copy()  # hp of each member
+        self.attack = np.array([kind.attack for kind in kinds], dtype=np.int64)
+        self.defense = np.array([kind.defense for kind in kinds], dtype=np.int64)
+        self.resistance = {"physical": np.array([kind.physical_resistance for kind in kinds]),
+                           "magic": np.array([kind.magic_resistance for kind in kinds])}
+        self.alive = np.ones(len(kinds), dtype=bool)
+        self.stunned = np.zeros(len(kinds), dtype=bool)
+        self.stacks = np.zeros((len(EFFECTS), len(kinds)), dtype=np.int64)
+        self.turns = np.zeros((len(EFFECTS), len(kinds)), dtype=np.int64)
+        self.scratch = Character("", 1, 0, 0, 0)  # one member at a time, for the hooks of the effects
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def size(self):
+        # members still alive
+        return int(np.count_nonzero(self.alive))
+
+    @property
+    def hp(self):
+        return int(self.health.sum())
+
+    @property
+    def max_hp(self):
+        return int(self.max_health.sum())
+
+    def is_alive(self):
+        return bool(self.alive.any())
+
+    def has_status_effect(self, effect_name):
+        return bool((self.stacks[EFFECT_SLOTS[effect_name]] > 0).any())
+
+    def status_stacks(self, effect_name):
+        return int(self.stacks[EFFECT_SLOTS[effect_name]].max())
+
+    def first_alive(self):
+        return int(np.argmax(self.alive)) if self.alive.any() else -1
+
+    def member(self, index):
+        # the member as a Character (the same scratch object every time), put it back with store()
+        member = self.scratch
+        member.name = self.names[index]
+        member.hp = int(self.health[index])
+        member.max_hp = int(self.max_health[index])
+        member.attack = int(self.attack[index])
+        member.defense = int(self.defense[index])
+        member.physical_resistance = float(self.resistance["physical"][index])
+        member.magic_resistance = float(self.resistance["magic"][index])
+        member.alive = bool(self.alive[index])
+        member.stunned = bool(self.stunned[index])
+        member.effect_stacks[:] = self.stacks[:, index].tolist()
+        member.effect_turns[:] = self.turns[:, index].tolist()
+        member._refresh_effects()
+        return member
+
+    def store(self, index, member):
+        self.health[index] = member.hp
+        self.alive[index] = member.alive
+        self.stunned[index] = member.stunned
+        self.stacks[:, index] = member.effect_stacks
+        self.turns[:, index] = member.effect_turns
+
+    def hit(self, targets, damage, damage_type):
+        # damage (one number or one per target) to the members at index array targets, returns the damage dealt each
+        actual = _damage(damage, self.defense[targets], self.resistance[damage_type][targets])
+        hp = self.health[targets] - actual
+        self.health[targets] = np.maximum(hp, 0)
+        self.alive[targets] = hp > 0
+        return actual
+
+    def add_status_effect(self, effect_name, duration=0, stacks=1):
+        # Character.add_status_effect on every member alive
+        slot = EFFECT_SLOTS[effect_name]
+        members = np.flatnonzero(self.alive)
+        has = self.stacks[slot, members] > 0
+        self.stacks[slot, members] += stacks
+        if duration > 0:
+            self.turns[slot, members[has]] = np.maximum(self.turns[slot, members[has]], duration)
+        self.turns[slot, members[~has]] = duration
+
+    def process_status_effects(self):
+        # start of the group's turn, Character.process_status_effects for every member alive: the on_turn_start
+        # hooks in slot order, then the effects with a duration count down.
+        # returns (log events, one line per effect and not per member, damage in total, members killed)
+        events = []
+        before = self.alive.copy()
+        total = 0
+        for effect in EFFECTS:
+            if effect.on_turn_start is None:
+                continue
+            members = np.flatnonzero(self.alive & (self.stacks[effect.slot] > 0))
+            if not len(members):
+                continue
+            group = GROUP_TURN_START.get(effect.slot)
+            if group is not None:
+                damage = group(self, members)
+            else:
+                damage = 0
+                for index in members.tolist():
+                    member = self.member(index)
+                    damage += effect.on_turn_start(member, [])
+                    self.store(index, member)
+            if damage:
+                events.append((LOG_EFFECT_TICK, self.name, damage, effect.slot))
+            total += damage
+        counting = (self.turns > 0) & self.alive
+        if counting.any():
+            self.turns[counting] -= 1
+            expired = counting & (self.turns <= 0)
+            for slot in np.flatnonzero(expired.any(axis=1)).tolist():
+                members = np.flatnonzero(expired[slot])
+                self.stacks[slot, members] = 0
+                events.append((LOG_EFFECT_END, self.name, 0, slot))
+                effect = EFFECTS[slot]
+                if effect.on_expire is not None:
+                    for index in members.tolist():
+                        member = self.member(index)
+                        effect.on_expire(member, [])
+                        self.store(index, member)
+        return events, total, int(np.count_nonzero(before & ~self.alive))
+
+    @property
+    def physical_resistance(self):
+        return float(self.resistance["physical"][self.alive].mean()) if self.alive.any() else 0.0
+
+    @property
+    def magic_resistance(self):
+        return float(self.resistance["magic"][self.alive].mean()) if self.alive.any() else 0.0
+
+class HordeGame(Game):
+    # Game for encounters with many enemies, current_enemy is the Horde being fought. the player's side (perform,
+    # mana, heal, charge, the log) is Game's, only the hits and the enemies' turn work on the whole group.
+    # encounters: names of force_grey_content.json encounters to fight in order, all of them by default
+    def __init__(self, seed=None, encounters=None, content=None, rng="exact"):
+        self.chosen = encounters
+        self.target = 0  # member hit by the single target attacks, the first one alive if it is dead
+        super().__init__(seed, content, rng)
+        self.enemy_rng = np.random.default_rng(self.seed)  # the rolls of a whole group at once
+
+    def _roster(self, content):
+        self.encounters = content.encounters
+        roster = tuple(self.encounters) if self.chosen is None else tuple(self.chosen)
+        unknown = [name for name in roster if name not in self.encounters]
+        if unknown:
+            raise ValueError(f"unknown encounters: {', '.join(unknown)}")
+        return roster
+
+    def new_enemy(self):
+        if self.enemy_index < len(self.roster):
+            name = self.roster[self.enemy_index]
+            self.current_enemy = Horde(name, self.encounters[name])
+            self.enemy_index += 1
+            self.target = 0
+            self.game_state = "battle"
+            self.log(LOG_MEET, f"{name} ({len(self.current_enemy)} enemies)")
+        else:
+            self.game_state = "victory"
+
+    def snapshot(self, include_rng=True):
+        raise NotImplementedError("a HordeGame has no snapshot, search and save files work on Game")
+
+    def restore(self, snapshot):
+        raise NotImplementedError("a HordeGame has no snapshot, search and save files work on Game")
+
+    def _target(self):
+        horde = self.current_enemy
+        if not horde.alive[self.target]:
+            self.target = horde.first_alive()
+        return self.target
+
+    def single_target(self):
+        # a copy of the member being hit (the horde's scratch Character), for the damage tables
+        return self.current_enemy.member(self._target())
+
+    def enemy_attacks(self):
+        # the members that reach the player and are not stunned, like enemy_attack()
+        horde = self.current_enemy
+        front = np.flatnonzero(horde.alive)[:self.rules.horde_reach]
+        return tuple(horde.attack[front[~horde.stunned[front]]].tolist())
+
+    def _after_attack(self, killed):
+        # mana for every member killed by the player's action, then the enemy's turn or the next encounter
+        horde = self.current_enemy
+        if killed:
+            self.player.restore_magic(self.rules.kill_mana * killed)
+            self.log(LOG_HORDE_FELL, horde.name, killed, horde.size)
+        if not horde.is_alive():
+            self.log(LOG_BEAT, horde.name)
+            self.game_state = "enemy_defeated"
+        else:
+            self.game_state = "enemy_turn"
+
+    def player_attack(self):
+        # one target, through the on_hit hooks of its effects like Game.player_attack
+        horde = self.current_enemy
+        target = self._target()
+        member = horde.member(target)
+        spell = self.spells["attack"]
+        damage = member.on_hit(self.player.attack + self.rng.randint(spell.low, spell.high))
+        self.attack_count += 1
+        if member.effect_stacks[SHOCK] == 0:
+            member.add_status_effect("shock", 0, 1)
+        actual = member.take_damage(damage, "physical")
+        horde.store(target, member)
+        self.log(LOG_PHYSICAL_HIT, member.name, actual)
+        if member.effect_stacks[BREAK] > 0:
+            self.log(LOG_RUPTURE_DECAY, member.name)
+        self._after_attack(0 if member.alive else 1)
+
+    def _magic_hit(self, damage, kind):
+        # the normal magic and the released charge hit one member
+        horde = self.current_enemy
+        target = self._target()
+        actual = int(horde.hit(np.array([target]), damage, "magic")[0])
+        self.log(kind, horde.names[target], actual)
+        self._after_attack(0 if horde.alive[target] else 1)
+
+    def _double_magic_attack(self):
+        # every hit lands on every member alive, one roll per hit like Game
+        spell = self.spells["double"]
+        if self.player.use_magic(spell.cost):
+            horde = self.current_enemy
+            before = horde.size
+            total_damage = 0
+            for _ in range(spell.hits):
+                targets = np.flatnonzero(horde.alive)
+                if not len(targets):
+                    break
+                actual = horde.hit(targets, self._spell_damage(spell), "magic")
+                total_damage += int(actual.sum())
+                self.log(LOG_AREA_HIT, horde.name, int(actual.sum()), len(targets))
+            self.log(LOG_DOUBLE_TOTAL, horde.name, total_damage)
+            self._after_attack(before - horde.size)
+        else:
+            self.log(LOG_NO_MANA)
+            self.game_state = "player_turn"
+
+    def enemy_attack(self):
+        # the first rules.horde_reach members alive can reach the player, those that are not stunned attack.
+        # every stunned member loses its stun and a tremor stack
+        horde = self.current_enemy
+        stunned = horde.alive & horde.stunned
+        if stunned.any():
+            self.log(LOG_HORDE_STUNNED, horde.name, int(np.count_nonzero(stunned)))
+            horde.stunned[stunned] = False
+            shock = horde.stacks[SHOCK]
+            shock[stunned] = np.maximum(shock[stunned] - 1, 0)
+            horde.turns[SHOCK, stunned & (shock == 0)] = 0
+        front = np.flatnonzero(horde.alive)[:self.rules.horde_reach]
+        attackers = front[~stunned[front]]
+        if len(attackers):
+            rolls = self.enemy_rng.integers(self.rules.enemy_roll_low, self.rules.enemy_roll_high + 1, len(attackers))
+            player = self.player
+            actual = _damage(horde.attack[attackers] + rolls, player.defense, player.physical_resistance)
+            total = int(actual.sum())
+            player.hp = max(player.hp - total, 0)
+            player.alive = player.hp > 0
+            self.log(LOG_HORDE_HIT, horde.name, total, len(attackers))
+        self.game_state = "player_turn" if self.player.is_alive() else "defeat"
+
+    def update(self):
+        if self.game_state == "enemy_turn":
+            # the effects of the whole group, array hooks in one pass
+            horde = self.current_enemy
+            events, damage, killed = horde.process_status_effects()
+            for event in events:
+                self.log(*event)
+            if killed:
+                self.player.restore_magic(self.rules.kill_mana * killed)
+                self.log(LOG_HORDE_FELL, horde.name, killed, horde.size)
+                if not horde.is_alive():
+                    self.log(LOG_BEAT, horde.name)
+                    self.game_state = "enemy_defeated"
+                    return
+            self.enemy_attack()
+        elif self.game_state == "enemy_defeated":
+            self.new_enemy()
+            self.attack_count = 0
+
+def area_first(game):
+    # policy for groups: the double magic hits everyone, heal when low, physical attacks while the mana comes back
+    player = game.player
+    if player.hp < player.max_hp // 3 and player.magic_points >= game.action_cost(PlayerAction.HEAL):
+        return PlayerAction.HEAL
+    if player.magic_points >= game.action_cost(PlayerAction.DOUBLE):
+        return PlayerAction.DOUBLE
+    return PlayerAction.ATTACK
+
+def bench_turns(encounter, turns=2000, policy=None, seed=0):
+    # milliseconds per turn (the player's action and the whole group's answer) against one encounter,
+    # returns (mean, 99th percentile)
+    from force_grey_sim import play_turn
+    policy = policy or area_first
+    times = []
+    game = HordeGame(seed, [encounter])
+    while len(times) < turns:
+        if game.game_state == "battle":
+            game.game_state = "player_turn"
+        if game.game_state != "player_turn":
+            seed += 1
+            game = HordeGame(seed, [encounter])
+            continue
+        start = time.perf_counter()
+        play_turn(game, policy(game))
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return sum(times) / len(times) * 1000, times[int(len(times) * 0.99)] * 1000
+
+def main():
+    from force_grey_sim import POLICIES, run_dungeon
+    parser = argparse.ArgumentParser(description="fights against groups of enemies")
+    parser.add_argument("--encounter", action="append", help="encounter of the content file, all of them by default")
+    parser.add_argument("-n", "--runs", type=int, default=100)
+    policies = ["area_first"] + [name for name in POLICIES if name != "mcts"]
+    parser.add_argument("--policy", default="area_first", help=", ".join(policies))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.policy == "mcts":
+        parser.error("--policy mcts searches on Game snapshots, a HordeGame has none")
+    if args.policy not in policies:
+        parser.error(f"unknown policy {args.policy}, choose from {', '.join(policies)}")
+
+    encounters = args.encounter or list(get_content().encounters)
+    policy = area_first if args.policy == "area_first" else POLICIES[args.policy]
+    random.seed(args.seed)
+    seeds = random.Random(args.seed)
+    wins = {name: 0 for name in encounters}
+    for _ in range(args.runs):
+        fights, cleared = run_dungeon(policy, HordeGame(seeds.getrandbits(64), encounters))
+        for name, won, turns, hp, mp in fights:
+            wins[name] += won
+    for name in encounters:
+        size = len(get_content().encounters[name])
+        mean, p99 = bench_turns(name, policy=policy, seed=args.seed)
+        print(f"{name} ({size} enemies): reached and won {wins[name]}/{args.runs}, "
+              f"{mean:.3f}ms per turn, p99 {p99:.3f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+# vectorized battle kernel for Force_Grey
+# holds K full dungeon runs as numpy arrays (struct of arrays) and advances all of them one turn per step,
+# following the same rules as Character.take_damage, apply_break_effect, apply_shock_effect,
+# process_status_effects and the Game attack methods in force_grey_engine.py
+# usage: python force_grey_kernel.py --check   (parity against the scalar engine)
+#        python force_grey_kernel.py --bench   (throughput against the scalar engine)
+import argparse
+import random
+import time
+
+import numpy as np
+
+from force_grey_engine import Game, PlayerAction
+from force_grey_sim import POLICIES, SimulationReport, run_dungeon
+
+# action codes are the PlayerAction values, 0 means "no action" for finished battles
+ATTACK = PlayerAction.ATTACK.value
+NORMAL = PlayerAction.NORMAL.value
+DOUBLE = PlayerAction.DOUBLE.value
+CHARGE = PlayerAction.CHARGE.value
+BURN = PlayerAction.BURN.value
+RUPTURE = PlayerAction.RUPTURE.value
+TREMOR = PlayerAction.TREMOR.value
+HEAL = PlayerAction.HEAL.value
+
+# battle states
+RUNNING = 0
+VICTORY = 1
+DEFEAT = 2
+
+MAX_STEPS = 3000  # safety net, like force_grey_sim.MAX_TURNS
+
+class NumpyRolls:
+    # fast dice, one numpy generator for the whole batch
+    def __init__(self, seed=None):
+        self.generator = np.random.default_rng(seed)
+
+    def randint(self, low, high, lanes):
+        return self.generator.integers(low, high + 1, size=len(lanes))
+
+class ScalarRolls:
+    # one random.Random per battle drawing in the same order as the scalar engine,
+    # so battle i matches Game(seeds[i]). slow, only for checks
+    def __init__(self, seeds):
+        self.streams = [random.Random(seed) for seed in seeds]
+
+    def randint(self, low, high, lanes):
+        return np.array([self.streams[i].randint(low, high) for i in lanes], dtype=np.int64)
+
+def _damage(damage, defense, resistance):
+    # vector version of the formula in Character.take_damage
+    return np.maximum(1, np.trunc((damage - defense) * resistance).astype(np.int64))
+
+class BattleBatch:
+    def __init__(self, size, seed=None, rolls=None):
+        # stats are read from a fresh Game so the kernel follows the engine's roster
+        reference = Game()
+        player = reference.player
+        self.size = size
+        self.rolls = rolls if rolls is not None else NumpyRolls(seed)
+        self.costs = np.array([0] + [reference.action_cost(action) for action in PlayerAction], dtype=np.int64)
+
+        self.player_max_hp = player.max_hp
+        self.player_max_mp = player.max_magic_points
+        self.player_attack = player.attack
+        self.player_defense = player.defense
+        self.player_magic = player.magic_power
+        self.player_physical_resistance = player.physical_resistance
+
+        self.spells = reference.spells
+        self.rules = reference.rules
+        roster = reference.roster
+        self.enemy_names = [enemy.name for enemy in roster]
+        self.enemy_max_hp = np.array([enemy.max_hp for enemy in roster], dtype=np.int64)
+        self.enemy_attack = np.array([enemy.attack for enemy in roster], dtype=np.int64)
+        self.enemy_defense = np.array([enemy.defense for enemy in roster], dtype=np.int64)
+        self.enemy_physical_resistance = np.array([enemy.physical_resistance for enemy in roster])
+        self.enemy_magic_resistance = np.array([enemy.magic_resistance for enemy in roster])
+        enemies = len(roster)
+
+        # player side
+        self.hp = np.full(size, player.hp, dtype=np.int64)
+        self.mp = np.full(size, player.magic_points, dtype=np.int64)
+        self.charging = np.zeros(size, dtype=bool)
+        # enemy side, enemy_index points into the enemy tables
+        self.enemy_index = np.zeros(size, dtype=np.int64)
+        self.enemy_hp = np.full(size, self.enemy_max_hp[0], dtype=np.int64)
+        self.burn = np.zeros(size, dtype=np.int64)
+        self.rupture = np.zeros(size, dtype=np.int64)
+        self.shock = np.zeros(size, dtype=np.int64)
+        self.stunned = np.zeros(size, dtype=bool)
+        # bookkeeping
+        self.state = np.full(size, RUNNING, dtype=np.int8)
+        self.turns = np.zeros(size, dtype=np.int64)
+        self.kill_turns = np.full((size, enemies), -1, dtype=np.int64)  # -1 means the enemy was not beaten
+        self.kill_hp = np.zeros((size, enemies), dtype=np.int64)
+        self.kill_mp = np.zeros((size, enemies), dtype=np.int64)
+
+    def running(self):
+        return self.state == RUNNING
+
+    def _hit_enemy(self, lanes, damage, resistance):
+        enemy = self.enemy_index[lanes]
+        actual = _damage(damage, self.enemy_defense[enemy], resistance[enemy])
+        self.enemy_hp[lanes] = np.maximum(self.enemy_hp[lanes] - actual, 0)
+
+    def _spell_damage(self, spell, base, lanes):
+        # int((base + roll) * multiplier) like the engine
+        return np.trunc((base + self.rolls.randint(spell.low, spell.high, lanes)) * spell.multiplier).astype(np.int64)
+
+    def _enemy_defeated(self, lanes):
+        enemy = self.enemy_index[lanes]
+        self.mp[lanes] = np.minimum(self.player_max_mp, self.mp[lanes] + self.rules.kill_mana)
+        self.kill_turns[lanes, enemy] = self.turns[lanes]
+        self.kill_hp[lanes, enemy] = self.hp[lanes]
+        self.kill_mp[lanes, enemy] = self.mp[lanes]
+        self.turns[lanes] = 0
+        # next enemy, a brand new Enemy has no status effects
+        enemy = enemy + 1
+        cleared = enemy >= len(self.enemy_names)
+        self.state[lanes[cleared]] = VICTORY
+        self.enemy_index[lanes] = np.minimum(enemy, len(self.enemy_names) - 1)
+        self.enemy_hp[lanes] = self.enemy_max_hp[self.enemy_index[lanes]]
+        self.burn[lanes] = 0
+        self.rupture[lanes] = 0
+        self.shock[lanes] = 0
+        self.stunned[lanes] = False
+
+    def step(self, actions):
+        # play one turn in every running battle, actions holds a PlayerAction value per battle
+        live = self.running()
+        actions = np.where(live, actions, 0)
+        cost = np.where(self.charging & (actions == CHARGE), 0, self.costs[actions])
+        actions = np.where(live & (cost > self.mp), ATTACK, actions)  # not enough mana, fall back to a physical attack
+
+        spells = self.spells
+        lanes = np.flatnonzero(actions == ATTACK)
+        if lanes.size:
+            spell = spells["attack"]
+            damage = self.player_attack + self.rolls.randint(spell.low, spell.high, lanes)
+            # rupture: add the stacks to the damage and lose one stack
+            stacks = self.rupture[lanes]
+            has = stacks > 0
+            damage = damage + np.where(has, stacks, 0)
+            self.rupture[lanes] = stacks - has
+            # tremor: one more stack per hit, at 10 stacks the enemy is stunned and takes double damage
+            stacks = self.shock[lanes]
+            has = stacks > 0
+            stacks = np.where(has, stacks + 1, 1)
+            stun = has & (stacks >= 10)
+            self.shock[lanes] = stacks
+            self.stunned[lanes] |= stun
+            damage = np.where(stun, damage * 2, damage)
+            self._hit_enemy(lanes, damage, self.enemy_physical_resistance)
+
+        for action, name in ((NORMAL, "normal"), (DOUBLE, "double")):
+            lanes = np.flatnonzero(actions == action)
+            if lanes.size:
+                spell = spells[name]
+                self.mp[lanes] -= spell.cost
+                for _ in range(spell.hits if action == DOUBLE else 1):
+                    damage = self._spell_damage(spell, self.player_magic, lanes)
+                    self._hit_enemy(lanes, damage, self.enemy_magic_resistance)
+
+        lanes = np.flatnonzero(actions == CHARGE)
+        if lanes.size:
+            spell = spells["charge"]
+            charged = self.charging[lanes]
+            release = lanes[charged]
+            if release.size:
+                damage = self._spell_damage(spell, self.player_magic, release)
+                self._hit_enemy(release, damage, self.enemy_magic_resistance)
+                self.charging[release] = False
+            start = lanes[~charged]
+            self.mp[start] -= spell.cost
+            self.charging[start] = True
+
+        for action, stacks, name in ((BURN, self.burn, "burn"), (RUPTURE, self.rupture, "rupture"), (TREMOR, self.shock, "tremor")):
+            lanes = np.flatnonzero(actions == action)
+            if lanes.size:
+                self.mp[lanes] -= spells[name].cost
+                stacks[lanes] += spells[name].stacks
+
+        lanes = np.flatnonzero(actions == HEAL)
+        if lanes.size:
+            spell = spells["heal"]
+            self.mp[lanes] -= spell.cost
+            amount = self._spell_damage(spell, spell.base, lanes)
+            self.hp[lanes] = np.minimum(self.player_max_hp, self.hp[lanes] + amount)
+
+        self.turns[live] += 1
+        killed = live & (self.enemy_hp <= 0)
+        self._enemy_defeated(np.flatnonzero(killed))
+
+        # enemy turn, burn first: max hp * stacks% damage and one stack less
+        enemy_turn = live & ~killed
+        burning = enemy_turn & (self.burn > 0)
+        lanes = np.flatnonzero(burning)
+        if lanes.size:
+            burn_damage = np.trunc(self.enemy_max_hp[self.enemy_index[lanes]] * (self.burn[lanes] * 0.01)).astype(np.int64)
+            self.enemy_hp[lanes] = np.maximum(self.enemy_hp[lanes] - burn_damage, 0)
+            self.burn[lanes] -= 1
+        burned = burning & (self.enemy_hp <= 0)
+        self._enemy_defeated(np.flatnonzero(burned))
+
+        # a stunned enemy skips its attack and loses one tremor stack
+        acting = enemy_turn & ~burned
+        stunned = acting & self.stunned
+        lanes = np.flatnonzero(stunned)
+        self.stunned[lanes] = False
+        self.shock[lanes] -= self.shock[lanes] > 0
+
+        lanes = np.flatnonzero(acting & ~stunned)
+        if lanes.size:
+            rolls = self.rolls.randint(self.rules.enemy_roll_low, self.rules.enemy_roll_high, lanes)
+            damage = self.enemy_attack[self.enemy_index[lanes]] + rolls
+            actual = _damage(damage, self.player_defense, self.player_physical_resistance)
+            self.hp[lanes] = np.maximum(self.hp[lanes] - actual, 0)
+            self.state[lanes[self.hp[lanes] <= 0]] = DEFEAT
+
+    def run(self, policy, max_steps=MAX_STEPS):
+        # play every battle to the end with a vector policy from VECTOR_POLICIES
+        steps = 0
+        while steps < max_steps and self.running().any():
+            self.step(policy(self))
+            steps += 1
+        return self
+
+    def to_report(self, policy_name, seconds=0.0):
+        # summary in the same shape as force_grey_sim.simulate
+        report = SimulationReport(policy_name)
+        report.runs = self.size
+        report.victories = int(np.count_nonzero(self.state == VICTORY))
+        report.seconds = seconds
+        reached = self.size
+        for column, name in enumerate(self.enemy_names):
+            if reached == 0:
+                break
+            report.add_enemy(name)
+            stats = report.enemies[name]
+            won = self.kill_turns[:, column] >= 0
+            stats.fights = reached
+            stats.wins = int(np.count_nonzero(won))
+            for stat, values in ((stats.turns, self.kill_turns), (stats.player_hp, self.kill_hp), (stats.player_mp, self.kill_mp)):
+                values = values[won, column]
+                stat.n = stats.wins
+                stat.total = int(values.sum())
+                stat.total_sq = int((values * values).sum())
+            report.battles += reached
+            reached = stats.wins
+        return report
+
+# vector versions of the policies in force_grey_sim, they must make the same choice for the same state
+def always_physical(batch):
+    return np.full(batch.size, ATTACK)
+
+def burn_then_normal(batch):
+    return np.where((batch.burn == 0) & (batch.mp >= 12), BURN, np.where(batch.mp >= 10, NORMAL, ATTACK))
+
+def charge_cycle(batch):
+    return np.where(batch.charging | (batch.mp >= 20), CHARGE, ATTACK)
+
+def rupture_then_physical(batch):
+    return np.where((batch.rupture == 0) & (batch.mp >= 12), RUPTURE, ATTACK)
+
+def heal_when_low(batch):
+    return np.where((batch.hp < batch.player_max_hp // 3) & (batch.mp >= 15), HEAL, charge_cycle(batch))
+
+def every_action(batch):
+    return (batch.hp + batch.enemy_hp) % len(PlayerAction) + 1
+
+VECTOR_POLICIES = {
+    "physical": always_physical,
+    "burn_normal": burn_then_normal,
+    "charge_cycle": charge_cycle,
+    "rupture_physical": rupture_then_physical,
+    "heal_when_low": heal_when_low,
+    "every_action": every_action,
+}
+
+def simulate(runs, policy_name="charge_cycle", seed=0, batch_size=100000):
+    # like force_grey_sim.simulate, but in batches through the kernel on one core
+    report = SimulationReport(policy_name)
+    seeds = np.random.SeedSequence(seed).spawn((runs + batch_size - 1) // batch_size)
+    start = time.perf_counter()
+    left = runs
+    for batch_seed in seeds:
+        batch = BattleBatch(min(batch_size, left), batch_seed)
+        report.merge(batch.run(VECTOR_POLICIES[policy_name]).to_report(policy_name))
+        left -= batch.size
+    report.seconds = time.perf_counter() - start
+    return report
+
+def verify_parity(runs=1000, policy_name="charge_cycle", seed=0):
+    # play the same seeds through the scalar engine and the kernel, returns the battles that differ
+    seeds = [seed * 1000003 + i for i in range(runs)]
+    batch = BattleBatch(runs, rolls=ScalarRolls(seeds)).run(VECTOR_POLICIES[policy_name])
+    mismatches = []
+    for lane, lane_seed in enumerate(seeds):
+        game = Game(lane_seed)
+        fights, cleared = run_dungeon(POLICIES[policy_name], game)
+        expected = [cleared, game.player.hp, game.player.magic_points, game.player.charging]
+        got = [bool(batch.state[lane] == VICTORY), int(batch.hp[lane]), int(batch.mp[lane]), bool(batch.charging[lane])]
+        for column, (name, won, turns, hp, mp) in enumerate(fights):
+            expected.append((won, turns if won else -1, hp if won else 0, mp if won else 0))
+            won_here = bool(batch.kill_turns[lane, column] >= 0)
+            got.append((won_here, int(batch.kill_turns[lane, column]), int(batch.kill_hp[lane, column]), int(batch.kill_mp[lane, column])))
+        if not cleared:
+            # the enemy that beat the player, compared by hp left and status stacks
+            enemy = game.current_enemy
+            expected.append((enemy.hp, *(enemy.status_stacks(name) for name in ("burn", "break", "shock"))))
+            got.append((int(batch.enemy_hp[lane]), int(batch.burn[lane]), int(batch.rupture[lane]), int(batch.shock[lane])))
+        if expected != got:
+            mismatches.append((lane_seed, expected, got))
+    return mismatches
+
+def benchmark(runs=200000, policy_name="charge_cycle", scalar_runs=5000):
+    # battles per second of the scalar engine against the kernel, on one core
+    random.seed(0)
+    start = time.perf_counter()
+    battles = 0
+    for _ in range(scalar_runs):
+        battles += len(run_dungeon(POLICIES[policy_name])[0])
+    scalar_rate = battles / (time.perf_counter() - start)
+    report = simulate(runs, policy_name)
+    kernel_rate = report.battles / report.seconds
+    return scalar_rate, kernel_rate
+
+def main():
+    parser = argparse.ArgumentParser(description="vectorized battle kernel for Force_Grey")
+    parser.add_argument("-n", "--runs", type=int, default=100000, help="number of full dungeon runs")
+    parser.add_argument("--policy", default="charge_cycle", help=", ".join(VECTOR_POLICIES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", action="store_true", help="compare against the scalar engine with the same seeds")
+    parser.add_argument("--bench", action="store_true", help="compare throughput against the scalar engine")
+    args = parser.parse_args()
+
+    if args.check:
+        for name in VECTOR_POLICIES:
+            mismatches = verify_parity(min(args.runs, 2000), name, args.seed)
+            print(f"{name}: {'parity ok' if not mismatches else f'{len(mismatches)} battles differ, first {mismatches[0]}'}")
+    elif args.bench:
+        scalar_rate, kernel_rate = benchmark(args.runs, args.policy)
+        print(f"scalar {scalar_rate:,.0f} battles/s, kernel {kernel_rate:,.0f} battles/s, {kernel_rate / scalar_rate:.1f}x")
+    else:
+        print(simulate(args.runs, args.policy, args.seed).format())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# battle log events of Force_Grey
+# the engine logs (kind, actor, amount, extra) tuples, the text is only made by format_event() when a line
+# is shown, so headless runs never build strings. a LogSpill streams every event to an append only binary
+# file for runs whose whole history is wanted, memory stays at the last LOG_LINES events.
+# usage: python force_grey_log.py battle.fglog      print a spill file as text
+import argparse
+import importlib
+import struct
+from collections import deque
+
+LOG_LINES = 8  # lines kept in memory, the ones on screen
+
+# event kinds
+(LOG_TEXT, LOG_MEET, LOG_MULTIPLIERS, LOG_PHYSICAL_HIT, LOG_RUPTURE_DECAY, LOG_BEAT, LOG_MAGIC_HIT, LOG_NO_MANA,
+ LOG_DOUBLE_HIT, LOG_DOUBLE_TOTAL, LOG_CHARGE_RELEASE, LOG_CHARGE_START, LOG_EFFECT, LOG_HEAL, LOG_STUNNED,
+ LOG_ENEMY_HIT, LOG_BURN_TICK, LOG_EFFECT_END, LOG_BURN_KILL, LOG_EFFECT_TICK, LOG_AREA_HIT, LOG_HORDE_FELL,
+ LOG_HORDE_STUNNED, LOG_HORDE_HIT) = range(24)
+
+# by effect slot, filled by force_grey_engine.register_effect()
+EFFECT_LABELS = []       # extra of LOG_EFFECT and LOG_EFFECT_TICK
+EFFECT_END_NAMES = []    # extra of LOG_EFFECT_END, same as force_grey_engine.EFFECT_NAMES
+
+# kind -> function(actor, amount, extra) giving the line shown in the battle log
+LOG_FORMATS = {
+    LOG_TEXT: lambda actor, amount, extra: actor,
+    LOG_MEET: lambda actor, amount, extra: f"fall in battle with {actor}！",
+    LOG_MULTIPLIERS: lambda actor, amount, extra: f"{actor}'s physical multiplier:{amount}, magical multiplier:{extra}",
+    LOG_PHYSICAL_HIT: lambda actor, amount, extra: f"You dealt {int(amount)} points of physical damage to {actor}！",
+    LOG_RUPTURE_DECAY: lambda actor, amount, extra: f"{actor}'s rupture buff decrease 1 stack!",
+    LOG_BEAT: lambda actor, amount, extra: f"you have beat {actor}！",
+    LOG_MAGIC_HIT: lambda actor, amount, extra: f"You dealt {int(amount)} points of magical damage to {actor}！",
+    LOG_NO_MANA: lambda actor, amount, extra: "No enough mana！",
+    LOG_DOUBLE_HIT: lambda actor, amount, extra: f"Your magic attack {int(extra)} dealt {int(amount)} points of magical damage！",
+    LOG_DOUBLE_TOTAL: lambda actor, amount, extra: f"The double magic dealt total damage: {int(amount)}！",
+    LOG_CHARGE_RELEASE: lambda actor, amount, extra:
+        f"Charging ends！you dealt {int(amount)} points of magical damage to {actor}！",
+    LOG_CHARGE_START: lambda actor, amount, extra: "Start to charge, the charge is going to ends at next turn！",
+    LOG_EFFECT: lambda actor, amount, extra: f"You dealt ({int(amount)}) {EFFECT_LABELS[int(extra)]} to {actor}！",
+    LOG_HEAL: lambda actor, amount, extra: f"You heal yourself {int(amount)} points of heal points！",
+    LOG_STUNNED: lambda actor, amount, extra: f"{actor} is shocked, can't move this turn！",
+    LOG_ENEMY_HIT: lambda actor, amount, extra: f"{actor} dealt {int(amount)} points of physical damage to you！",
+    LOG_BURN_TICK: lambda actor, amount, extra: f"{actor}affected by the burn，lost{int(amount)}heal points",
+    LOG_EFFECT_END: lambda actor, amount, extra: f"{actor}'s{EFFECT_END_NAMES[int(extra)]}ends.",
+    LOG_BURN_KILL: lambda actor, amount, extra: f"{actor} is bitten down due to the negative buff！",
+    LOG_EFFECT_TICK: lambda actor, amount, extra:
+        f"{actor} affected by the {EFFECT_LABELS[int(extra)].lower()}, lost {int(amount)} heal points",
+    # a group of enemies (force_grey_horde.py), the actor is the name of the group
+    LOG_AREA_HIT: lambda actor, amount, extra:
+        f"You dealt {int(amount)} points of magical damage to {int(extra)} enemies of {actor}！",
+    LOG_HORDE_FELL: lambda actor, amount, extra: f"{int(amount)} of {actor} fell, {int(extra)} left！",
+    LOG_HORDE_STUNNED: lambda actor, amount, extra: f"{int(amount)} of {actor} are shocked, can't move this turn！",
+    LOG_HORDE_HIT: lambda actor, amount, extra:
+        f"{actor} attacked {int(extra)} times, dealt {int(amount)} points of physical damage to you！",
+}
+
+def format_event(event):
+    kind, actor, amount, extra = event
+    return LOG_FORMATS[kind](actor, amount, extra)
+
+# spill file: a header, then records. a record is an event (kind, actor id, amount, extra) or,
+# the first time a name shows up, a name record (NAME_TAG, id, length, utf-8 bytes) giving the id its text
+SPILL_MAGIC = b"FGLG"
+SPILL_VERSION = 1
+SPILL_HEADER = struct.Struct("<4sB")
+EVENT_RECORD = struct.Struct("<BHdd")
+NAME_RECORD = struct.Struct("<BHH")
+NAME_TAG = 255
+READ_CHUNK = 1 << 20  # bytes read at a time, a spill of any size is read in bounded memory
+
+class LogSpill:
+    # append only binary file with every event of one or more games
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self.file = open(path, "ab", buffering=buffer_size)
+        if self.file.tell() == 0:
+            self.file.write(SPILL_HEADER.pack(SPILL_MAGIC, SPILL_VERSION))
+            self.names = {}
+        else:
+            # appending to an old file, its name ids are already taken
+            self.names = {name: index for index, name in enumerate(_read_names(path))}
+        self.events = 0
+
+    def write(self, event):
+        kind, actor, amount, extra = event
+        name_id = self.names.get(actor)
+        if name_id is None:
+            # checked before the name gets its id, the table only holds names the file has
+            if len(self.names) > 0xFFFF:
+                raise ValueError("too many different names for one spill file")
+            name_id = self.names[actor] = len(self.names)
+            data = actor.encode()
+            self.file.write(NAME_RECORD.pack(NAME_TAG, name_id, len(data)) + data)
+        self.file.write(EVENT_RECORD.pack(kind, name_id, amount, extra or 0))
+        self.events += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _records(path, chunk_size=READ_CHUNK):
+    # (tag, fields) for every record of a spill file, read chunk_size bytes at a time. a record cut by the end
+    # of a chunk waits for the next one
+    with open(path, "rb") as file:
+        data = file.read(max(chunk_size, SPILL_HEADER.size))
+        if len(data) < SPILL_HEADER.size:
+            raise ValueError("not a Force_Grey log spill")
+        magic, version = SPILL_HEADER.unpack_from(data)
+        if magic != SPILL_MAGIC or version != SPILL_VERSION:
+            raise ValueError("not a Force_Grey log spill or an unsupported version")
+        offset = SPILL_HEADER.size
+        while True:
+            while offset < len(data):
+                if data[offset] == NAME_TAG:
+                    start = offset + NAME_RECORD.size
+                    if start > len(data):
+                        break
+                    _, name_id, length = NAME_RECORD.unpack_from(data, offset)
+                    if start + length > len(data):
+                        break
+                    yield NAME_TAG, (name_id, data[start:start + length].decode())
+                    offset = start + length
+                else:
+                    if offset + EVENT_RECORD.size > len(data):
+                        break
+                    yield None, EVENT_RECORD.unpack_from(data, offset)
+                    offset += EVENT_RECORD.size
+            more = file.read(chunk_size)
+            if not more:
+                break
+            data = data[offset:] + more
+            offset = 0
+    if offset < len(data):
+        raise ValueError("the spill file ends in the middle of a record")
+
+def _read_names(path):
+    return [fields[1] for tag, fields in _records(path) if tag == NAME_TAG]
+
+def read_spill(path):
+    # every event of a spill file, in order, as (kind, actor, amount, extra)
+    names = {}
+    for tag, fields in _records(path):
+        if tag == NAME_TAG:
+            names[fields[0]] = fields[1]
+        else:
+            kind, name_id, amount, extra = fields
+            yield kind, names[name_id], amount, extra
+
+def main():
+    parser = argparse.ArgumentParser(description="print a Force_Grey log spill file")
+    parser.add_argument("path")
+    parser.add_argument("--tail", type=int, default=0, help="only the last N lines")
+    args = parser.parse_args()
+    importlib.import_module("force_grey_engine")  # registers the effect names the lines use
+    events = read_spill(args.path)
+    if args.tail:
+        events = deque(events, maxlen=args.tail)  # only the last lines are kept, not the whole file
+    for event in events:
+        print(format_event(event))
+
+if __name__ == "__main__":
+    main()
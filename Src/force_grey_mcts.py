@@ -0,0 +1,194 @@
+# monte carlo tree search advisor for Force_Grey
+# picks the player's action by playing many random continuations of the current fight with the real engine.
+# the tree is open loop (it keeps statistics per action sequence, the dice are re-rolled every iteration),
+# so after the real action the matching subtree can be kept for the next turn.
+# usage: python force_grey_mcts.py --budget 0.05 --runs 20 --workers 4
+import argparse
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+
+from force_grey_engine import Game, PlayerAction
+from force_grey_sim import SimulationReport, charge_cycle, play_turn, run_dungeon
+
+EXPLORATION = 0.7   # UCB1 exploration constant, rewards are between 0 and 1
+ROLLOUT_TURNS = 60  # a rollout stops after this many turns even if the fight is not over
+
+class Node:
+    __slots__ = ("children", "visits", "value")
+
+    def __init__(self):
+        self.children = {}  # PlayerAction -> Node
+        self.visits = 0
+        self.value = 0.0    # sum of rewards
+
+def fight_over(game, enemy):
+    return game.current_enemy is not enemy or game.game_state in ("victory", "defeat")
+
+def reward(game, enemy):
+    # 0..1 score of a finished or cut off rollout: winning counts most, then the hp and mp kept for later fights
+    player = game.player
+    if not enemy.is_alive():
+        return 0.6 + 0.3 * player.hp / player.max_hp + 0.1 * player.magic_points / player.max_magic_points
+    if not player.is_alive():
+        return 0.3 * (1 - enemy.hp / enemy.max_hp)
+    return 0.3 + 0.3 * (1 - enemy.hp / enemy.max_hp) * player.hp / player.max_hp
+
+class MCTSAgent:
+    def __init__(self, budget=0.05, workers=1, seed=None):
+        self.budget = budget    # seconds of search per move
+        self.workers = workers  # > 1 runs extra independent searches in a process pool and merges them
+        self.rng = random.Random(seed)
+        # scratch game for the search, the real game is never touched. its rolls come in numpy batches
+        self.sim = Game(self.rng.getrandbits(64), rng="batched")
+        self.pool = None
+        self.root = Node()
+        self.root_snapshot = None
+        self.last_action = None
+        # speed counters, to spot engine regressions
+        self.rollouts = 0
+        self.search_time = 0.0
+        self.last_rollouts_per_second = 0.0
+
+    def rollouts_per_second(self):
+        return self.rollouts / self.search_time if self.search_time else 0.0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def __call__(self, game):
+        # so an agent can be used as a policy in force_grey_sim.run_dungeon
+        return self.choose(game)
+
+    def choose(self, game, budget=None):
+        # best PlayerAction for a game waiting for the player
+        if game.game_state not in ("battle", "player_turn"):
+            raise ValueError(f"the game is in state {game.game_state}, there is no action to choose")
+        budget = self.budget if budget is None else budget
+        snapshot = game.snapshot(include_rng=False)
+        self._reuse_tree(game, snapshot)
+
+        jobs = []
+        if self.workers > 1:
+            if self.pool is None:
+                self.pool = Pool(self.workers - 1)
+            jobs = [self.pool.apply_async(_search_worker, (snapshot, budget, self.rng.getrandbits(64)))
+                    for _ in range(self.workers - 1)]
+
+        start = time.perf_counter()
+        rollouts = 0
+        while time.perf_counter() - start < budget or rollouts == 0:
+            self._iterate(snapshot)
+            rollouts += 1
+
+        # merge the root statistics of every search, the most visited action wins
+        visits = {action: child.visits for action, child in self.root.children.items()}
+        for job in jobs:
+            for value, child_visits in job.get():
+                action = PlayerAction(value)
+                visits[action] = visits.get(action, 0) + child_visits
+                rollouts += child_visits
+        elapsed = time.perf_counter() - start
+        self.rollouts += rollouts
+        self.search_time += elapsed
+        self.last_rollouts_per_second = rollouts / elapsed
+
+        self.sim.restore(snapshot)
+        allowed = set(self.sim.available_actions())
+        action = max((action for action in visits if action in allowed), key=visits.get, default=PlayerAction.ATTACK)
+        self.last_action = action
+        return action
+
+    def _reuse_tree(self, game, snapshot):
+        # same state as last time: keep searching the same tree. one turn later in the same fight, and the
+        # action played was the one this agent chose: the subtree under it becomes the root. anything else (the
+        # player clicked something else than the hint, several turns went by) starts over
+        if snapshot == self.root_snapshot:
+            return
+        previous = self.root_snapshot
+        child = self.root.children.get(self.last_action)
+        if (previous is not None and child is not None and previous[2] == snapshot[2] and snapshot[0] == "player_turn"
+                and snapshot[8] == previous[8] + 1 and game.action_log[-1] == self.last_action.value):
+            self.root = child
+        else:
+            self.root = Node()
+        self.root_snapshot = snapshot
+
+    def _iterate(self, snapshot):
+        sim = self.sim
+        sim.restore(snapshot)
+        if sim.game_state == "battle":
+            sim.game_state = "player_turn"
+        enemy = sim.current_enemy
+        node = self.root
+        path = [node]
+        # selection and expansion
+        while not fight_over(sim, enemy):
+            actions = sim.available_actions()
+            untried = [action for action in actions if action not in node.children]
+            if untried:
+                action = self.rng.choice(untried)
+                node.children[action] = Node()
+                node = node.children[action]
+                play_turn(sim, action)
+                path.append(node)
+                break
+            log_visits = math.log(node.visits)
+            action = max(actions, key=lambda action: _ucb(node.children[action], log_visits))
+            node = node.children[action]
+            play_turn(sim, action)
+            path.append(node)
+        # simulation
+        turns = 0
+        while not fight_over(sim, enemy) and turns < ROLLOUT_TURNS:
+            play_turn(sim, self._rollout_action(sim))
+            turns += 1
+        # backpropagation
+        score = reward(sim, enemy)
+        for node in path:
+            node.visits += 1
+            node.value += score
+
+    def _rollout_action(self, game):
+        # half random, half the charge cycle, cheap and not too silly
+        if self.rng.random() < 0.5:
+            return self.rng.choice(game.available_actions())
+        return charge_cycle(game)
+
+def _ucb(node, log_visits):
+    return node.value / node.visits + EXPLORATION * math.sqrt(log_visits / node.visits)
+
+def _search_worker(snapshot, budget, seed):
+    # one independent search in a pool process, returns (action value, visits) of the root children
+    agent = MCTSAgent(budget, 1, seed)
+    game = Game(seed)
+    game.restore(snapshot)
+    agent.choose(game)
+    return [(action.value, child.visits) for action, child in agent.root.children.items()]
+
+def main():
+    parser = argparse.ArgumentParser(description="MCTS player for Force_Grey")
+    parser.add_argument("--budget", type=float, default=0.05, help="seconds of search per move")
+    parser.add_argument("--runs", type=int, default=10, help="full dungeon runs to play")
+    parser.add_argument("--workers", type=int, default=1, help="search processes per move, 0 means every core")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    agent = MCTSAgent(args.budget, args.workers or os.cpu_count(), args.seed)
+    report = SimulationReport(f"mcts {args.budget * 1000:g}ms")
+    start = time.perf_counter()
+    try:
+        for _ in range(args.runs):
+            report.add_run(*run_dungeon(agent))
+    finally:
+        agent.close()
+    print(report.format())
+    print(f"{agent.rollouts_per_second():,.0f} rollouts per second, {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# opt-in instrumentation for Force_Grey
+# instrument(game) swaps wrappers onto one Game object, an uninstrumented Game runs the plain class methods and
+# pays nothing. collects actions per type, seconds spent in each game_state, latency histograms of the engine
+# methods and, fed by main(), frame times. the method histograms only hold the calls that were timed, one in
+# SAMPLE_EVERY (per action for perform()), exported as force_grey_call_sample_every: multiply _count and _sum by it
+# for an estimate of every call, force_grey_actions_total has the real number of actions.
+# not free: the wrappers add about 5us per turn, 30-40% fewer turns/s in `force_grey_bench.py metrics`.
+# nothing next to a 60fps frame, but leave it off for bulk simulation (sim, tune, stream don't use it)
+# export with to_prometheus() (text exposition format) or snapshot() (json friendly dict).
+# in the game: FORCE_GREY_METRICS=metrics.prom python Elemental_Master_Force_Grey.py
+import json
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from force_grey_engine import Enemy, PlayerAction
+
+# upper bounds in seconds, the last bucket is +Inf
+CALL_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2, 1e-1)
+FRAME_BUCKETS = (0.001, 0.002, 0.004, 0.008, 0.016, 0.033, 0.05, 0.1, 0.25, 0.5, 1.0)
+SAMPLE_EVERY = 16  # one call in this many is timed, the latency histograms hold those
+# Game methods with a latency histogram
+TIMED_METHODS = ("player_attack", "_normal_magic_attack", "_double_magic_attack", "_charge_magic_attack",
+                 "apply_magic_effect", "player_heal", "enemy_attack", "update")
+# the player's methods are timed through perform(), which runs exactly one of them, instead of one wrapper each
+ACTION_METHODS = {
+    PlayerAction.ATTACK: "player_attack",
+    PlayerAction.NORMAL: "_normal_magic_attack",
+    PlayerAction.DOUBLE: "_double_magic_attack",
+    PlayerAction.CHARGE: "_charge_magic_attack",
+    PlayerAction.BURN: "apply_magic_effect",
+    PlayerAction.RUPTURE: "apply_magic_effect",
+    PlayerAction.TREMOR: "apply_magic_effect",
+    PlayerAction.HEAL: "player_heal",
+}
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # per bucket, not cumulative
+        self.total = 0.0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def quantile(self, fraction):
+        # upper bound of the bucket holding the quantile, inf if it is in the last one
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+    def snapshot(self):
+        return {"count": self.count, "sum": self.total,
+                "buckets": {str(bound): count for bound, count in zip(self.bounds + ("+Inf",), self.counts)}}
+
+class Metrics:
+    def __init__(self):
+        self.actions = Counter()  # PlayerAction -> count
+        self.phase_seconds = {}  # game_state -> seconds
+        self.calls = {name: Histogram(CALL_BUCKETS) for name in TIMED_METHODS + ("process_status_effects",)}
+        self.action_calls = {action: self.calls[name] for action, name in ACTION_METHODS.items()}
+        self.frames = Histogram(FRAME_BUCKETS)   # work per frame in main(): events, engine and drawing
+        self.renders = Histogram(FRAME_BUCKETS)  # drawing and pushing the screen only
+        self.started = time.time()
+        self._phase = None
+        self._since = 0.0
+        self._enemy_class = None
+        # calls left until the next timed one, by PlayerAction (a rare spell is timed every SAMPLE_EVERY-th time it
+        # is cast, not only when it lands on the SAMPLE_EVERY-th action) and by method name. kept here so the
+        # games sharing these metrics keep one count between them
+        self._countdowns = dict.fromkeys(tuple(ACTION_METHODS) + TIMED_METHODS + ("process_status_effects",), 1)
+
+    def observe_phase(self, game, now=None):
+        # the time since the last change belongs to the state seen then, call it whenever the state may change.
+        # while the state is the same there is nothing to do, the time is added up at the next change
+        if game.game_state == self._phase:
+            return
+        now = time.perf_counter() if now is None else now
+        self.close_phase(now)
+        self._phase = game.game_state
+        self._since = now
+
+    def observe_frame(self, game, work_seconds, render_seconds):
+        self.frames.observe(work_seconds)
+        self.renders.observe(render_seconds)
+        self.observe_phase(game)
+
+    def close_phase(self, now=None):
+        # add the time of the current state so far, before an export
+        if self._phase is not None:
+            now = time.perf_counter() if now is None else now
+            self.phase_seconds[self._phase] = self.phase_seconds.get(self._phase, 0.0) + now - self._since
+            self._since = now
+
+    def snapshot(self):
+        self.close_phase()
+        return {
+            "uptime_seconds": time.time() - self.started,
+            "actions": {action.name: count for action, count in self.actions.items()},
+            "phase_seconds": dict(self.phase_seconds),
+            "call_sample_every": SAMPLE_EVERY,
+            "calls": {name: histogram.snapshot() for name, histogram in self.calls.items() if histogram.count},
+            "frames": self.frames.snapshot(),
+            "renders": self.renders.snapshot(),
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        self.close_phase()
+        lines = ["# TYPE force_grey_actions_total counter"]
+        lines += [f'force_grey_actions_total{{action="{action.name}"}} {count}'
+                  for action, count in sorted(self.actions.items(), key=lambda item: item[0].value)]
+        lines.append("# TYPE force_grey_phase_seconds_total counter")
+        lines += [f'force_grey_phase_seconds_total{{phase="{phase}"}} {seconds:.6f}'
+                  for phase, seconds in sorted(self.phase_seconds.items())]
+        lines.append("# TYPE force_grey_call_sample_every gauge")
+        lines.append(f"force_grey_call_sample_every {SAMPLE_EVERY}")
+        lines.append("# TYPE force_grey_call_seconds histogram")
+        for name, histogram in self.calls.items():
+            if histogram.count:
+                lines += _histogram_lines("force_grey_call_seconds", histogram, f'method="{name}"')
+        for metric, histogram in (("force_grey_frame_seconds", self.frames), ("force_grey_render_seconds", self.renders)):
+            lines.append(f"# TYPE {metric} histogram")
+            lines += _histogram_lines(metric, histogram, "")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        # .json gets the snapshot, anything else the prometheus text
+        text = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        with open(path, "w") as file:
+            file.write(text)
+
+def _histogram_lines(metric, histogram, labels):
+    separator = "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.bounds + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+    braces = f"{{{labels}}}" if labels else ""
+    lines.append(f"{metric}_sum{braces} {histogram.total:.9f}")
+    lines.append(f"{metric}_count{braces} {histogram.count}")
+    return lines
+
+def _timed(metrics, name, function):
+    # the histogram is updated inline, a method call would cost as much as the timing itself.
+    # only every SAMPLE_EVERY-th call is timed and observed, the others only pay the countdown. a call that raises
+    # is not counted
+    perf_counter = time.perf_counter
+    histogram = metrics.calls[name]
+    bounds = histogram.bounds
+    counts = histogram.counts
+    countdowns = metrics._countdowns
+
+    def timed(*args):
+        countdowns[name] -= 1
+        if countdowns[name]:
+            return function(*args)
+        countdowns[name] = SAMPLE_EVERY
+        start = perf_counter()
+        result = function(*args)
+        elapsed = perf_counter() - start
+        counts[bisect_left(bounds, elapsed)] += 1
+        histogram.total += elapsed
+        return result
+    return timed
+
+def _timed_enemy_class(metrics):
+    # an Enemy subclass with the same (empty) slots, so a live enemy can switch to it and back
+    if metrics._enemy_class is None:
+        metrics._enemy_class = type("TimedEnemy", (Enemy,), {
+            "__slots__": (),
+            "process_status_effects": _timed(metrics, "process_status_effects", Enemy.process_status_effects),
+        })
+    return metrics._enemy_class
+
+def instrument(game, metrics=None, detail=False):
+    # start collecting for this game, returns the Metrics (a new one unless given, so several games can share one).
+    # detail=True also times enemy_attack() and process_status_effects(), which run inside update(): two more
+    # wrappers on every enemy turn, main() turns it on, the benchmarks and scripts leave it off
+    metrics = metrics or Metrics()
+    perform = type(game).perform.__get__(game)
+    update = type(game).update.__get__(game)
+    actions = metrics.actions
+    action_histograms = metrics.action_calls
+    update_histogram = metrics.calls["update"]
+    update_bounds = update_histogram.bounds
+    update_counts = update_histogram.counts
+    perf_counter = time.perf_counter
+    countdowns = metrics._countdowns
+
+    def counted_perform(action):
+        # every action is counted, every SAMPLE_EVERY-th one of its kind is timed into the histogram of its method
+        actions[action] += 1
+        countdowns[action] -= 1
+        if countdowns[action]:
+            perform(action)
+        else:
+            countdowns[action] = SAMPLE_EVERY
+            start = perf_counter()
+            perform(action)
+            elapsed = perf_counter() - start
+            histogram = action_histograms[action]
+            histogram.counts[bisect_left(histogram.bounds, elapsed)] += 1
+            histogram.total += elapsed
+        if game.game_state != metrics._phase:
+            metrics.observe_phase(game)
+
+    def timed_update():
+        # sampled like _timed() and marks the phase, in one wrapper since update() runs on every turn
+        countdowns["update"] -= 1
+        if countdowns["update"]:
+            update()
+        else:
+            countdowns["update"] = SAMPLE_EVERY
+            start = perf_counter()
+            update()
+            elapsed = perf_counter() - start
+            update_counts[bisect_left(update_bounds, elapsed)] += 1
+            update_histogram.total += elapsed
+        if game.game_state != metrics._phase:
+            metrics.observe_phase(game)
+
+    game.perform = counted_perform
+    game.update = timed_update
+    if detail:
+        _instrument_detail(game, metrics)
+    metrics.observe_phase(game)
+    return metrics
+
+def _instrument_detail(game, metrics):
+    game.enemy_attack = _timed(metrics, "enemy_attack", type(game).enemy_attack.__get__(game))
+    new_enemy = type(game).new_enemy.__get__(game)
+    restore = type(game).restore.__get__(game)
+    enemy_class = _timed_enemy_class(metrics)
+
+    def use_timed_enemy():
+        if game.current_enemy is not None and type(game.current_enemy) is Enemy:
+            game.current_enemy.__class__ = enemy_class
+
+    def timed_new_enemy():
+        new_enemy()
+        use_timed_enemy()
+
+    def timed_restore(snapshot):
+        restore(snapshot)
+        use_timed_enemy()
+
+    game.new_enemy = timed_new_enemy
+    game.restore = timed_restore
+    use_timed_enemy()
+
+def uninstrument(game):
+    # back to the plain class methods
+    for name in ("enemy_attack", "perform", "update", "new_enemy", "restore"):
+        game.__dict__.pop(name, None)
+    if game.current_enemy is not None and isinstance(game.current_enemy, Enemy):
+        game.current_enemy.__class__ = Enemy
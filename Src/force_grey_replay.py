@@ -0,0 +1,137 @@
+# replays for Force_Grey
+# a game is fully decided by its seed and the actions the player took, so a replay only stores those:
+# a 25 byte header (magic, version, seed, action count, hash of the final state) and one byte per action.
+# several replays can be concatenated into one corpus file and verified in one go.
+# usage: python force_grey_replay.py record corpus.fgr -n 5000 --policy every_action
+#        python force_grey_replay.py verify corpus.fgr last_game.fgr
+import argparse
+import hashlib
+import random
+import struct
+import time
+
+from force_grey_engine import Character, Game, PlayerAction
+
+MAGIC = b"FGRP"
+VERSION = 3  # 2: the hash covers the current enemy only, enemies are built lazily from the content file
+             # 3: character records have a slot for every registered status effect
+HEADER = struct.Struct("<4sBQI8s")  # magic, version, seed, number of actions, final state hash
+PLAYER_EXTRA = struct.Struct("<2i?i")
+
+def state_hash(game):
+    # 8 byte fingerprint of everything the dice and the actions decide.
+    # the selected magic mode is left out, picking a mode button is not an action and is not recorded
+    player = game.player
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(Character.RECORD.pack(*Character.to_record(player)))
+    digest.update(PLAYER_EXTRA.pack(player.magic_points, player.max_magic_points, player.charging, player.charge_turn))
+    if game.current_enemy is not None:
+        digest.update(game.current_enemy.pack())
+    digest.update(struct.pack("<2i", game.enemy_index, game.attack_count))
+    digest.update(game.game_state.encode())
+    return digest.digest()
+
+def encode(game):
+    # replay bytes of a game played so far
+    if not 0 <= game.seed < 2 ** 64:
+        raise ValueError(f"seed {game.seed} does not fit in a replay, use a seed between 0 and 2**64")
+    if not isinstance(game.rng, random.Random):
+        # replay() plays the seed again with random.Random, a batched game's rolls would never verify
+        raise ValueError("only games with the exact random mode can be replayed")
+    return HEADER.pack(MAGIC, VERSION, game.seed, len(game.action_log), state_hash(game)) + bytes(game.action_log)
+
+def decode(data, offset=0):
+    # (seed, actions, final hash, offset of the next replay) of the replay starting at offset
+    if len(data) - offset < HEADER.size:
+        raise ValueError("truncated replay header")
+    magic, version, seed, count, final_hash = HEADER.unpack_from(data, offset)
+    if magic != MAGIC:
+        raise ValueError("not a Force_Grey replay")
+    if version != VERSION:
+        raise ValueError(f"replay version {version} is not supported, expected {VERSION}")
+    start = offset + HEADER.size
+    actions = bytes(data[start:start + count])
+    if len(actions) != count:
+        raise ValueError("truncated replay, some actions are missing")
+    return seed, actions, final_hash, start + count
+
+def iter_replays(data):
+    offset = 0
+    while offset < len(data):
+        seed, actions, final_hash, offset = decode(data, offset)
+        yield seed, actions, final_hash
+
+def save(game, path, append=False):
+    with open(path, "ab" if append else "wb") as file:
+        file.write(encode(game))
+
+def load(path):
+    # every replay in the file as (seed, actions, final hash)
+    with open(path, "rb") as file:
+        return list(iter_replays(file.read()))
+
+def replay(seed, actions):
+    # play the actions again without a display, the game advances between actions like main() does
+    game = Game(seed)
+    for value in actions:
+        if game.game_state == "battle":
+            game.game_state = "player_turn"
+        if game.game_state != "player_turn":
+            raise ValueError(f"the replay has an action left but the game is in state {game.game_state}")
+        game.perform(PlayerAction(value))
+        while game.game_state in ("enemy_turn", "enemy_defeated"):
+            game.update()
+    return game
+
+def verify(seed, actions, final_hash):
+    # True when the replay ends in the recorded state
+    try:
+        return state_hash(replay(seed, actions)) == final_hash
+    except ValueError:
+        return False
+
+def record_corpus(path, runs, policy_name="every_action", seed=0):
+    # play `runs` dungeon runs with a simulator policy and write them all to one corpus file
+    from force_grey_sim import POLICIES, run_dungeon
+    policy = POLICIES[policy_name]
+    seeds = random.Random(seed)
+    with open(path, "wb") as file:
+        for _ in range(runs):
+            game = Game(seeds.getrandbits(64))
+            run_dungeon(policy, game)
+            file.write(encode(game))
+
+def main():
+    parser = argparse.ArgumentParser(description="record and verify Force_Grey replays")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="write a corpus of simulated games")
+    record_parser.add_argument("path")
+    record_parser.add_argument("-n", "--runs", type=int, default=1000)
+    record_parser.add_argument("--policy", default="every_action")
+    record_parser.add_argument("--seed", type=int, default=0)
+    verify_parser = commands.add_parser("verify", help="replay files and check their final state")
+    verify_parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        start = time.perf_counter()
+        record_corpus(args.path, args.runs, args.policy, args.seed)
+        print(f"recorded {args.runs} games to {args.path} in {time.perf_counter() - start:.2f}s")
+        return
+
+    failed = 0
+    for path in args.paths:
+        start = time.perf_counter()
+        replays = load(path)
+        bad = [index for index, entry in enumerate(replays) if not verify(*entry)]
+        turns = sum(len(actions) for _, actions, _ in replays)
+        seconds = time.perf_counter() - start
+        print(f"{path}: {len(replays) - len(bad)}/{len(replays)} replays match, "
+              f"{turns} actions in {seconds:.2f}s ({turns / seconds:,.0f} actions per second)")
+        for index in bad[:10]:
+            print(f"  replay {index} (seed {replays[index][0]}) does not reproduce")
+        failed += len(bad)
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# random number providers for Force_Grey games
+# a Game draws every die from game.rng, which only needs randint(), random(), getstate() and setstate().
+# "exact" is random.Random: the rolls of a seed are the same on every python, replays and save files rely on it.
+# "batched" draws blocks of floats with a numpy Generator (PCG64) and hands them out one by one, a roll is a list
+# index and a multiplication instead of three python calls inside random.randint. it is just as deterministic
+# per seed but gives other rolls than "exact", use it for bulk simulation, not for games that are replayed or saved.
+# making a numpy Generator costs more than the rolls of a whole game, so bulk simulation shares one BatchedRandom
+# between the games of a job: Game(seed, rng=shared). Game(seed, rng="batched") suits long lived games (the search).
+# usage: --rng batched on force_grey_sim.py / force_grey_stream.py
+import random
+
+BLOCK = 4096  # rolls drawn at once by BatchedRandom
+
+class BatchedRandom:
+    __slots__ = ("generator", "block", "block_state", "index")
+
+    def __init__(self, seed=None):
+        import numpy as np  # only the batched mode needs numpy, the game itself starts without it
+        self.generator = np.random.Generator(np.random.PCG64(seed))
+        self._refill()
+
+    def _refill(self):
+        # the state before the block is kept, getstate() is (that state, position in the block)
+        self.block_state = self.generator.bit_generator.state
+        self.block = self.generator.random(BLOCK).tolist()
+        self.index = 0
+
+    def random(self):
+        if self.index == BLOCK:
+            self._refill()
+        value = self.block[self.index]
+        self.index += 1
+        return value
+
+    def randint(self, low, high):
+        # low <= n <= high like random.randint, the float has 53 bits so the bias is far below anything measurable
+        index = self.index
+        if index == BLOCK:
+            self._refill()
+            index = 0
+        self.index = index + 1
+        return low + int(self.block[index] * (high - low + 1))
+
+    def getstate(self):
+        return self.block_state, self.index
+
+    def setstate(self, state):
+        block_state, index = state
+        if block_state is not self.block_state:
+            # another block: draw it again from its state. restoring within the block is just the index
+            self.generator.bit_generator.state = block_state
+            self.block_state = block_state
+            self.block = self.generator.random(BLOCK).tolist()
+        self.index = index
+
+RNG_MODES = {"exact": random.Random, "batched": BatchedRandom}
+
+def make_rng(mode, seed):
+    try:
+        return RNG_MODES[mode](seed)
+    except KeyError:
+        raise ValueError(f"unknown rng mode {mode}, choose from {', '.join(RNG_MODES)}") from None
@@ -0,0 +1,168 @@
+# save files for Force_Grey games in progress
+# a save is the whole state of a Game packed with struct: the player, the enemy being fought (the others are
+# still roster entries or beaten), enemy_index, attack_count, the battle log, the random generator and the
+# actions so far, so a loaded game plays on exactly as if it was never closed and its replay still verifies.
+# about 2.9KB, most of it the state of random.Random. files are written next to their final name and renamed,
+# a reader never sees half a save, and a crc32 at the end catches files damaged some other way.
+# usage: python force_grey_save.py autosave.fgs        describe a save file
+#        python force_grey_save.py --bench             time pack, unpack and save
+import argparse
+import os
+import random
+import struct
+import time
+import zlib
+
+from force_grey_engine import EFFECTS, Character, Game, Player
+
+MAGIC = b"FGSV"
+VERSION = 1
+# magic, version, number of registered effects (the width of the records), seed, state, enemy_index, attack_count,
+# enemy present
+HEADER = struct.Struct("<4sBBQBii?")
+STATES = ("start", "battle", "player_turn", "enemy_turn", "enemy_defeated", "victory", "defeat")
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+LENGTH = struct.Struct("<H")
+LOG_EVENT = struct.Struct("<BHdd")  # kind, actor length, amount, extra, then the actor in utf-8
+RNG_STATE = struct.Struct("<B625I?d")  # version, mersenne twister words and position, gauss_next (set?, value)
+ACTIONS = struct.Struct("<I")
+CHECKSUM = struct.Struct("<I")
+
+def _text(text):
+    data = text.encode()
+    return LENGTH.pack(len(data)) + data
+
+def pack(game):
+    # bytes of a Game, for Game objects of force_grey_engine (not HordeGame)
+    if not 0 <= game.seed < 2 ** 64:
+        raise ValueError(f"seed {game.seed} does not fit in a save, use a seed between 0 and 2**64")
+    if not isinstance(game.rng, random.Random):
+        raise ValueError("only games with the exact random mode can be saved")
+    enemy = game.current_enemy
+    parts = [HEADER.pack(MAGIC, VERSION, len(EFFECTS), game.seed, STATE_CODES[game.game_state], game.enemy_index,
+                         game.attack_count, enemy is not None),
+             Player.RECORD.pack(*game.player.to_record())]
+    if enemy is not None:
+        parts.append(Character.RECORD.pack(*enemy.to_record()))
+    parts.append(_text(game.message))
+    parts.append(bytes([len(game.log_events)]))
+    for kind, actor, amount, extra in game.log_events:
+        actor = actor.encode()
+        parts.append(LOG_EVENT.pack(kind, len(actor), amount, extra or 0) + actor)
+    version, words, gauss = game.rng.getstate()
+    parts.append(RNG_STATE.pack(version, *words, gauss is not None, gauss or 0.0))
+    parts.append(ACTIONS.pack(len(game.action_log)) + bytes(game.action_log))
+    data = b"".join(parts)
+    return data + CHECKSUM.pack(zlib.crc32(data))
+
+def unpack(data):
+    # the Game saved in data, raises ValueError for anything that is not an intact save of this version
+    try:
+        return _unpack(data)
+    except (struct.error, IndexError) as error:
+        # a record cut short or a code out of range that still passed the checksum
+        raise ValueError(f"damaged save: {error}") from error
+
+def _unpack(data):
+    if len(data) < HEADER.size + CHECKSUM.size:
+        raise ValueError("truncated save")
+    body = memoryview(data)[:-CHECKSUM.size]
+    if CHECKSUM.unpack_from(data, len(body))[0] != zlib.crc32(body):
+        raise ValueError("damaged save, the checksum does not match")
+    magic, version, effects, seed, state, enemy_index, attack_count, has_enemy = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ValueError("not a Force_Grey save")
+    if version != VERSION:
+        raise ValueError(f"save version {version} is not supported, expected {VERSION}")
+    if effects != len(EFFECTS):
+        raise ValueError(f"the save has {effects} status effects, this game registers {len(EFFECTS)}")
+    offset = HEADER.size
+    player = Player.RECORD.unpack_from(body, offset)
+    offset += Player.RECORD.size
+    enemy = None
+    if has_enemy:
+        enemy = Character.RECORD.unpack_from(body, offset)
+        offset += Character.RECORD.size
+    (length,) = LENGTH.unpack_from(body, offset)
+    offset += LENGTH.size
+    message = bytes(body[offset:offset + length]).decode()
+    offset += length
+    log_events = []
+    count = body[offset]
+    offset += 1
+    for _ in range(count):
+        kind, length, amount, extra = LOG_EVENT.unpack_from(body, offset)
+        offset += LOG_EVENT.size
+        log_events.append((kind, bytes(body[offset:offset + length]).decode(), amount, extra))
+        offset += length
+    rng_version, *words, has_gauss, gauss = RNG_STATE.unpack_from(body, offset)
+    offset += RNG_STATE.size
+    (actions,) = ACTIONS.unpack_from(body, offset)
+    offset += ACTIONS.size
+    if offset + actions != len(body):
+        raise ValueError("damaged save, the length does not match")
+
+    game = Game(seed)
+    game.action_log[:] = body[offset:]
+    game.restore((STATES[state], message, enemy_index, attack_count, tuple(log_events), player, enemy,
+                  (rng_version, tuple(words), gauss if has_gauss else None), actions))
+    return game
+
+def save(game, path, sync=False):
+    # atomic: the old file stays until the new one is complete. sync=True also waits for the disk,
+    # which costs milliseconds, autosaves leave it off
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(pack(game))
+        if sync:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+def load(path):
+    with open(path, "rb") as file:
+        return unpack(file.read())
+
+def bench(number=2000):
+    # (bytes, pack, unpack and save microseconds) of a game in the middle of a fight
+    import tempfile
+    from force_grey_sim import every_action, play_turn
+    game = Game(7)
+    game.game_state = "player_turn"
+    for _ in range(3):
+        play_turn(game, every_action(game))
+    data = pack(game)
+    start = time.perf_counter()
+    for _ in range(number):
+        pack(game)
+    pack_us = (time.perf_counter() - start) / number * 1e6
+    start = time.perf_counter()
+    for _ in range(number):
+        unpack(data)
+    unpack_us = (time.perf_counter() - start) / number * 1e6
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.fgs")
+        start = time.perf_counter()
+        for _ in range(number // 10):
+            save(game, path)
+        save_us = (time.perf_counter() - start) / (number // 10) * 1e6
+    return {"bytes": len(data), "pack_us": pack_us, "unpack_us": unpack_us, "save_us": save_us}
+
+def main():
+    parser = argparse.ArgumentParser(description="Force_Grey save files")
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument("--bench", action="store_true", help="time pack, unpack and save")
+    args = parser.parse_args()
+    for path in args.paths:
+        game = load(path)
+        enemy = game.current_enemy
+        print(f"{path}: seed {game.seed}, {game.game_state}, {len(game.action_log)} actions, "
+              f"player hp {game.player.hp} mp {game.player.magic_points}, "
+              + (f"fighting {enemy.name} ({enemy.hp}/{enemy.max_hp} hp)" if enemy else "no enemy"))
+    if args.bench:
+        result = bench()
+        print(f"{result['bytes']} bytes, pack {result['pack_us']:.1f}us, unpack {result['unpack_us']:.1f}us, "
+              f"atomic save {result['save_us']:.1f}us")
+
+if __name__ == "__main__":
+    main()
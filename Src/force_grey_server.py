@@ -0,0 +1,455 @@
+# battle server for Force_Grey: many games in one process behind a line based json protocol
+# every request is one json object on one line, every answer too:
+#   {"op": "new", "seed": 12}                       -> {"ok": true, "session": "0-5f1c...", "game": {...}}
+#   {"op": "act", "session": "...", "action": "CHARGE"} -> {"ok": true, "game": {...}}
+#   {"op": "state", "session": "..."}  {"op": "close", "session": "..."}  {"op": "stats"}
+# errors come back as {"ok": false, "error": "..."}. the enemy's turn is played right after the action,
+# the game in the answer is always waiting for the player or over.
+# with --workers N the listening socket is shared by N forked processes, the kernel spreads the
+# connections and a session lives in the process of the connection that created it.
+# with --save-dir a session idle for --idle-timeout is written to that directory (see force_grey_save.py) instead of
+# dropped, and comes back on its next request, in any worker. a worker saves all its sessions when it is stopped.
+# usage: python force_grey_server.py serve --port 7000 --workers 4
+#        python force_grey_server.py serve --save-dir sessions
+#        python force_grey_server.py loadtest --workers 4 --connections 50 --sessions 40
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import force_grey_save
+from force_grey_engine import EFFECT_NAMES, Game, PlayerAction, TurnScheduler
+
+IDLE_TIMEOUT = 600.0  # seconds without a request before a session is dropped
+MAX_SESSIONS = 100000 # per worker, new games are refused above this
+SESSION_ID = re.compile(r"[0-9]+-[0-9a-f]{16}")  # anything else never gets near the save directory
+
+class Session:
+    __slots__ = ("game", "last_used")
+
+    def __init__(self, game, now):
+        self.game = game
+        self.last_used = now
+
+def describe(game):
+    # what a client needs to draw the battle and pick an action
+    player = game.player
+    enemy = game.current_enemy
+    waiting = game.game_state in ("battle", "player_turn")
+    return {
+        "state": game.game_state,
+        "player": {"hp": player.hp, "max_hp": player.max_hp, "mp": player.magic_points,
+                   "max_mp": player.max_magic_points, "charging": player.charging},
+        "enemy": None if enemy is None else {
+            "name": enemy.name, "hp": enemy.hp, "max_hp": enemy.max_hp,
+            "effects": {name: enemy.status_stacks(name) for name in EFFECT_NAMES if enemy.has_status_effect(name)}},
+        "log": list(game.battle_log),
+        "actions": [action.name for action in game.available_actions()] if waiting else [],
+    }
+
+class SessionStore:
+    # the games of one worker process, keyed by session id
+    def __init__(self, worker=0, idle_timeout=IDLE_TIMEOUT, max_sessions=MAX_SESSIONS, clock=time.monotonic,
+                 save_dir=None):
+        self.worker = worker
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.save_dir = save_dir  # None: idle sessions are dropped
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+        self.sessions = {}
+        self.scheduler = TurnScheduler.headless()  # no pauses between turns, the client sets the pace
+        self.actions = 0
+        self.evicted = 0
+        self.saved = 0
+        self.loaded = 0
+        self.save_errors = 0
+        self.load_errors = 0
+
+    def new(self, seed=None):
+        if len(self.sessions) >= self.max_sessions:
+            raise ValueError("the server is full, try again later")
+        if seed is not None and (type(seed) is not int or not 0 <= seed < 2 ** 64):
+            raise ValueError("seed must be an integer between 0 and 2**64")  # what a save file can hold
+        session_id = f"{self.worker}-{secrets.token_hex(8)}"
+        self.sessions[session_id] = Session(Game(seed), self.clock())
+        return session_id
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            game = self._load(session_id)
+            if game is None:
+                raise ValueError(f"unknown session {session_id}, it may have been idle for too long")
+            session = self.sessions[session_id] = Session(game, self.clock())
+        session.last_used = self.clock()
+        return session.game
+
+    def _path(self, session_id):
+        if not isinstance(session_id, str) or not SESSION_ID.fullmatch(session_id):
+            return None
+        return os.path.join(self.save_dir, session_id + ".fgs")
+
+    def _load(self, session_id):
+        # the saved game of session_id or None. the file is renamed first, so when two workers ask for the same
+        # session only one of them gets it. it is deleted once the game is back in memory, a file that can't be
+        # loaded goes back under its name for a later try or a look
+        path = self.save_dir and self._path(session_id)
+        if not path:
+            return None
+        claimed = f"{path}.{os.getpid()}.claim"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        try:
+            game = force_grey_save.load(claimed)
+        except (OSError, ValueError) as error:
+            self.load_errors += 1
+            print(f"worker {self.worker}: could not load session {session_id}: {error}", file=sys.stderr)
+            try:
+                os.rename(claimed, path)
+            except OSError:
+                pass  # still there as the .claim file
+            return None
+        os.remove(claimed)
+        self.loaded += 1
+        return game
+
+    def _save(self, session_id, game):
+        # True when the game is on disk. a game that cannot be saved is reported and the caller keeps it,
+        # one bad session must not stop the saves of the others
+        try:
+            force_grey_save.save(game, self._path(session_id))
+        except (OSError, ValueError) as error:
+            self.save_errors += 1
+            print(f"worker {self.worker}: could not save session {session_id}: {error}", file=sys.stderr)
+            return False
+        self.saved += 1
+        return True
+
+    def save_all(self):
+        # write every open session to save_dir, when the worker stops
+        if self.save_dir:
+            for session_id, session in self.sessions.items():
+                self._save(session_id, session.game)
+
+    def act(self, session_id, action_name):
+        game = self.get(session_id)
+        try:
+            action = PlayerAction[action_name]
+        except KeyError:
+            raise ValueError(f"unknown action {action_name}, use one of {', '.join(action.name for action in PlayerAction)}")
+        if game.game_state == "battle":
+            game.game_state = "player_turn"
+        if game.game_state != "player_turn":
+            raise ValueError(f"the game is over ({game.game_state}), start a new one")
+        game.perform(action)
+        if game.game_state == "player_turn":
+            raise ValueError("not enough mana")
+        self.scheduler.poll(game)
+        self.actions += 1
+        return game
+
+    def close(self, session_id):
+        if self.sessions.pop(session_id, None) is None and self._load(session_id) is None:
+            raise ValueError(f"unknown session {session_id}")
+
+    def evict_idle(self):
+        # drop sessions nobody has touched for idle_timeout seconds (saving them first with a save_dir, unless
+        # the game is over), returns how many went
+        limit = self.clock() - self.idle_timeout
+        idle = [session_id for session_id, session in self.sessions.items() if session.last_used < limit]
+        evicted = 0
+        for session_id in idle:
+            game = self.sessions[session_id].game
+            if self.save_dir and game.game_state not in ("victory", "defeat") and not self._save(session_id, game):
+                continue  # still in memory, tried again next round
+            del self.sessions[session_id]
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    def stats(self):
+        result = {"worker": self.worker, "pid": os.getpid(), "sessions": len(self.sessions), "actions": self.actions,
+                  "evicted": self.evicted, "saved": self.saved, "loaded": self.loaded,
+                  "save_errors": self.save_errors, "load_errors": self.load_errors,
+                  "cpu_seconds": time.process_time()}
+        try:
+            import resource
+            result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            pass  # windows
+        return result
+
+    def handle(self, request):
+        # one decoded request -> answer dict
+        op = request.get("op")
+        if op == "new":
+            session_id = self.new(request.get("seed"))
+            return {"ok": True, "session": session_id, "game": describe(self.sessions[session_id].game)}
+        if op == "act":
+            return {"ok": True, "game": describe(self.act(request.get("session"), request.get("action")))}
+        if op == "state":
+            return {"ok": True, "game": describe(self.get(request.get("session")))}
+        if op == "close":
+            self.close(request.get("session"))
+            return {"ok": True}
+        if op == "stats":
+            return {"ok": True, "stats": self.stats()}
+        raise ValueError(f"unknown op {op}")
+
+    def handle_line(self, line):
+        request = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a request is a json object")
+            response = self.handle(request)
+        except ValueError as error:  # json errors are ValueErrors too
+            response = {"ok": False, "error": str(error)}
+        except (TypeError, KeyError, RecursionError) as error:
+            # a field of the wrong json type (a list as session or action, ...) or json nested deeper than the
+            # parser goes, the connection stays open
+            response = {"ok": False, "error": f"malformed request: {error}"}
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]  # lets a client match pipelined answers
+        return (json.dumps(response, separators=(",", ":")) + "\n").encode()
+
+async def _serve_connection(store, reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            writer.write(store.handle_line(line))
+            await writer.drain()
+    except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+        pass  # client went away or sent a line longer than the stream limit
+    finally:
+        writer.close()
+
+async def _evict_loop(store):
+    while True:
+        await asyncio.sleep(max(1.0, min(store.idle_timeout / 4, 30.0)))
+        try:
+            store.evict_idle()
+        except Exception as error:  # the loop has to outlive anything one round runs into
+            print(f"worker {store.worker}: eviction failed: {error!r}", file=sys.stderr)
+
+async def _serve(listener, store):
+    if listener.family == socket.AF_INET or listener.family == socket.AF_INET6:
+        server = await asyncio.start_server(lambda r, w: _serve_connection(store, r, w), sock=listener)
+    else:
+        server = await asyncio.start_unix_server(lambda r, w: _serve_connection(store, r, w), sock=listener)
+    # terminate() and ctrl-c stop the worker through the loop: the server closes, asyncio.run() cancels the open
+    # connections and _worker() saves the sessions, no exception thrown into whatever the loop was running
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:
+            pass  # windows, ctrl-c still ends in KeyboardInterrupt
+    evictor = asyncio.create_task(_evict_loop(store))
+    try:
+        await stop.wait()
+    finally:
+        evictor.cancel()
+        server.close()
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+def _worker(listener, worker, idle_timeout, max_sessions, save_dir=None):
+    store = SessionStore(worker, idle_timeout, max_sessions, save_dir=save_dir)
+    try:
+        asyncio.run(_serve(listener, store))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)  # a second stop must not cut the saves short
+        store.save_all()
+
+def listen(host="127.0.0.1", port=7000, unix_path=None):
+    # the listening socket, made before forking so every worker accepts from the same one
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.unlink(unix_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(unix_path)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+    listener.listen(1024)
+    listener.setblocking(False)
+    return listener
+
+def serve(host="127.0.0.1", port=7000, unix_path=None, workers=1, idle_timeout=IDLE_TIMEOUT, max_sessions=MAX_SESSIONS,
+          save_dir=None):
+    listener = listen(host, port, unix_path)
+    if workers == 1:
+        _worker(listener, 0, idle_timeout, max_sessions, save_dir)
+        return
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise ValueError("sharding over several workers needs fork, run one server per port instead")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_worker, args=(listener, worker, idle_timeout, max_sessions, save_dir), daemon=True)
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()  # the workers save their sessions before they exit
+
+# load test: clients keep many sessions open and play them round robin as fast as the server answers
+async def _open(address):
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address)
+    return await asyncio.open_connection(*address)
+
+async def _request(reader, writer, request):
+    writer.write((json.dumps(request) + "\n").encode())
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    if not response["ok"]:
+        raise RuntimeError(response["error"])
+    return response
+
+async def _client_connection(address, sessions, actions, rng, latencies):
+    reader, writer = await _open(address)
+    games = [await _request(reader, writer, {"op": "new", "seed": rng.getrandbits(32)}) for _ in range(sessions)]
+    games = [[response["session"], response["game"]] for response in games]
+    played = 0
+    while played < actions:
+        for entry in games:
+            if played == actions:
+                break
+            session_id, game = entry
+            if not game["actions"]:
+                await _request(reader, writer, {"op": "close", "session": session_id})
+                response = await _request(reader, writer, {"op": "new", "seed": rng.getrandbits(32)})
+                entry[:] = [response["session"], response["game"]]
+                continue
+            action = "CHARGE" if "CHARGE" in game["actions"] and rng.random() < 0.7 else rng.choice(game["actions"])
+            start = time.perf_counter()
+            response = await _request(reader, writer, {"op": "act", "session": session_id, "action": action})
+            latencies.append(time.perf_counter() - start)
+            entry[1] = response["game"]
+            played += 1
+    stats = (await _request(reader, writer, {"op": "stats"}))["stats"]
+    writer.close()
+    return stats
+
+async def _client_main(address, connections, sessions, actions, seed):
+    rng = random.Random(seed)
+    latencies = []
+    start = time.perf_counter()
+    stats = await asyncio.gather(*(_client_connection(address, sessions, actions, random.Random(rng.getrandbits(64)),
+                                                      latencies) for _ in range(connections)))
+    return latencies, time.perf_counter() - start, stats
+
+def _client_process(job):
+    return asyncio.run(_client_main(*job))
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+def loadtest(address, connections=50, sessions=40, actions=200, clients=1, seed=0):
+    # `clients` processes with `connections` connections each, every connection plays `sessions` games
+    # until it has sent `actions` actions. returns the summary dict
+    jobs = [(address, connections, sessions, actions, seed * 1000 + index) for index in range(clients)]
+    if clients == 1:
+        results = [_client_process(jobs[0])]
+    else:
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.map(_client_process, jobs)
+    latencies = [latency for result in results for latency in result[0]]
+    seconds = max(result[1] for result in results)
+    workers = {}
+    for result in results:
+        for stats in result[2]:
+            workers[stats["pid"]] = stats
+    return {
+        "sessions": clients * connections * sessions,
+        "actions": len(latencies),
+        "seconds": seconds,
+        "actions_per_second": len(latencies) / seconds,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "workers_seen": len(workers),
+        "max_rss_kb": max((stats.get("max_rss_kb", 0) for stats in workers.values()), default=0),
+    }
+
+def _wait_for(path, process, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("the server did not start")
+        time.sleep(0.05)
+
+def main():
+    parser = argparse.ArgumentParser(description="multi session battle server for Force_Grey")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the server")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=7000)
+    serve_parser.add_argument("--unix", default=None, help="listen on this unix socket instead of tcp")
+    serve_parser.add_argument("--workers", type=int, default=1, help="server processes, 0 means every core")
+    serve_parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT)
+    serve_parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS)
+    serve_parser.add_argument("--save-dir", default=None, help="keep idle sessions in this directory instead of dropping them")
+    load_parser = commands.add_parser("loadtest", help="start a local server and measure it")
+    load_parser.add_argument("--workers", type=int, default=1, help="server processes")
+    load_parser.add_argument("--clients", type=int, default=1, help="client processes")
+    load_parser.add_argument("--connections", type=int, default=50, help="connections per client process")
+    load_parser.add_argument("--sessions", type=int, default=40, help="games per connection")
+    load_parser.add_argument("--actions", type=int, default=200, help="actions per connection")
+    load_parser.add_argument("--think", type=float, default=2.0, help="seconds a human takes per action")
+    load_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.unix, args.workers or os.cpu_count(), args.idle_timeout, args.max_sessions,
+              args.save_dir)
+        return
+
+    path = os.path.join(tempfile.mkdtemp(), "force_grey.sock")
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--unix", path,
+                               "--workers", str(args.workers)])
+    try:
+        _wait_for(path, server)
+        result = loadtest(path, args.connections, args.sessions, args.actions, args.clients, args.seed)
+    finally:
+        server.terminate()
+        server.wait()
+    per_core = result["actions_per_second"] / args.workers
+    print(f"{result['sessions']} sessions, {result['actions']} actions in {result['seconds']:.2f}s "
+          f"on {args.workers} server worker(s)")
+    print(f"latency p50 {result['p50_ms']:.3f}ms, p99 {result['p99_ms']:.3f}ms")
+    print(f"{result['actions_per_second']:,.0f} actions per second, {per_core:,.0f} per core, "
+          f"about {per_core * args.think:,.0f} sessions per core at one action every {args.think:g}s")
+    if result["max_rss_kb"]:
+        print(f"largest worker: {result['max_rss_kb'] / 1024:.1f} MB resident")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# monte carlo balance simulator for Force_Grey
+# plays full dungeon runs with the real Game engine and a player policy, spread over a process pool
+# usage: python force_grey_sim.py -n 100000 --policy charge_cycle --workers 16 --seed 1
+import argparse
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+
+from force_grey_damage import action_table, enemy_attack_table
+from force_grey_engine import Game, PlayerAction
+from force_grey_rng import RNG_MODES, make_rng
+
+MAX_TURNS = 1000   # safety net, a run never gets close to this
+CHUNK_SIZE = 2000  # runs handed to a worker at once
+
+# player policies, each one looks at the game and returns the PlayerAction for this turn
+# if the policy picks something the player can't afford, the simulator falls back to a physical attack
+def always_physical(game):
+    return PlayerAction.ATTACK
+
+def burn_then_normal(game):
+    mp = game.player.magic_points
+    if not game.current_enemy.has_status_effect("burn") and mp >= 12:
+        return PlayerAction.BURN
+    if mp >= 10:
+        return PlayerAction.NORMAL
+    return PlayerAction.ATTACK
+
+def charge_cycle(game):
+    if game.player.charging or game.player.magic_points >= 20:
+        return PlayerAction.CHARGE
+    return PlayerAction.ATTACK
+
+def rupture_then_physical(game):
+    if not game.current_enemy.has_status_effect("break") and game.player.magic_points >= 12:
+        return PlayerAction.RUPTURE
+    return PlayerAction.ATTACK
+
+def heal_when_low(game):
+    if game.player.hp < game.player.max_hp // 3 and game.player.magic_points >= 15:
+        return PlayerAction.HEAL
+    return charge_cycle(game)
+
+def every_action(game):
+    # walks through the whole action set depending on the hp left, mostly useful to exercise the engine
+    return PlayerAction((game.player.hp + game.current_enemy.hp) % len(PlayerAction) + 1)
+
+def expected_damage(game):
+    # greedy on the exact damage tables of force_grey_damage.py: the surest kill this turn if there is one,
+    # a heal when the enemy's next hit is likely to kill, else the most expected damage per turn
+    player = game.player
+    enemy = game.current_enemy
+    if player.charging:
+        return PlayerAction.CHARGE
+    mp = player.magic_points
+    best, best_kill, best_mean = PlayerAction.ATTACK, 0.0, 0.0
+    for action in (PlayerAction.ATTACK, PlayerAction.NORMAL, PlayerAction.DOUBLE):
+        if game.action_cost(action) > mp:
+            continue
+        table = action_table(game, action)
+        kill = table.kill_chance(enemy.hp)
+        if (kill, table.mean) > (best_kill, best_mean):
+            best, best_kill, best_mean = action, kill, table.mean
+    if best_kill < 1.0 and mp >= game.action_cost(PlayerAction.HEAL) \
+            and enemy_attack_table(game).kill_chance(player.hp) > 0.5:
+        return PlayerAction.HEAL
+    if best_kill == 0.0 and mp >= game.action_cost(PlayerAction.CHARGE) \
+            and action_table(game, PlayerAction.CHARGE).mean / 2 > best_mean:
+        return PlayerAction.CHARGE  # two turns for the release
+    return best
+
+_advisor = None
+
+def mcts_advisor(game):
+    # 5 ms of tree search per move, slow but a good yardstick for the hand written policies
+    global _advisor
+    if _advisor is None:
+        from force_grey_mcts import MCTSAgent
+        _advisor = MCTSAgent(budget=0.005)
+    return _advisor.choose(game)
+
+POLICIES = {
+    "physical": always_physical,
+    "burn_normal": burn_then_normal,
+    "charge_cycle": charge_cycle,
+    "rupture_physical": rupture_then_physical,
+    "heal_when_low": heal_when_low,
+    "every_action": every_action,
+    "expected": expected_damage,
+    "mcts": mcts_advisor,
+}
+
+def play_turn(game, action):
+    # one player action followed by the enemy's answer, like clicking a button in main()
+    game.perform(action)
+    if game.game_state == "player_turn":
+        # not enough mana, the click did nothing
+        game.perform(PlayerAction.ATTACK)
+    while game.game_state in ("enemy_turn", "enemy_defeated"):
+        game.update()
+
+def run_dungeon(policy, game=None):
+    # play one full run, returns (enemy name, won, turns, player hp, player mp) for every fight
+    # and whether the whole dungeon was cleared
+    if game is None:
+        game = Game()
+    fights = []
+    turns = 0
+    enemy = game.current_enemy
+    while turns < MAX_TURNS:
+        if game.game_state == "battle":
+            game.game_state = "player_turn"
+        elif game.game_state == "player_turn":
+            play_turn(game, policy(game))
+            turns += 1
+        else:
+            break
+        if game.current_enemy is not enemy or game.game_state in ("victory", "defeat"):
+            won = not enemy.is_alive()
+            fights.append((enemy.name, won, turns, game.player.hp, game.player.magic_points))
+            if not won:
+                break
+            enemy = game.current_enemy
+            turns = 0
+    return fights, game.game_state == "victory"
+
+class RunningStat:
+    # count, sum and sum of squares, so stats from different workers can be merged
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.total_sq = 0
+
+    def add(self, value):
+        self.n += 1
+        self.total += value
+        self.total_sq += value * value
+
+    def merge(self, other):
+        self.n += other.n
+        self.total += other.total
+        self.total_sq += other.total_sq
+
+    def mean(self):
+        return self.total / self.n if self.n else 0.0
+
+    def confidence(self, z=1.96):
+        # half width of the normal confidence interval of the mean
+        if self.n < 2:
+            return 0.0
+        variance = (self.total_sq - self.total * self.total / self.n) / (self.n - 1)
+        return z * math.sqrt(max(variance, 0.0) / self.n)
+
+class EnemyStats:
+    def __init__(self):
+        self.fights = 0
+        self.wins = 0
+        self.turns = RunningStat()     # turns to kill, only for won fights
+        self.player_hp = RunningStat() # player hp left after the fight
+        self.player_mp = RunningStat() # player mp left after the fight
+
+    def add(self, won, turns, hp, mp):
+        self.fights += 1
+        if won:
+            self.wins += 1
+            self.turns.add(turns)
+            self.player_hp.add(hp)
+            self.player_mp.add(mp)
+
+    def merge(self, other):
+        self.fights += other.fights
+        self.wins += other.wins
+        self.turns.merge(other.turns)
+        self.player_hp.merge(other.player_hp)
+        self.player_mp.merge(other.player_mp)
+
+    def win_rate(self):
+        return self.wins / self.fights if self.fights else 0.0
+
+    def win_rate_interval(self, z=1.96):
+        # wilson score interval, behaves well for win rates close to 0 or 1
+        n = self.fights
+        if n == 0:
+            return 0.0, 0.0
+        p = self.wins / n
+        centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+        half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        return centre - half, centre + half
+
+class SimulationReport:
+    def __init__(self, policy_name):
+        self.policy_name = policy_name
+        self.runs = 0
+        self.victories = 0
+        self.battles = 0
+        self.enemies = {}  # enemy name -> EnemyStats, in the order they were met
+        self.seconds = 0.0
+
+    def add_run(self, fights, cleared):
+        self.runs += 1
+        if cleared:
+            self.victories += 1
+        for name, won, turns, hp, mp in fights:
+            self.battles += 1
+            self.add_enemy(name)
+            self.enemies[name].add(won, turns, hp, mp)
+
+    def add_enemy(self, name):
+        if name not in self.enemies:
+            self.enemies[name] = EnemyStats()
+
+    def merge(self, other):
+        self.runs += other.runs
+        self.victories += other.victories
+        self.battles += other.battles
+        for name, stats in other.enemies.items():
+            self.add_enemy(name)
+            self.enemies[name].merge(stats)
+
+    def format(self):
+        lines = [f"policy {self.policy_name}: {self.runs} runs, {self.battles} battles, "
+                 f"dungeon cleared {self.victories / max(self.runs, 1):.2%}"]
+        if self.seconds > 0:
+            lines.append(f"{self.battles / self.seconds * 60:,.0f} battles per minute")
+        for name, stats in self.enemies.items():
+            low, high = stats.win_rate_interval()
+            lines.append(f"  {name}: win rate {stats.win_rate():.2%} [{low:.2%}, {high:.2%}] over {stats.fights} fights")
+            lines.append(f"    turns to kill {stats.turns.mean():.2f} +- {stats.turns.confidence():.2f}, "
+                         f"hp left {stats.player_hp.mean():.1f} +- {stats.player_hp.confidence():.1f}, "
+                         f"mp left {stats.player_mp.mean():.1f} +- {stats.player_mp.confidence():.1f}")
+        return "\n".join(lines)
+
+def _run_chunk(job):
+    # worker side, every chunk has its own seed so the result does not depend on the pool size
+    policy_name, runs, seed, rng = job
+    random.seed(seed)
+    seeds = random.Random(seed)
+    policy = POLICIES[policy_name]
+    report = SimulationReport(policy_name)
+    # "exact": a random.Random per game. other modes: one generator for the whole chunk, seeded by the chunk
+    shared = None if rng == "exact" else make_rng(rng, seed)
+    for _ in range(runs):
+        report.add_run(*run_dungeon(policy, Game(seeds.getrandbits(64), rng=shared or rng)))
+    return report
+
+def simulate(runs, policy_name="charge_cycle", workers=None, seed=0, chunk_size=CHUNK_SIZE, rng="exact"):
+    # run `runs` full dungeon runs and return the merged SimulationReport
+    if policy_name not in POLICIES:
+        raise ValueError(f"unknown policy {policy_name}, choose from {', '.join(POLICIES)}")
+    if rng not in RNG_MODES:
+        raise ValueError(f"unknown rng mode {rng}, choose from {', '.join(RNG_MODES)}")
+    seeds = random.Random(seed)
+    jobs = []
+    left = runs
+    while left > 0:
+        size = min(chunk_size, left)
+        jobs.append((policy_name, size, seeds.getrandbits(64), rng))
+        left -= size
+
+    report = SimulationReport(policy_name)
+    start = time.perf_counter()
+    if workers == 1:
+        for job in jobs:
+            report.merge(_run_chunk(job))
+    else:
+        with Pool(workers or os.cpu_count()) as pool:
+            for part in pool.imap_unordered(_run_chunk, jobs):
+                report.merge(part)
+    report.seconds = time.perf_counter() - start
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo balance simulator for Force_Grey")
+    parser.add_argument("-n", "--runs", type=int, default=10000, help="number of full dungeon runs")
+    parser.add_argument("--policy", default="all",
+                        help="policy name or 'all' (every policy but mcts, which searches for 5ms per move "
+                             "and only runs when named): " + ", ".join(POLICIES))
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default is every core")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rng", default="exact", choices=list(RNG_MODES),
+                        help="batched draws the rolls in numpy blocks, faster but not the rolls of a replay")
+    args = parser.parse_args()
+
+    names = [name for name in POLICIES if name != "mcts"] if args.policy == "all" else [args.policy]
+    for name in names:
+        print(simulate(args.runs, name, args.workers, args.seed, rng=args.rng).format())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+# exact win probability and best action for Force_Grey battles
+# expectimax over every dice roll of the engine, memoized in a bounded LRU transposition table.
+# every turn either costs mana or deals at least 1 damage, so the battle states form a DAG and
+# plain memoized recursion is exact, no value iteration needed.
+# usage: python force_grey_solver.py --hp 80 --mp 40
+import argparse
+import sys
+import time
+
+from force_grey_damage import actual_damage, physical_table, spell_table
+from force_grey_engine import BREAK, EFFECTS, SHOCK, Game, PlayerAction
+
+TABLE_SIZE = 4000000  # entries kept in the transposition table
+SHOCK_CAP = 9         # from 9 tremor stacks on every hit stuns and the stacks never drop below 9 again
+CERTAIN = 1.0 - 1e-12 # sums of probabilities can miss 1.0 by a rounding error
+SEARCH_ORDER = (PlayerAction.CHARGE, PlayerAction.ATTACK, PlayerAction.DOUBLE, PlayerAction.NORMAL,
+                PlayerAction.TREMOR, PlayerAction.RUPTURE, PlayerAction.BURN, PlayerAction.HEAL)
+
+class TranspositionTable:
+    # bounded LRU approximation with two generations: new and recently used entries live in `young`,
+    # when it is full the old generation is dropped and young becomes old. a hit in old moves the entry back
+    def __init__(self, size):
+        self.size = size
+        self.young = {}
+        self.old = {}
+
+    def get(self, key):
+        value = self.young.get(key)
+        if value is None:
+            value = self.old.pop(key, None)
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        young = self.young
+        young[key] = value
+        if len(young) >= self.size // 2:
+            self.old = young
+            self.young = {}
+
+    def __len__(self):
+        return len(self.young) + len(self.old)
+
+class BattleSolver:
+    # canonical state at the start of a player turn:
+    # (enemy position, player hp, player mp, charging, enemy hp, burn, rupture, tremor stacks capped at SHOCK_CAP)
+    # attack_count, stunned and the log do not change the outcome so they are dropped
+    def __init__(self, game=None, whole_run=False, table_size=TABLE_SIZE):
+        game = game or Game()
+        # False: chance to beat the current enemy. True: chance to clear the rest of the dungeon,
+        # much bigger because every way of entering the next fight is a new sub game
+        self.whole_run = whole_run
+        self.table = TranspositionTable(table_size)        # state -> (win probability, best action)
+        self.enemy_turns = TranspositionTable(table_size)  # state after the player's action -> win probability
+        self.reachable = TranspositionTable(table_size)    # state -> can the enemy be beaten with the best rolls
+
+        player = game.player
+        self.max_hp = player.max_hp
+        self.max_mp = player.max_magic_points
+        # strong actions first, so certain wins are found early and the search can stop
+        self.action_costs = [(action, game.action_cost(action)) for action in SEARCH_ORDER]
+        spells = game.spells
+        rules = game.rules
+        self.attack_spell = spells["attack"]
+        self.stacks = {action: spells[name].stacks for action, name in
+                       ((PlayerAction.BURN, "burn"), (PlayerAction.RUPTURE, "rupture"), (PlayerAction.TREMOR, "tremor"))}
+        self.kill_mana = rules.kill_mana
+        self.enemies = []
+        # the (probability, damage) pairs of the tables in force_grey_damage.py
+        for enemy in game.roster:
+            magic = (player.magic_power, enemy.defense, enemy.magic_resistance)
+            self.enemies.append({
+                "max_hp": enemy.max_hp,
+                "physical": {},  # (rupture bonus, stunned) -> distribution, filled on demand
+                "normal": spell_table(spells["normal"], *magic).pairs,
+                "double": spell_table(spells["double"], *magic, spells["double"].hits).pairs,
+                "charge": spell_table(spells["charge"], *magic).pairs,
+                "attack": physical_table(enemy.attack, rules.enemy_roll_low, rules.enemy_roll_high, player.defense,
+                                         player.physical_resistance).pairs,
+                "defense": enemy.defense,
+                "weakest_attack": actual_damage(enemy.attack + rules.enemy_roll_low, player.defense,
+                                                player.physical_resistance),
+                "physical_resistance": enemy.physical_resistance,
+                "player_attack": player.attack,
+            })
+        self.heal = spell_table(spells["heal"], spells["heal"].base).pairs
+
+    def state_of(self, game):
+        # canonical state of a Game waiting for the player's action
+        if game.game_state not in ("battle", "player_turn"):
+            raise ValueError(f"the game is in state {game.game_state}, the solver needs the player's turn")
+        enemy = game.current_enemy
+        return (game.enemy_index - 1, game.player.hp, game.player.magic_points, game.player.charging, enemy.hp,
+                enemy.status_stacks("burn"), enemy.status_stacks("break"), min(enemy.status_stacks("shock"), SHOCK_CAP))
+
+    def solve(self, game):
+        # (win probability, best PlayerAction) for the game's current state
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 20000))
+        try:
+            return self._value(self.state_of(game))
+        finally:
+            sys.setrecursionlimit(limit)
+
+    def win_probability(self, game):
+        return self.solve(game)[0]
+
+    def best_action(self, game):
+        return self.solve(game)[1]
+
+    def action_values(self, game):
+        # win probability of every affordable action, the best one is the max
+        state = self.state_of(game)
+        self.solve(game)
+        return {action: self._action_value(state, action, cost) for action, cost in self._actions(state)}
+
+    def _actions(self, state):
+        # (action, cost) pairs the player can afford, releasing a charge is free
+        mp, charging = state[2], state[3]
+        return [(action, cost) for action, cost in self.action_costs
+                if cost <= mp or (charging and action is PlayerAction.CHARGE)]
+
+    def _value(self, state):
+        entry = self.table.get(state)
+        if entry is not None:
+            return entry
+        if not self._can_beat(state):
+            # not even the luckiest rolls beat this enemy
+            best = (0.0, PlayerAction.ATTACK)
+        else:
+            best = (-1.0, None)
+            for action, cost in self._actions(state):
+                value = sum(p * self._after_player(*outcome) for p, outcome in self._player_outcomes(state, action, cost))
+                if value > best[0]:
+                    best = (value, action)
+                    if value >= CERTAIN:
+                        break
+        self.table.put(state, best)
+        return best
+
+    def _action_value(self, state, action, cost):
+        return sum(p * self._after_player(*outcome) for p, outcome in self._player_outcomes(state, action, cost))
+
+    def _physical_outcomes(self, enemy, bonus, stunned):
+        key = (bonus, stunned)
+        outcomes = enemy["physical"].get(key)
+        if outcomes is None:
+            # rupture adds its stacks, a tremor hit from 9 stacks stuns and doubles
+            stacks = [0] * len(EFFECTS)
+            stacks[BREAK] = bonus
+            stacks[SHOCK] = 9 if stunned else 0
+            spell = self.attack_spell
+            outcomes = physical_table(enemy["player_attack"], spell.low, spell.high, enemy["defense"],
+                                      enemy["physical_resistance"], tuple(stacks)).pairs
+            enemy["physical"][key] = outcomes
+        return outcomes
+
+    def _player_outcomes(self, state, action, cost):
+        # (probability, state after the player's action plus the stunned flag) for every distinct roll
+        index, hp, mp, charging, enemy_hp, burn, rupture, shock = state
+        enemy = self.enemies[index]
+        if action is PlayerAction.ATTACK:
+            # rupture and tremor do not depend on the roll, only the damage does
+            bonus = rupture
+            if rupture > 0:
+                rupture -= 1
+            stunned = False
+            if shock > 0:
+                shock += 1
+                stunned = shock >= 10
+            else:
+                shock = 1
+            return [(p, (index, hp, mp, charging, enemy_hp - damage, burn, rupture, shock, stunned))
+                    for p, damage in self._physical_outcomes(enemy, bonus, stunned)]
+        if action is PlayerAction.NORMAL or action is PlayerAction.DOUBLE:
+            mp -= cost
+            return [(p, (index, hp, mp, charging, enemy_hp - damage, burn, rupture, shock, False))
+                    for p, damage in enemy["normal" if action is PlayerAction.NORMAL else "double"]]
+        if action is PlayerAction.CHARGE:
+            if not charging:
+                return [(1.0, (index, hp, mp - cost, True, enemy_hp, burn, rupture, shock, False))]
+            return [(p, (index, hp, mp, False, enemy_hp - damage, burn, rupture, shock, False)) for p, damage in enemy["charge"]]
+        if action is PlayerAction.HEAL:
+            mp -= cost
+            return [(p, (index, min(self.max_hp, hp + amount), mp, charging, enemy_hp, burn, rupture, shock, False))
+                    for p, amount in self.heal]
+        mp -= cost
+        if action is PlayerAction.BURN:
+            burn += self.stacks[action]
+        elif action is PlayerAction.RUPTURE:
+            rupture += self.stacks[action]
+        else:
+            shock += self.stacks[action]
+        return [(1.0, (index, hp, mp, charging, enemy_hp, burn, rupture, shock, False))]
+
+    def _can_beat(self, state):
+        # can the current enemy be beaten at all, playing every roll in the player's favour?
+        # the battle is monotone (more player hp or less enemy hp never hurts), so if this
+        # best case loses then every real roll sequence loses too and the win probability is 0
+        result = self.reachable.get(state)
+        if result is not None:
+            return result
+        result = False
+        index, hp, mp, charging, enemy_hp, burn, rupture, shock = state
+        enemy = self.enemies[index]
+        for action, cost in self._actions(state):
+            # the luckiest roll of every action
+            next_hp, next_mp, next_charging, next_enemy_hp = hp, mp - cost, charging, enemy_hp
+            next_burn, next_rupture, next_shock, stunned = burn, rupture, shock, False
+            if action is PlayerAction.ATTACK:
+                if rupture > 0:
+                    next_rupture -= 1
+                if shock > 0:
+                    next_shock += 1
+                    stunned = next_shock >= 10
+                else:
+                    next_shock = 1
+                next_enemy_hp -= self._physical_outcomes(enemy, rupture, stunned)[-1][1]
+            elif action is PlayerAction.NORMAL:
+                next_enemy_hp -= enemy["normal"][-1][1]
+            elif action is PlayerAction.DOUBLE:
+                next_enemy_hp -= enemy["double"][-1][1]
+            elif action is PlayerAction.CHARGE:
+                if charging:
+                    next_mp = mp
+                    next_charging = False
+                    next_enemy_hp -= enemy["charge"][-1][1]
+                else:
+                    next_charging = True
+            elif action is PlayerAction.HEAL:
+                next_hp = min(self.max_hp, hp + self.heal[-1][1])
+            elif action is PlayerAction.BURN:
+                next_burn += self.stacks[action]
+            elif action is PlayerAction.RUPTURE:
+                next_rupture += self.stacks[action]
+            else:
+                next_shock += self.stacks[action]
+            # then the enemy's turn with its weakest attack
+            if next_burn > 0 and next_enemy_hp > 0:
+                next_enemy_hp -= int(enemy["max_hp"] * (next_burn * 0.01))
+                next_burn -= 1
+            if next_enemy_hp <= 0:
+                result = True
+                break
+            if stunned:
+                if next_shock > 0:
+                    next_shock -= 1
+            else:
+                next_hp -= enemy["weakest_attack"]
+                if next_hp <= 0:
+                    continue
+            if self._can_beat((index, next_hp, next_mp, next_charging, next_enemy_hp, next_burn, next_rupture,
+                               min(next_shock, SHOCK_CAP))):
+                result = True
+                break
+        self.reachable.put(state, result)
+        return result
+
+    def _after_player(self, index, hp, mp, charging, enemy_hp, burn, rupture, shock, stunned):
+        # expected value after the player's action: kill check, burn, then the enemy's attack.
+        # many actions and rolls end in the same state, so these are cached too
+        if enemy_hp <= 0:
+            return self._kill_value(index, hp, mp, charging)
+        key = (index, hp, mp, charging, enemy_hp, burn, rupture, shock, stunned)
+        total = self.enemy_turns.get(key)
+        if total is not None:
+            return total
+        enemy = self.enemies[index]
+        if burn > 0:
+            enemy_hp -= int(enemy["max_hp"] * (burn * 0.01))
+            burn -= 1
+        if enemy_hp <= 0:
+            total = self._kill_value(index, hp, mp, charging)
+        elif stunned:
+            if shock > 0:
+                shock -= 1
+            total = self._value((index, hp, mp, charging, enemy_hp, burn, rupture, min(shock, SHOCK_CAP)))[0]
+        else:
+            shock = min(shock, SHOCK_CAP)
+            total = 0.0
+            for p, damage in enemy["attack"]:
+                if hp > damage:
+                    total += p * self._value((index, hp - damage, mp, charging, enemy_hp, burn, rupture, shock))[0]
+        self.enemy_turns.put(key, total)
+        return total
+
+    def _kill_value(self, index, hp, mp, charging):
+        index += 1
+        if not self.whole_run or index >= len(self.enemies):
+            return 1.0
+        mp = min(self.max_mp, mp + self.kill_mana)
+        return self._value((index, hp, mp, charging, self.enemies[index]["max_hp"], 0, 0, 0))[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="exact win probabilities for Force_Grey")
+    parser.add_argument("--hp", type=int, default=None, help="player hp when meeting each enemy, default full")
+    parser.add_argument("--mp", type=int, default=None, help="player mp when meeting each enemy, default full")
+    parser.add_argument("--whole-run", action="store_true", help="chance to clear the rest of the dungeon instead of one fight")
+    args = parser.parse_args()
+
+    solver = BattleSolver(whole_run=args.whole_run)
+    for position in range(len(Game().roster)):
+        game = Game()
+        while game.enemy_index <= position:
+            game.new_enemy()
+        if args.hp is not None:
+            game.player.hp = args.hp
+        if args.mp is not None:
+            game.player.magic_points = args.mp
+        start = time.perf_counter()
+        probability, action = solver.solve(game)
+        print(f"{game.current_enemy.name}: win probability {probability:.6f}, best action {action.name}, "
+              f"{time.perf_counter() - start:.2f}s, {len(solver.table)} states")
+
+if __name__ == "__main__":
+    main()
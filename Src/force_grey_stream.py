@@ -0,0 +1,294 @@
+# streaming simulation output for Force_Grey, for runs far too big to keep in lists
+# worker processes play dungeon runs and turn every turn and every battle into a record as it happens. the records
+# go through a chain of generators (records -> numpy batches -> bounded queue -> fixed size chunks -> files), so
+# memory stays at a few batches whatever the number of runs. the queue between the workers and the writer is
+# bounded: when the disk falls behind, the workers wait instead of piling up results.
+# the output is columnar: every chunk is a directory with one .npy file per field, plus manifest.json. analysis
+# memory-maps the columns it needs one chunk at a time.
+# usage: python force_grey_stream.py run -n 1000000 --policy expected --out runs
+#        python force_grey_stream.py analyze runs
+import argparse
+import json
+import os
+import queue as queues
+import random
+import shutil
+import time
+from multiprocessing import get_context
+
+import numpy as np
+
+from force_grey_engine import EFFECT_NAMES, Game, PlayerAction
+from force_grey_rng import RNG_MODES, make_rng
+from force_grey_sim import MAX_TURNS, POLICIES, play_turn
+
+OUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runs")
+BATCH_ROWS = 16384     # records a worker packs into one numpy batch before handing it on
+CHUNK_ROWS = 1 << 18   # rows per chunk on disk, about 12MB of turns
+QUEUE_BATCHES = 4      # batches waiting per worker, the workers block when the queue is full
+RUNS_PER_JOB = 2000    # runs with one seed, so the output does not depend on the number of workers
+
+# outcome of a turn
+ONGOING, BEATEN, DIED = range(3)
+
+# one row per player turn: what was done and the state after the enemy's answer
+TURN_DTYPE = np.dtype([
+    ("run", np.uint64), ("enemy", np.uint8), ("turn", np.uint16), ("action", np.uint8),
+    ("damage", np.int32),         # enemy hp lost this turn, the burn at the start of its turn included
+    ("damage_taken", np.int32),   # player hp lost to the enemy's attack
+    ("player_hp", np.int32), ("player_mp", np.int32), ("enemy_hp", np.int32),
+    ("stacks", np.uint16, (len(EFFECT_NAMES),)),  # enemy effect stacks after the turn, in effect slot order
+    ("outcome", np.uint8),
+])
+# one row per battle
+BATTLE_DTYPE = np.dtype([
+    ("run", np.uint64), ("seed", np.uint64), ("enemy", np.uint8), ("won", np.bool_), ("turns", np.uint16),
+    ("player_hp", np.int32), ("player_mp", np.int32),
+])
+DTYPES = {"turns": TURN_DTYPE, "battles": BATTLE_DTYPE}
+
+# worker side
+def run_records(policy, run, seed, rng="exact"):
+    # ("turns", row) for every turn and ("battles", row) for every battle of one dungeon run, like run_dungeon()
+    game = Game(seed, rng=rng)
+    position = 0
+    turn = 0  # of the current battle
+    enemy = game.current_enemy
+    player = game.player
+    while turn < MAX_TURNS:
+        if game.game_state == "battle":
+            game.game_state = "player_turn"
+            continue
+        if game.game_state != "player_turn":
+            break
+        enemy_hp, player_hp = enemy.hp, player.hp
+        action = policy(game)
+        play_turn(game, action)
+        turn += 1
+        outcome = BEATEN if not enemy.is_alive() else DIED if not player.is_alive() else ONGOING
+        yield "turns", (run, position, turn, game.action_log[-1], enemy_hp - enemy.hp, player_hp - player.hp,
+                        player.hp, player.magic_points, enemy.hp, tuple(enemy.effect_stacks), outcome)
+        if outcome != ONGOING:
+            yield "battles", (run, seed, position, outcome == BEATEN, turn, player.hp, player.magic_points)
+            if outcome == DIED:
+                break
+            enemy = game.current_enemy
+            position += 1
+            turn = 0
+
+def job_records(policy, first_run, runs, seed, rng="exact"):
+    # the records of `runs` runs, every run with its own seed drawn from the job's seed.
+    # with a mode other than "exact" the runs of the job share one generator seeded by the job
+    seeds = random.Random(seed)
+    shared = None if rng == "exact" else make_rng(rng, seed)
+    for run in range(first_run, first_run + runs):
+        yield from run_records(policy, run, seeds.getrandbits(64), shared or rng)
+
+def batches(records, rows=BATCH_ROWS):
+    # (table, structured array) batches of at most `rows` records per table
+    pending = {table: [] for table in DTYPES}
+    for table, record in records:
+        rows_of_table = pending[table]
+        rows_of_table.append(record)
+        if len(rows_of_table) >= rows:
+            yield table, np.array(rows_of_table, dtype=DTYPES[table])
+            rows_of_table.clear()
+    for table, rows_of_table in pending.items():
+        if rows_of_table:
+            yield table, np.array(rows_of_table, dtype=DTYPES[table])
+
+def _worker(queue, policy_name, jobs, rng):
+    # puts every batch of its jobs on the queue, then None. put() blocks while the queue is full.
+    # None also follows an exception so the writer does not wait for it, the exit code tells the run failed
+    policy = POLICIES[policy_name]
+    try:
+        for first_run, runs, seed in jobs:
+            for batch in batches(job_records(policy, first_run, runs, seed, rng)):
+                queue.put(batch)
+    finally:
+        queue.put(None)
+
+# writer side
+def from_queue(queue, workers, processes=()):
+    # the batches of every worker until all of them are done. a worker that died without its None (killed,
+    # out of memory) raises instead of waiting for it forever
+    done = 0
+    while done < workers:
+        try:
+            batch = queue.get(timeout=1.0)
+        except queues.Empty:
+            for process in processes:
+                if process.exitcode:
+                    raise RuntimeError(f"worker {process.name} stopped with exit code {process.exitcode}") from None
+            continue
+        if batch is None:
+            done += 1
+        else:
+            yield batch
+
+def chunks(batches, rows=CHUNK_ROWS):
+    # (table, array of `rows` records) chunks out of the batches, the last one of a table may be shorter
+    pending = {table: [] for table in DTYPES}
+    counts = dict.fromkeys(DTYPES, 0)
+    for table, batch in batches:
+        pending[table].append(batch)
+        counts[table] += len(batch)
+        while counts[table] >= rows:
+            joined = np.concatenate(pending[table])
+            yield table, joined[:rows]
+            pending[table] = [joined[rows:]]
+            counts[table] -= rows
+    for table, parts in pending.items():
+        if counts[table]:
+            yield table, np.concatenate(parts)
+
+class ChunkWriter:
+    # writes chunks as out/<table>/<number>/<field>.npy, manifest.json last so a half written store is not read
+    def __init__(self, directory, policy_name, runs, seed, rng="exact"):
+        self.directory = directory
+        self.manifest = {"policy": policy_name, "runs": runs, "seed": seed, "rng": rng, "effects": list(EFFECT_NAMES),
+                         "fields": {table: list(dtype.names) for table, dtype in DTYPES.items()},
+                         "chunks": {table: [] for table in DTYPES}}
+        if os.path.exists(directory):
+            # only an earlier store is replaced, a mistyped --out must not delete anything else
+            if not os.path.isdir(directory):
+                raise ValueError(f"{directory} is a file, not a store directory")
+            if os.listdir(directory) and not os.path.exists(os.path.join(directory, "manifest.json")):
+                raise ValueError(f"{directory} is not empty and not a store (no manifest.json), "
+                                 f"remove it yourself or pick another directory")
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+
+    def write(self, table, chunk):
+        number = len(self.manifest["chunks"][table])
+        path = os.path.join(self.directory, table, f"{number:06}")
+        os.makedirs(path)
+        for field in chunk.dtype.names:
+            np.save(os.path.join(path, field + ".npy"), np.ascontiguousarray(chunk[field]))
+        self.manifest["chunks"][table].append(len(chunk))
+
+    def close(self):
+        with open(os.path.join(self.directory, "manifest.json"), "w") as file:
+            json.dump(self.manifest, file, indent=1)
+
+def _jobs(runs, seed):
+    seeds = random.Random(seed)
+    jobs = []
+    for first_run in range(0, runs, RUNS_PER_JOB):
+        jobs.append((first_run, min(RUNS_PER_JOB, runs - first_run), seeds.getrandbits(64)))
+    return jobs
+
+def stream(runs, policy_name="charge_cycle", directory=OUT_DIR, workers=None, seed=0, rng="exact"):
+    # play `runs` dungeon runs into a column store at directory, returns (turn rows, battle rows, seconds)
+    if policy_name not in POLICIES:
+        raise ValueError(f"unknown policy {policy_name}, choose from {', '.join(POLICIES)}")
+    if rng not in RNG_MODES:
+        raise ValueError(f"unknown rng mode {rng}, choose from {', '.join(RNG_MODES)}")
+    workers = workers or os.cpu_count()
+    jobs = _jobs(runs, seed)
+    writer = ChunkWriter(directory, policy_name, runs, seed, rng)
+    start = time.perf_counter()
+    context = get_context("spawn" if os.name == "nt" else "fork")
+    queue = context.Queue(QUEUE_BATCHES * workers)
+    processes = [context.Process(target=_worker, args=(queue, policy_name, jobs[index::workers], rng), daemon=True)
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for table, chunk in chunks(from_queue(queue, workers, processes)):
+            writer.write(table, chunk)
+    except BaseException:
+        # the workers may be blocked on a full queue that nobody reads anymore
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+    failed = [process for process in processes if process.exitcode]
+    if failed:
+        # no manifest: the store is incomplete and analyze() will not read it
+        raise RuntimeError(f"{len(failed)} worker(s) failed (exit codes "
+                           f"{', '.join(str(process.exitcode) for process in failed)}), the store at {directory} is incomplete")
+    writer.close()
+    chunks_written = writer.manifest["chunks"]
+    return sum(chunks_written["turns"]), sum(chunks_written["battles"]), time.perf_counter() - start
+
+# analysis
+def load_manifest(directory):
+    with open(os.path.join(directory, "manifest.json")) as file:
+        return json.load(file)
+
+def columns(directory, table, fields):
+    # {field: memory-mapped array} for every chunk of the table, only the pages that are read are loaded
+    manifest = load_manifest(directory)
+    for number in range(len(manifest["chunks"][table])):
+        path = os.path.join(directory, table, f"{number:06}")
+        yield {field: np.load(os.path.join(path, field + ".npy"), mmap_mode="r") for field in fields}
+
+def analyze(directory):
+    # per enemy: battles, wins and turns to kill. per enemy and action: turns played and damage dealt
+    manifest = load_manifest(directory)
+    enemies = len(Game(0).roster)
+    actions = max(action.value for action in PlayerAction) + 1
+    fights = np.zeros(enemies, dtype=np.int64)
+    wins = np.zeros(enemies, dtype=np.int64)
+    kill_turns = np.zeros(enemies, dtype=np.int64)
+    for chunk in columns(directory, "battles", ("enemy", "won", "turns")):
+        enemy = chunk["enemy"]
+        won = chunk["won"]
+        fights += np.bincount(enemy, minlength=enemies)
+        wins += np.bincount(enemy, weights=won, minlength=enemies).astype(np.int64)
+        kill_turns += np.bincount(enemy, weights=chunk["turns"] * won, minlength=enemies).astype(np.int64)
+    played = np.zeros((enemies, actions), dtype=np.int64)
+    damage = np.zeros((enemies, actions), dtype=np.int64)
+    for chunk in columns(directory, "turns", ("enemy", "action", "damage")):
+        cell = chunk["enemy"].astype(np.int64) * actions + chunk["action"]
+        played += np.bincount(cell, minlength=enemies * actions).reshape(enemies, actions)
+        damage += np.bincount(cell, weights=chunk["damage"], minlength=enemies * actions).astype(np.int64).reshape(
+            enemies, actions)
+    return {"manifest": manifest, "fights": fights, "wins": wins, "kill_turns": kill_turns, "played": played,
+            "damage": damage}
+
+def format_analysis(result):
+    manifest = result["manifest"]
+    roster = Game(0).roster
+    lines = [f"policy {manifest['policy']}: {manifest['runs']} runs, {sum(manifest['chunks']['battles'])} battles, "
+             f"{sum(manifest['chunks']['turns'])} turns, dungeon cleared {result['wins'][-1] / max(manifest['runs'], 1):.2%}"]
+    for position, fights in enumerate(result["fights"]):
+        if not fights:
+            continue
+        wins = result["wins"][position]
+        lines.append(f"  {roster[position].name}: win rate {wins / fights:.2%} over {fights} fights, "
+                     f"turns to kill {result['kill_turns'][position] / max(wins, 1):.2f}")
+        for action in PlayerAction:
+            played = result["played"][position, action.value]
+            if played:
+                lines.append(f"    {action.name:7} {played:10} turns, {result['damage'][position, action.value] / played:6.2f} "
+                             f"damage per turn")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="stream Force_Grey simulation records into a columnar store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="simulate and write the store")
+    run_parser.add_argument("-n", "--runs", type=int, default=100000, help="number of full dungeon runs")
+    run_parser.add_argument("--policy", default="charge_cycle", help=", ".join(POLICIES))
+    run_parser.add_argument("--out", default=OUT_DIR, help="directory of the store, an earlier store there is replaced")
+    run_parser.add_argument("--workers", type=int, default=None, help="worker processes, default is every core")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--rng", default="exact", choices=list(RNG_MODES),
+                            help="batched is faster, the seed column then no longer replays a battle on its own")
+    analyze_parser = commands.add_parser("analyze", help="aggregate a store without loading it")
+    analyze_parser.add_argument("directory", nargs="?", default=OUT_DIR)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        turns, battles, seconds = stream(args.runs, args.policy, args.out, args.workers, args.seed, args.rng)
+        print(f"{args.runs} runs, {battles} battles, {turns} turns in {seconds:.2f}s "
+              f"({turns / seconds:,.0f} turns per second) -> {args.out}")
+    else:
+        print(format_analysis(analyze(args.directory)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+# balance sweep and auto-tuner for Force_Grey
+# a spec file names the numbers to search (enemy stats, spell costs and multipliers, rules) with the values to try,
+# and the win rate and turns to kill wanted for each enemy. every candidate is the content file with those numbers
+# changed, played with a simulator policy over a process pool in rounds. after each round a candidate whose
+# confidence interval is already clearly away from a target is dropped, the others play on up to --max-runs.
+# every candidate plays the same seeds (chunk n of a policy has one seed), so two configs differ by their numbers and
+# not by their luck, and the tuner only moves when the new score is better by more than both confidence intervals.
+# results are kept per candidate in --cache (one json file per config hash), so a rerun only plays what is missing,
+# and a higher --max-runs plays on from there.
+# usage: python force_grey_tune.py force_grey_tune.json                 every combination of the values
+#        python force_grey_tune.py force_grey_tune.json --tune          walk from the current numbers to the best
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+
+from force_grey_content import SOURCE_PATH, compile_content
+from force_grey_engine import Game
+from force_grey_sim import POLICIES, EnemyStats, RunningStat, SimulationReport, run_dungeon
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tune_cache")
+CHUNK_SIZE = 250  # runs in one pool job, the seeds of a chunk depend only on the policy and the chunk number
+CACHE_VERSION = 2  # part of the config hash, results played with the seeds of older versions are not reused
+
+def _load_source():
+    with open(SOURCE_PATH, encoding="utf-8") as file:
+        return json.load(file)
+
+def apply_overrides(source, overrides):
+    # copy of the parsed content file with the "section.name.field" numbers of overrides replaced
+    source = copy.deepcopy(source)
+    for path, value in overrides.items():
+        keys = path.split(".")
+        table = source
+        for key in keys[:-1]:
+            if key not in table:
+                raise ValueError(f"{path}: there is no {key} in the content file")
+            table = table[key]
+        table[keys[-1]] = value
+    return source
+
+def config_key(source, overrides, policy_name):
+    # hash of everything that decides the result: the content file, the changed numbers and the policy
+    text = json.dumps([CACHE_VERSION, source, sorted(overrides.items()), policy_name], sort_keys=True)
+    return hashlib.blake2b(text.encode(), digest_size=10).hexdigest()
+
+def _chunk_seed(policy_name, chunk):
+    # the same for every config: common random numbers, the difference of two scores is mostly the change
+    return int.from_bytes(hashlib.blake2b(f"{policy_name}:{chunk}".encode(), digest_size=8).digest(), "little")
+
+_contents = {}  # config key -> compiled Content, per worker process
+
+def _run_chunk(job):
+    key, source, overrides, policy_name, chunk = job
+    content = _contents.get(key)
+    if content is None:
+        content = _contents[key] = compile_content(apply_overrides(source, overrides))
+    seed = _chunk_seed(policy_name, chunk)
+    random.seed(seed)
+    seeds = random.Random(seed)
+    policy = POLICIES[policy_name]
+    report = SimulationReport(policy_name)
+    for _ in range(CHUNK_SIZE):
+        report.add_run(*run_dungeon(policy, Game(seeds.getrandbits(64), content)))
+    return key, report
+
+# cache files: the json form of a SimulationReport plus the status of the candidate
+def _stat_to_list(stat):
+    return [stat.n, stat.total, stat.total_sq]
+
+def _stat_from_list(values):
+    stat = RunningStat()
+    stat.n, stat.total, stat.total_sq = values
+    return stat
+
+def report_to_dict(report):
+    return {"policy": report.policy_name, "runs": report.runs, "victories": report.victories, "battles": report.battles,
+            "enemies": {name: {"fights": stats.fights, "wins": stats.wins, "turns": _stat_to_list(stats.turns),
+                               "player_hp": _stat_to_list(stats.player_hp), "player_mp": _stat_to_list(stats.player_mp)}
+                        for name, stats in report.enemies.items()}}
+
+def report_from_dict(data):
+    report = SimulationReport(data["policy"])
+    report.runs, report.victories, report.battles = data["runs"], data["victories"], data["battles"]
+    for name, values in data["enemies"].items():
+        stats = report.enemies[name] = EnemyStats()
+        stats.fights, stats.wins = values["fights"], values["wins"]
+        stats.turns = _stat_from_list(values["turns"])
+        stats.player_hp = _stat_from_list(values["player_hp"])
+        stats.player_mp = _stat_from_list(values["player_mp"])
+    return report
+
+class Candidate:
+    def __init__(self, overrides, key, report=None, status="running"):
+        self.overrides = overrides
+        self.key = key
+        self.report = report or SimulationReport("")
+        self.status = status  # running, rejected (clearly off a target) or done (played --max-runs)
+        self.score = None
+        self.score_interval = None  # (low, high) the score can be given the confidence intervals of the numbers
+
+class Tuner:
+    def __init__(self, spec, max_runs=5000, round_runs=1000, min_fights=200, workers=None, cache_dir=CACHE_DIR):
+        self.policy_name = spec.get("policy", "charge_cycle")
+        if self.policy_name not in POLICIES:
+            raise ValueError(f"unknown policy {self.policy_name}, choose from {', '.join(POLICIES)}")
+        self.params = {path: list(values) for path, values in spec["params"].items()}
+        self.targets = spec["targets"]
+        self.win_tolerance = spec.get("win_tolerance", 0.05)
+        self.turn_tolerance = spec.get("turn_tolerance", 1.0)
+        self.max_runs = max_runs
+        self.round_runs = max(CHUNK_SIZE, round_runs // CHUNK_SIZE * CHUNK_SIZE)
+        self.min_fights = min_fights
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.source = _load_source()
+        apply_overrides(self.source, {path: values[0] for path, values in self.params.items()})  # check the paths
+        self.battles = 0  # played by this run, not counting the cache
+
+    def candidate(self, overrides):
+        key = config_key(self.source, overrides, self.policy_name)
+        path = os.path.join(self.cache_dir, key + ".json")
+        try:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+            report, status = report_from_dict(data["report"]), data["status"]
+        except (OSError, ValueError, KeyError):
+            return Candidate(overrides, key, SimulationReport(self.policy_name))
+        if status == "done" and report.runs < self.max_runs:
+            status = "running"  # --max-runs went up since, play on from the cached runs
+        return Candidate(overrides, key, report, status)
+
+    def _save(self, candidate):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, candidate.key + ".json")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({"overrides": candidate.overrides, "status": candidate.status,
+                       "report": report_to_dict(candidate.report)}, file)
+        os.replace(temporary, path)
+
+    def _clearly_off(self, report):
+        # True when a target is outside the confidence interval by more than the tolerance
+        for name, target in self.targets.items():
+            stats = report.enemies.get(name)
+            if stats is None or stats.fights < self.min_fights:
+                continue
+            if "win_rate" in target:
+                low, high = stats.win_rate_interval()
+                if high < target["win_rate"] - self.win_tolerance or low > target["win_rate"] + self.win_tolerance:
+                    return True
+            if "turns" in target and stats.turns.n >= 2:
+                mean, half = stats.turns.mean(), stats.turns.confidence()
+                if mean + half < target["turns"] - self.turn_tolerance or mean - half > target["turns"] + self.turn_tolerance:
+                    return True
+        return False
+
+    def score(self, report):
+        # squared distance to the targets in units of the tolerances, lower is better
+        return self._score(report)[0]
+
+    def _score(self, report):
+        # (score, lowest, highest): the score, and the range it takes over the confidence intervals of the win rates
+        # and mean turns
+        total = low = high = 0.0
+        def add(value, interval_low, interval_high, target, tolerance):
+            nonlocal total, low, high
+            total += ((value - target) / tolerance) ** 2
+            nearest = min(max(target, interval_low), interval_high)
+            farthest = max(abs(interval_low - target), abs(interval_high - target))
+            low += ((nearest - target) / tolerance) ** 2
+            high += (farthest / tolerance) ** 2
+        for name, target in self.targets.items():
+            stats = report.enemies.get(name) or EnemyStats()
+            if "win_rate" in target:
+                add(stats.win_rate(), *stats.win_rate_interval(), target["win_rate"], self.win_tolerance)
+            if "turns" in target:
+                if stats.turns.n:
+                    mean, half = stats.turns.mean(), stats.turns.confidence()
+                    add(mean, mean - half, mean + half, target["turns"], self.turn_tolerance)
+                else:
+                    turns = target["turns"] + 10 * self.turn_tolerance
+                    add(turns, turns, turns, target["turns"], self.turn_tolerance)
+        return total, low, high
+
+    def evaluate(self, configs):
+        # play every config (a dict of overrides) until it is rejected or done, all of them share one pool.
+        # returns the Candidates, scored
+        candidates = {}
+        for overrides in configs:
+            candidate = self.candidate(overrides)
+            candidates[candidate.key] = candidate
+        pool = self._pool()
+        try:
+            while True:
+                running = [candidate for candidate in candidates.values() if candidate.status == "running"]
+                if not running:
+                    break
+                self._play_round(pool, running)
+                for candidate in running:
+                    if self._clearly_off(candidate.report):
+                        candidate.status = "rejected"
+                    elif candidate.report.runs >= self.max_runs:
+                        candidate.status = "done"
+                    self._save(candidate)
+        finally:
+            _close(pool)
+        for candidate in candidates.values():
+            self._rescore(candidate)
+        return list(candidates.values())
+
+    def _pool(self):
+        return Pool(self.workers or os.cpu_count()) if self.workers != 1 else None
+
+    def _play_round(self, pool, candidates):
+        # up to round_runs more runs of every candidate, merged into their reports
+        by_key = {candidate.key: candidate for candidate in candidates}
+        jobs = []
+        for candidate in candidates:
+            first = candidate.report.runs // CHUNK_SIZE
+            count = min(self.round_runs, self.max_runs - candidate.report.runs) // CHUNK_SIZE
+            jobs += [(candidate.key, self.source, candidate.overrides, self.policy_name, chunk)
+                     for chunk in range(first, first + max(count, 1))]
+        results = pool.imap_unordered(_run_chunk, jobs) if pool else map(_run_chunk, jobs)
+        for key, report in results:
+            by_key[key].report.merge(report)
+            self.battles += report.battles
+
+    def _rescore(self, candidate):
+        candidate.score, *candidate.score_interval = self._score(candidate.report)
+
+    def refine(self, candidate, best):
+        # two candidates whose score intervals overlap (dropped ones stop after a round or two) play on, up to
+        # --max-runs, until one of them is clearly better or there are no runs left. the status stays as it is
+        pool = self._pool()
+        try:
+            while not _clearly_better(candidate, best) and not _clearly_better(best, candidate):
+                short = [each for each in (candidate, best) if each.report.runs < self.max_runs]
+                if not short:
+                    break
+                self._play_round(pool, short)
+                for each in short:
+                    self._save(each)
+                    self._rescore(each)
+        finally:
+            _close(pool)
+
+    def sweep(self):
+        # every combination of the values, best first
+        paths = list(self.params)
+        configs = [dict(zip(paths, values)) for values in itertools.product(*self.params.values())]
+        return sorted(self.evaluate(configs), key=_rank)
+
+    def tune(self, start=None):
+        # coordinate search: from start (the values closest to the content file by default) try the next value
+        # up and down of every number, move to the best neighbour while it is clearly better than the current
+        # config (see _clearly_better), a difference inside the noise of the runs is no reason to move.
+        # returns the path walked, the last Candidate is the best found
+        current = start or {path: _closest(values, _lookup(self.source, path)) for path, values in self.params.items()}
+        best = self.evaluate([current])[0]
+        walked = [best]
+        while True:
+            neighbours = []
+            for path, values in self.params.items():
+                index = values.index(current[path])
+                for step in (-1, 1):
+                    if 0 <= index + step < len(values):
+                        neighbours.append(dict(current, **{path: values[index + step]}))
+            candidates = sorted(self.evaluate(neighbours), key=_rank)
+            if candidates and candidates[0].score < best.score:
+                self.refine(candidates[0], best)
+            if not candidates or not _clearly_better(candidates[0], best):
+                return walked
+            best = candidates[0]
+            current = best.overrides
+            walked.append(best)
+
+def _close(pool):
+    if pool:
+        pool.close()
+        pool.join()
+
+def _rank(candidate):
+    # rejected candidates after the others, then by score
+    return (candidate.status == "rejected", candidate.score)
+
+def _clearly_better(candidate, best):
+    # a candidate that is not dropped beats a dropped one and the other way round. otherwise the improvement must be
+    # larger than the combined confidence interval of the two scores (half widths added like the errors of a
+    # difference). numbers the policy never uses give the same runs with the shared seeds, so no improvement at all
+    if (candidate.status == "rejected") != (best.status == "rejected"):
+        return best.status == "rejected"
+    half = math.hypot((candidate.score_interval[1] - candidate.score_interval[0]) / 2,
+                      (best.score_interval[1] - best.score_interval[0]) / 2)
+    return best.score - candidate.score > half
+
+def _lookup(source, path):
+    value = source
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+def _closest(values, current):
+    if current is None:
+        return values[len(values) // 2]
+    return min(values, key=lambda value: abs(value - current))
+
+def describe(tuner, candidate):
+    report = candidate.report
+    low, high = candidate.score_interval
+    lines = [f"score {candidate.score:.2f} [{low:.2f}, {high:.2f}] ({candidate.status}, {report.runs} runs): "
+             + ", ".join(f"{path}={value}" for path, value in candidate.overrides.items())]
+    for name, target in tuner.targets.items():
+        stats = report.enemies.get(name) or EnemyStats()
+        wanted = ", ".join(f"{key} {value}" for key, value in target.items())
+        lines.append(f"    {name}: win rate {stats.win_rate():.2%}, turns {stats.turns.mean():.2f} (wanted {wanted})")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="parameter sweep and auto-tuner for the Force_Grey balance")
+    parser.add_argument("spec", help="json file with policy, targets and params, see force_grey_tune.json")
+    parser.add_argument("--tune", action="store_true", help="coordinate search instead of trying every combination")
+    parser.add_argument("--max-runs", type=int, default=5000, help="dungeon runs for a candidate that is never dropped")
+    parser.add_argument("--round", type=int, default=1000, help="runs per candidate between two early stopping checks")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default is every core")
+    parser.add_argument("--cache", default=CACHE_DIR)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.spec, encoding="utf-8") as file:
+        spec = json.load(file)
+    tuner = Tuner(spec, args.max_runs, args.round, workers=args.workers, cache_dir=args.cache)
+    start = time.perf_counter()
+    if args.tune:
+        walked = tuner.tune()
+        for step, candidate in enumerate(walked):
+            print(f"step {step}: " + describe(tuner, candidate))
+    else:
+        ranked = tuner.sweep()
+        rejected = sum(candidate.status == "rejected" for candidate in ranked)
+        print(f"{len(ranked)} configs, {rejected} dropped early")
+        for candidate in ranked[:args.top]:
+            print(describe(tuner, candidate))
+    seconds = time.perf_counter() - start
+    print(f"{tuner.battles} new battles in {seconds:.1f}s ({tuner.battles / max(seconds, 1e-9):,.0f} per second)")
+
+if __name__ == "__main__":
+    main()